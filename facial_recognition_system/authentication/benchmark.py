@@ -0,0 +1,153 @@
+"""
+Offline benchmark of the register/, authenticate/ and users/ endpoints.
+
+For each gallery size a synthetic gallery of random 128-d embeddings (and
+random image hashes) is inserted, then each scenario sends requests through the
+full Django stack in-process with the test client, so no server or network is
+involved. Request latency is measured end to end; per-stage latency is read from
+the ``Server-Timing`` header (see ``metrics.py``). Results are plain dicts ready
+for JSON, and ``compare()`` flags scenarios whose median latency regressed
+against an earlier run.
+"""
+import base64
+import os
+import platform
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.test import Client
+
+from .gallery import get_gallery
+from .hash_index import get_hash_index
+from .models import User, embedding_to_bytes
+
+SCENARIOS = ('register', 'authenticate', 'authenticate_cached', 'list')
+INSERT_BATCH_SIZE = 10000
+SAMPLE_USER = 'bench-sample'
+
+
+def build_gallery(size, seed=0):
+    """Replace all users with ``size`` synthetic members; returns seconds spent loading the in-memory gallery."""
+    User.objects.all().delete()
+    rng = np.random.default_rng(seed)
+    for start in range(0, size, INSERT_BATCH_SIZE):
+        count = min(INSERT_BATCH_SIZE, size - start)
+        vectors = rng.normal(scale=0.1, size=(count, 128)).astype(np.float32)
+        hashes = rng.integers(0, 2 ** 63, size=count, dtype=np.int64)
+        User.objects.bulk_create(
+            User(unique_id=f'bench-{start + i}', name=f'Bench {start + i}', face_embedding=embedding_to_bytes(vector),
+                 image_hash=f'{int(image_hash):016x}')
+            for i, (vector, image_hash) in enumerate(zip(vectors, hashes))
+        )
+    get_gallery().invalidate()
+    get_hash_index().invalidate()
+    caches['face_probes'].clear()
+    start = time.perf_counter()
+    get_gallery().ensure_loaded()
+    get_hash_index().ensure_loaded()
+    return time.perf_counter() - start
+
+
+def _stages(response):
+    header = response.get('Server-Timing', '')
+    for entry in filter(None, header.split(', ')):
+        name, _, duration = entry.partition(';dur=')
+        if name != 'total':
+            yield name, float(duration) / 1000
+
+
+def _summary(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {'p50_ms': round(float(np.percentile(ms, 50)), 3), 'p99_ms': round(float(np.percentile(ms, 99)), 3)}
+
+
+def _run(send, iterations, warmup, expected_status):
+    """Call ``send(i)`` ``warmup`` + ``iterations`` times and summarise the timed calls."""
+    for i in range(warmup):
+        send(-1 - i)
+    latencies, stages, errors = [], {}, 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        start = time.perf_counter()
+        response = send(i)
+        latencies.append(time.perf_counter() - start)
+        errors += response.status_code != expected_status
+        for name, seconds in _stages(response):
+            stages.setdefault(name, []).append(seconds)
+    elapsed = time.perf_counter() - started
+    result = {'requests': iterations, 'errors': errors, **_summary(latencies),
+              'mean_ms': round(float(np.mean(latencies)) * 1000, 3),
+              'requests_per_second': round(iterations / elapsed, 2)}
+    result['stages'] = {name: _summary(values) for name, values in sorted(stages.items())}
+    return result
+
+
+def run_scenarios(image_bytes, iterations, warmup=2, scenarios=SCENARIOS):
+    """Run the benchmark scenarios against the current gallery; returns {scenario: summary}."""
+    client = Client()
+    face_image = base64.b64encode(image_bytes).decode()
+    results = {}
+
+    def register(i):
+        response = client.post('/api/authentication/register/',
+                               {'unique_id': f'bench-reg-{i}', 'name': 'Bench', 'face_image': face_image},
+                               content_type='application/json')
+        # Untimed clean-up, so the next request is not rejected as a duplicate.
+        User.objects.filter(unique_id=f'bench-reg-{i}').delete()
+        return response
+
+    def authenticate(cached):
+        def send(i):
+            if not cached:
+                caches['face_probes'].clear()
+            return client.post('/api/authentication/authenticate/', {'face_image': face_image},
+                               content_type='application/json')
+        return send
+
+    def list_users(i):
+        return client.get('/api/authentication/users/', {'limit': 100})
+
+    if 'register' in scenarios:
+        results['register'] = _run(register, iterations, warmup, 201)
+    if {'authenticate', 'authenticate_cached'} & set(scenarios):
+        response = client.post('/api/authentication/register/',
+                               {'unique_id': SAMPLE_USER, 'name': 'Bench', 'face_image': face_image},
+                               content_type='application/json')
+        if response.status_code != 201:
+            raise ValueError(f"Sample image could not be registered: {response.json().get('message')}")
+        for cached in (False, True):
+            name = 'authenticate_cached' if cached else 'authenticate'
+            if name in scenarios:
+                results[name] = _run(authenticate(cached), iterations, warmup, 200)
+    if 'list' in scenarios:
+        results['list'] = _run(list_users, iterations, warmup, 200)
+    return results
+
+
+def environment():
+    """What the numbers depend on, recorded next to them."""
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'index_backend': settings.FACE_INDEX_BACKEND,
+        'engine_workers': settings.FACE_ENGINE_WORKERS,
+        'detect_max_side': settings.FACE_DETECT_MAX_SIDE,
+        'decode_max_side': settings.FACE_DECODE_MAX_SIDE,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return messages for every (gallery size, scenario) whose p50 is over ``tolerance`` slower than in ``baseline``."""
+    before = {(run['gallery_size'], name): summary['p50_ms']
+              for run in baseline.get('runs', []) for name, summary in run['scenarios'].items()}
+    regressions = []
+    for run in results['runs']:
+        for name, summary in run['scenarios'].items():
+            old = before.get((run['gallery_size'], name))
+            if old and summary['p50_ms'] > old * (1 + tolerance):
+                regressions.append(f"{name} @ {run['gallery_size']}: p50 {old:.1f} ms -> {summary['p50_ms']:.1f} ms")
+    return regressions
@@ -0,0 +1,133 @@
+"""
+Change feed keeping every process's gallery and image-hash index in step with the User table.
+
+A process applies its own writes to its gallery and hash index directly
+(signals.py) and also publishes the changed User ids to the feed. Before a
+search, each structure polls the feed, at most once every
+``FACE_CHANGE_POLL_INTERVAL`` seconds, and re-reads only the rows that changed,
+so other processes see a registration or deletion within that delay without
+rescanning the table.
+
+The default ``DatabaseChangeFeed`` is a table of changed ids whose highest id is
+the version counter. ``FACE_CHANGE_FEED`` can name any class with the same
+``publish`` / ``latest`` / ``poll`` methods (e.g. one backed by a message bus),
+or be empty to turn the feed off.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import GalleryChange
+
+# A change id skipped by a poll may belong to a transaction that has not committed yet;
+# it is looked for again until it is this many seconds old.
+_GAP_SECONDS = 10.0
+# Gaps wider than this are id jumps (e.g. a sequence cache), not in-flight transactions.
+_MAX_GAP = 1000
+# User rows re-read per query when applying changes.
+CHUNK_SIZE = 500
+
+
+class DatabaseChangeFeed:
+    """Changed User ids in the ``GalleryChange`` table; the cursor is (last id, pending gaps)."""
+
+    def __init__(self):
+        self._next_prune = 0.0
+
+    def publish(self, user_ids):
+        GalleryChange.objects.bulk_create([GalleryChange(user_id=user_id) for user_id in user_ids])
+        if time.monotonic() >= self._next_prune:
+            self._next_prune = time.monotonic() + 60
+            cutoff = timezone.now() - timedelta(seconds=settings.FACE_CHANGE_RETENTION)
+            GalleryChange.objects.filter(created__lt=cutoff).delete()
+
+    def latest(self):
+        last = GalleryChange.objects.order_by("-id").values_list("id", flat=True).first()
+        return last or 0, ()
+
+    def poll(self, cursor):
+        """Return (new cursor, user ids changed since ``cursor``)."""
+        last, gaps = cursor
+        now = time.monotonic()
+        gaps = [(change_id, expires) for change_id, expires in gaps if expires > now]
+        query = Q(id__gt=last)
+        if gaps:
+            query |= Q(id__in=[change_id for change_id, _ in gaps])
+        rows = list(GalleryChange.objects.filter(query).order_by("id").values_list("id", "user_id"))
+        found = {change_id for change_id, _ in rows}
+        gaps = [gap for gap in gaps if gap[0] not in found]
+        for change_id, _ in rows:
+            if last < change_id:
+                if change_id - last - 1 <= _MAX_GAP:
+                    gaps.extend((missing, now + _GAP_SECONDS) for missing in range(last + 1, change_id))
+                last = change_id
+        return (last, tuple(gaps)), [user_id for _, user_id in rows]
+
+
+_feeds = {}
+
+
+def get_change_feed():
+    """The feed configured by ``settings.FACE_CHANGE_FEED``, or None when it is disabled."""
+    path = settings.FACE_CHANGE_FEED
+    if not path:
+        return None
+    if path not in _feeds:
+        _feeds[path] = import_string(path)()
+    return _feeds[path]
+
+
+def publish_changes(user_ids):
+    """Tell other processes that these User rows were saved or deleted."""
+    feed = get_change_feed()
+    if feed is not None and user_ids:
+        feed.publish(user_ids)
+
+
+def chunked(user_ids, size=CHUNK_SIZE):
+    for start in range(0, len(user_ids), size):
+        yield user_ids[start:start + size]
+
+
+class ChangeFollower:
+    """Position of one in-process structure (gallery, hash index) in the change feed."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cursor = None
+        self._polled = 0.0
+
+    def start(self):
+        """Mark the current end of the feed; call just before loading a snapshot from the database."""
+        feed = get_change_feed()
+        self._cursor = feed.latest() if feed is not None else None
+        self._polled = time.monotonic()
+
+    def poll(self):
+        """
+        User ids changed since the last poll: empty when nothing changed, when
+        the next poll is not due yet or while another thread polls, and None
+        when this process has been idle longer than the feed keeps changes and
+        must reload.
+        """
+        feed = get_change_feed()
+        if feed is None or self._cursor is None:
+            return []
+        if time.monotonic() - self._polled < settings.FACE_CHANGE_POLL_INTERVAL:
+            return []
+        if not self._lock.acquire(blocking=False):
+            return []
+        try:
+            now = time.monotonic()
+            if now - self._polled > settings.FACE_CHANGE_RETENTION / 2:
+                return None
+            self._cursor, user_ids = feed.poll(self._cursor)
+            self._polled = now
+        finally:
+            self._lock.release()
+        return list(dict.fromkeys(user_ids))
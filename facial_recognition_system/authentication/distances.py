@@ -0,0 +1,92 @@
+"""
+Distribution of face distances across the gallery, for choosing FACE_MATCH_TOLERANCE.
+
+Every pair of gallery rows is scored once (upper triangle), in blocks of rows
+so memory stays bounded, and counted into a fixed-width histogram: pairs of
+rows from different members are impostor pairs, pairs of one member's
+templates are genuine pairs. From the two histograms a threshold can be read
+off for a target false-match rate, together with the share of genuine pairs it
+still accepts.
+"""
+from itertools import combinations
+
+import numpy as np
+
+# Rows x columns scored per block. Each element takes a float32 distance and an
+# int32 bin number, so a block peaks at about 8 bytes per element (~128 MB here).
+BLOCK_ELEMENTS = 16 * 1024 * 1024
+# Elements binned per np.bincount call, which converts its input to int64.
+_BINCOUNT_ELEMENTS = 1024 * 1024
+
+
+def _genuine_pairs(ids):
+    """(first rows, second rows) of every pair of rows that belong to the same member, first < second."""
+    order = np.argsort(ids, kind="stable")
+    bounds = np.flatnonzero(np.diff(ids[order])) + 1
+    pairs = [pair for group in np.split(order, bounds) if len(group) > 1
+             for pair in combinations(sorted(group.tolist()), 2)]
+    pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def distance_histograms(ids, matrix, edges):
+    """
+    Return (impostor counts, genuine counts) of all pairwise distances between
+    rows of ``matrix`` over the uniform bins ``edges``; distances past the last
+    edge are counted in the last bin.
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    n, bins = len(matrix), len(edges) - 1
+    scale = np.float32(bins / (edges[-1] - edges[0]))
+    impostor = np.zeros(bins + 1, dtype=np.int64)  # the extra bin collects pairs that are not counted
+    genuine = np.zeros(bins + 1, dtype=np.int64)
+    if n < 2:
+        return impostor[:bins], genuine[:bins]
+    sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+    first, second = _genuine_pairs(ids)
+    block = max(1, BLOCK_ELEMENTS // n)
+    dist_buffer = np.empty(min(n, block) * n, dtype=np.float32)
+    index_buffer = np.empty(len(dist_buffer), dtype=np.int32)
+    for start in range(0, n, block):
+        stop = min(n, start + block)
+        rows, width = stop - start, n - start
+        # Rows [start, stop) against columns [start, n); only pairs (i, j) with j > i are counted.
+        dist = dist_buffer[:rows * width].reshape(rows, width)
+        np.matmul(matrix[start:stop], matrix[start:].T, out=dist)
+        dist *= -2.0
+        dist += sq_norms[start:stop, None]
+        dist += sq_norms[None, start:]
+        np.maximum(dist, 0.0, out=dist)
+        np.sqrt(dist, out=dist)
+        dist -= np.float32(edges[0])
+        dist *= scale
+        np.clip(dist, 0, bins - 1, out=dist)
+        index = index_buffer[:rows * width].reshape(rows, width)
+        np.copyto(index, dist, casting="unsafe")
+        for i in range(rows):
+            index[i, :i + 1] = bins
+        mine = (first >= start) & (first < stop)
+        same = (first[mine] - start, second[mine] - start)
+        genuine += np.bincount(index[same], minlength=bins + 1)
+        index[same] = bins
+        flat = index.ravel()
+        for chunk in range(0, len(flat), _BINCOUNT_ELEMENTS):
+            impostor += np.bincount(flat[chunk:chunk + _BINCOUNT_ELEMENTS], minlength=bins + 1)
+    return impostor[:bins], genuine[:bins]
+
+
+def accepted_share(counts, edges, threshold):
+    """Share of the pairs in ``counts`` at a distance below ``threshold`` (to bin resolution)."""
+    total = counts.sum()
+    if not total:
+        return 0.0
+    return float(counts[:np.searchsorted(edges, threshold, side="right") - 1].sum() / total)
+
+
+def threshold_for_rate(impostor, edges, rate):
+    """Largest bin edge below which at most ``rate`` of the impostor pairs fall."""
+    total = impostor.sum()
+    if not total:
+        return float(edges[-1])
+    cumulative = np.cumsum(impostor) / total
+    return float(edges[np.searchsorted(cumulative, rate, side="right")])
@@ -0,0 +1,285 @@
+"""
+Face encoding engine.
+
+dlib face detection and encoding are CPU-bound and hold the GIL, so running them
+inline in a request thread pins that worker for the whole call. The engine runs
+them in a pool of worker processes (each with the dlib models loaded once at
+start-up) behind a bounded number of in-flight requests:
+
+- ``FACE_ENGINE_WORKERS = 0`` runs inline in the calling thread (development, tests).
+- When ``FACE_ENGINE_MAX_PENDING`` images are already queued or running, a new
+  request waits up to ``FACE_ENGINE_QUEUE_TIMEOUT`` seconds for a slot and then
+  fails fast with ``EngineBusy`` instead of piling up.
+- A call that takes longer than ``FACE_ENGINE_TIMEOUT`` seconds raises ``EngineTimeout``.
+
+Worker processes import this module without calling ``django.setup()``, so it
+must not import app models or touch the ORM at import time. Importing
+``django.conf.settings`` and ``django.http`` (via ``metrics``) is fine: settings
+are only read lazily in the parent process, when the engine is created, and the
+workers get their options as arguments.
+"""
+import asyncio
+import atexit
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import face_recognition
+import numpy as np
+from django.conf import settings
+
+from .metrics import record_stage
+
+logger = logging.getLogger(__name__)
+
+
+class FaceImageError(Exception):
+    """An image could not be turned into a face encoding; ``str(exc)`` is the API error message."""
+
+
+class EngineUnavailable(Exception):
+    """The engine cannot take or finish this request right now; clients should retry."""
+
+
+class EngineBusy(EngineUnavailable):
+    pass
+
+
+class EngineTimeout(EngineUnavailable):
+    pass
+
+
+def detection_scale(shape, max_side=None, max_width=None, max_height=None):
+    """Factor (<= 1) that shrinks an image of ``shape`` to fit every given bound."""
+    height, width = shape[:2]
+    scale = 1.0
+    if max_side:
+        scale = min(scale, max_side / max(height, width))
+    if max_width:
+        scale = min(scale, max_width / width)
+    if max_height:
+        scale = min(scale, max_height / height)
+    return scale
+
+
+def _face_crop(img, location, margin=0.5):
+    """Crop ``img`` around a (top, right, bottom, left) box plus ``margin``; returns (crop, box in crop)."""
+    top, right, bottom, left = location
+    pad_y, pad_x = int((bottom - top) * margin), int((right - left) * margin)
+    y0, x0 = max(0, top - pad_y), max(0, left - pad_x)
+    y1, x1 = min(img.shape[0], bottom + pad_y), min(img.shape[1], right + pad_x)
+    return np.ascontiguousarray(img[y0:y1, x0:x1]), (top - y0, right - x0, bottom - y0, left - x0)
+
+
+def encode_face(img, max_side=None, upsample=1, max_width=None, max_height=None, face_location=None, timings=None):
+    """
+    Return the 128-d encoding of the first face in ``img``; raises FaceImageError if there is none.
+
+    HOG detection cost grows with pixel count, so faces are detected on a copy
+    shrunk to fit ``max_side`` (and the client's ``max_width``/``max_height``),
+    the box is mapped back to full resolution, and only a crop around it is
+    handed to the encoder. A ``face_location`` (top, right, bottom, left) already
+    known to the client skips detection entirely. Stage durations are appended
+    to ``timings`` as (name, seconds) when it is given.
+    """
+    if face_location is not None:
+        height, width = img.shape[:2]
+        top, right, bottom, left = face_location
+        location = (max(0, top), min(width, right), min(height, bottom), max(0, left))
+        if location[2] <= location[0] or location[1] <= location[3]:
+            raise FaceImageError("face_box is outside the image.")
+    else:
+        scale = detection_scale(img.shape, max_side, max_width, max_height)
+        start = time.perf_counter()
+        small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else img
+        face_locations = face_recognition.face_locations(small, number_of_times_to_upsample=upsample)
+        if timings is not None:
+            timings.append(("face_locations", time.perf_counter() - start))
+        if not face_locations:
+            raise FaceImageError("No face found in the image.")
+        top, right, bottom, left = face_locations[0]
+        location = (int(top / scale), int(right / scale), int(bottom / scale), int(left / scale))
+    start = time.perf_counter()
+    crop, crop_location = _face_crop(img, location)
+    face_encodings = face_recognition.face_encodings(crop, [crop_location])
+    if timings is not None:
+        timings.append(("face_encodings", time.perf_counter() - start))
+    if not face_encodings:
+        raise FaceImageError("Could not extract face encoding.")
+    return face_encodings[0]
+
+
+def encode_face_timed(img, **options):
+    """``encode_face`` returning (encoding, stage timings), so worker processes can report them."""
+    timings = []
+    return encode_face(img, timings=timings, **options), timings
+
+
+def _report(result):
+    encoding, timings = result
+    for name, seconds in timings:
+        record_stage(name, seconds)
+    return encoding
+
+
+def load_models():
+    """Warm the dlib detector and encoder in this process so no request pays for it."""
+    blank = np.zeros((150, 150, 3), dtype=np.uint8)
+    face_recognition.face_locations(blank)
+    face_recognition.face_encodings(blank, [(0, 150, 150, 0)])
+
+
+def _init_worker():
+    load_models()
+
+
+class EncodingEngine:
+    def __init__(self, workers=0, max_pending=64, queue_timeout=2.0, timeout=30.0, detect_max_side=None,
+                 detect_upsample=1):
+        self.workers = workers
+        self.detect_max_side = detect_max_side
+        self.detect_upsample = detect_upsample
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._warm = False
+
+    def start(self):
+        """Create the worker pool (and load models in every worker) ahead of the first request."""
+        if self.workers > 0:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_worker,
+                    )
+        return self
+
+    @property
+    def warm(self):
+        """True once encoding needs no further start-up work (always, when encoding inline)."""
+        return self.workers <= 0 or self._warm
+
+    def warm_up(self):
+        """Start the pool and wait until every worker process has loaded the models."""
+        self.start()
+        if self.workers > 0:
+            # Processes are spawned on demand; one task each while none is idle brings them all up.
+            wait([self._executor.submit(os.getpid) for _ in range(self.workers)])
+            self._warm = True
+        return self
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._warm = False
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _options(self, max_width, max_height, face_location):
+        return dict(max_side=self.detect_max_side, upsample=self.detect_upsample,
+                    max_width=max_width, max_height=max_height, face_location=face_location)
+
+    def _submit(self, img, options):
+        """Hand one held slot's work to the pool; the slot is released when the worker finishes."""
+        try:
+            future = self.start()._executor.submit(encode_face_timed, img, **options)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._restart()
+            raise EngineUnavailable("Face encoding workers restarted. Please retry.")
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is held until the worker finishes, even if the caller stops waiting.
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def encode(self, img, max_width=None, max_height=None, face_location=None):
+        """
+        Encode the first face in ``img``; raises FaceImageError or EngineUnavailable.
+
+        ``max_width``/``max_height`` further bound the detection resolution;
+        ``face_location`` skips detection.
+        """
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise EngineBusy("Face encoding is at capacity. Please retry shortly.")
+        options = self._options(max_width, max_height, face_location)
+        if self.workers <= 0:
+            try:
+                return _report(encode_face_timed(img, **options))
+            finally:
+                self._slots.release()
+
+        future = self._submit(img, options)
+        try:
+            return _report(future.result(timeout=self.timeout))
+        except FutureTimeout:
+            raise EngineTimeout("Face encoding timed out. Please retry.")
+        except BrokenProcessPool:
+            self._restart()
+            raise EngineUnavailable("Face encoding workers restarted. Please retry.")
+
+    async def encode_async(self, img, max_width=None, max_height=None, face_location=None):
+        """
+        Awaitable ``encode()`` for async views. The event loop is never blocked,
+        and with worker processes no thread is tied up while a face is encoded.
+        """
+        loop = asyncio.get_running_loop()
+        if self.workers <= 0:
+            return await loop.run_in_executor(None, functools.partial(
+                self.encode, img, max_width=max_width, max_height=max_height, face_location=face_location))
+        if not self._slots.acquire(blocking=False):
+            acquiring = loop.run_in_executor(None, functools.partial(self._slots.acquire, timeout=self.queue_timeout))
+            try:
+                acquired = await asyncio.shield(acquiring)
+            except asyncio.CancelledError:
+                # The waiting thread cannot be interrupted: give back the slot it may still take.
+                acquiring.add_done_callback(lambda f: f.cancelled() or not f.result() or self._slots.release())
+                raise
+            if not acquired:
+                raise EngineBusy("Face encoding is at capacity. Please retry shortly.")
+        future = self._submit(img, self._options(max_width, max_height, face_location))
+        try:
+            return _report(await asyncio.wait_for(asyncio.wrap_future(future), self.timeout))
+        except asyncio.TimeoutError:
+            raise EngineTimeout("Face encoding timed out. Please retry.")
+        except BrokenProcessPool:
+            self._restart()
+            raise EngineUnavailable("Face encoding workers restarted. Please retry.")
+
+    def _restart(self):
+        logger.error("Face encoding pool broke; restarting %d workers", self.workers)
+        self.shutdown()
+        threading.Thread(target=self.warm_up, name="face-engine-warm-up", daemon=True).start()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the process-wide engine configured from ``settings.FACE_ENGINE_*``."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = EncodingEngine(
+                    workers=settings.FACE_ENGINE_WORKERS,
+                    max_pending=settings.FACE_ENGINE_MAX_PENDING,
+                    queue_timeout=settings.FACE_ENGINE_QUEUE_TIMEOUT,
+                    timeout=settings.FACE_ENGINE_TIMEOUT,
+                    detect_max_side=settings.FACE_DETECT_MAX_SIDE,
+                    detect_upsample=settings.FACE_DETECT_UPSAMPLE,
+                )
+                atexit.register(_engine.shutdown)
+    return _engine
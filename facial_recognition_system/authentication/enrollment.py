@@ -0,0 +1,192 @@
+"""
+Bulk enrollment: register many members in one call.
+
+Images are decoded and hashed on a thread pool and encoded by the encoding
+engine in parallel; duplicates are then found in one pass (against the gallery
+with a single batched search, within the batch with one pairwise distance
+matrix) and every accepted member is inserted with a single ``bulk_create``
+inside one transaction.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .changes import publish_changes
+from .engine import FaceImageError, get_engine
+from .faces import FACE_MATCH_TOLERANCE, decode_base64_image, decode_image_bytes, image_phash
+from .gallery import get_gallery
+from .hash_index import get_hash_index, parse_hash
+from .models import User, embedding_to_bytes
+from .serializers import UserSerializer
+
+
+def _validate(item):
+    """Return (item with validated unique_id and name, None), or (None, error message)."""
+    if not item.get('unique_id') or not item.get('name') or not (item.get('face_image') or item.get('image_bytes')):
+        return None, "unique_id, name and face_image are required."
+    serializer = UserSerializer(data={'unique_id': item['unique_id'], 'name': item['name']})
+    if not serializer.is_valid():
+        return None, " ".join(f"{field}: {' '.join(map(str, errors))}" for field, errors in serializer.errors.items())
+    return {**item, **serializer.validated_data}, None
+
+
+def _prepare(item):
+    """Decode, hash and encode one batch item. Returns (encoding, image_hash, error message)."""
+    if item.get('image_bytes') is not None:
+        img = decode_image_bytes(item['image_bytes'], settings.FACE_DECODE_MAX_SIDE)
+    else:
+        img = decode_base64_image(item['face_image'], settings.FACE_DECODE_MAX_SIDE)
+    if img is None:
+        return None, None, "Invalid image data."
+    try:
+        image_hash = image_phash(img)
+    except Exception as e:
+        return None, None, f"Error generating image hash: {str(e)}"
+    try:
+        return get_engine().encode(img), image_hash, None
+    except FaceImageError as e:
+        return None, image_hash, str(e)
+
+
+def register_batch(items, workers=None):
+    """
+    Register ``items`` (dicts with ``unique_id``, ``name`` and ``face_image``
+    base64 or raw ``image_bytes``) and return one result dict per item, in order:
+    ``{"unique_id", "status", "message"}`` with status 201 or 400.
+
+    ``image_bytes`` is for trusted callers (the ``bulk_register`` command); the
+    register/batch/ view passes on only the documented fields.
+    """
+    results = [{"unique_id": item.get('unique_id'), "status": 400, "message": None} for item in items]
+
+    def reject(i, message, **extra):
+        results[i].update(message=message, **extra)
+
+    # 1. Field validation (as for register/) and unique_id conflicts (within the batch and against the database).
+    items = list(items)
+    pending = []
+    seen_ids = {}
+    for i, item in enumerate(items):
+        item, error = _validate(item)
+        if error:
+            reject(i, error)
+            continue
+        items[i] = item
+        if item['unique_id'] in seen_ids:
+            reject(i, f"Duplicate unique_id in batch (same as item {seen_ids[item['unique_id']]}).")
+        else:
+            seen_ids[item['unique_id']] = i
+            pending.append(i)
+    taken = set(User.objects.filter(unique_id__in=[items[i]['unique_id'] for i in pending])
+                .values_list('unique_id', flat=True))
+    for i in [i for i in pending if items[i]['unique_id'] in taken]:
+        reject(i, "A user with this username already exists. Please choose a different username.")
+    pending = [i for i in pending if items[i]['unique_id'] not in taken]
+
+    # 2. Decode, hash and encode in parallel (EngineUnavailable propagates to the caller).
+    workers = workers or settings.FACE_BATCH_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        prepared = dict(zip(pending, pool.map(_prepare, [items[i] for i in pending])))
+    encoded = []
+    for i in pending:
+        encoding, image_hash, error = prepared[i]
+        if error:
+            reject(i, error)
+        else:
+            encoded.append(i)
+
+    # 3. Exact-image duplicates by perceptual hash, then near-identical images via the Hamming index
+    #    and against the images accepted earlier in the batch.
+    hash_owners = dict(User.objects.filter(image_hash__in=[prepared[i][1] for i in encoded])
+                       .values_list('image_hash', 'unique_id'))
+    hash_index = get_hash_index()
+    similar = {i: hash_index.nearest(prepared[i][1], settings.FACE_HASH_MAX_DISTANCE) for i in encoded}
+    similar_owners = dict(User.objects.filter(pk__in=[u for u, _ in similar.values() if u is not None])
+                          .values_list('pk', 'unique_id'))
+    remaining = []
+    batch_hashes = []  # (parsed hash, unique_id) of the items accepted so far
+    for i in encoded:
+        image_hash = prepared[i][1]
+        similar_id, bits = similar[i]
+        value = parse_hash(image_hash)
+        earlier = None
+        if value is not None:
+            earlier = min(((bin(value ^ other).count("1"), owner) for other, owner in batch_hashes), default=None)
+        if image_hash in hash_owners:
+            reject(i, f"This exact image is already registered for user ID: {hash_owners[image_hash]}. "
+                      "Please use a different photograph.")
+        elif similar_id in similar_owners:
+            reject(i, f"A near-identical image is already registered for user ID: {similar_owners[similar_id]}. "
+                      "Please use a different photograph.", hash_distance=bits)
+        elif earlier is not None and earlier[0] <= settings.FACE_HASH_MAX_DISTANCE:
+            reject(i, f"A near-identical image appears earlier in the batch (unique_id: {earlier[1]}). "
+                      "Please use a different photograph.", hash_distance=earlier[0])
+        else:
+            hash_owners[image_hash] = items[i]['unique_id']
+            if value is not None:
+                batch_hashes.append((value, items[i]['unique_id']))
+            remaining.append(i)
+    if not remaining:
+        return results
+
+    # 4. Same face as an existing member: one batched gallery search.
+    matrix = np.vstack([prepared[i][0] for i in remaining]).astype(np.float32)
+    match_ids, match_dist = get_gallery().best_matches(matrix)
+    owners = dict(User.objects.filter(pk__in=[int(u) for u, d in zip(match_ids, match_dist)
+                                              if d <= FACE_MATCH_TOLERANCE])
+                  .values_list('pk', 'unique_id'))
+
+    # 5. Same face twice within the batch: one pairwise distance matrix, earlier items win.
+    sq = np.einsum("ij,ij->i", matrix, matrix)
+    pairwise = np.sqrt(np.maximum(sq[:, None] - 2.0 * (matrix @ matrix.T) + sq[None, :], 0.0))
+    accepted = []
+    accepted_rows = np.zeros(len(remaining), dtype=bool)
+    for row, i in enumerate(remaining):
+        if match_dist[row] <= FACE_MATCH_TOLERANCE and int(match_ids[row]) in owners:
+            reject(i, f"This face is already registered with another member (unique_id: {owners[int(match_ids[row])]}). "
+                      "One person cannot be registered under multiple member IDs.",
+                   distance=round(float(match_dist[row]), 4))
+            continue
+        within = np.where(accepted_rows, pairwise[row], np.inf)
+        nearest = int(np.argmin(within))
+        if within[nearest] <= FACE_MATCH_TOLERANCE:
+            reject(i, f"This face appears earlier in the batch (unique_id: {items[remaining[nearest]]['unique_id']}). "
+                      "One person cannot be registered under multiple member IDs.",
+                   distance=round(float(within[nearest]), 4))
+            continue
+        accepted_rows[row] = True
+        accepted.append((row, i))
+
+    # 6. Insert everything accepted in one transaction.
+    users = [
+        User(unique_id=items[i]['unique_id'], name=items[i]['name'],
+             face_embedding=embedding_to_bytes(matrix[row]), image_hash=prepared[i][1])
+        for row, i in accepted
+    ]
+    try:
+        with transaction.atomic():
+            created = User.objects.bulk_create(users)
+            pks = [user.pk for user in created]
+            if None in pks:
+                pks = list(User.objects.filter(unique_id__in=[user.unique_id for user in created])
+                           .values_list("pk", flat=True))
+            publish_changes(pks)
+    except IntegrityError:
+        for _, i in accepted:
+            reject(i, "A user in this batch was registered concurrently; no users from the batch were saved.")
+        return results
+
+    # bulk_create bypasses post_save, so update the gallery and hash index directly.
+    gallery = get_gallery()
+    for user, (row, i) in zip(created, accepted):
+        if user.pk is None:
+            gallery.invalidate()
+            hash_index.invalidate()
+            break
+        gallery.add(user.pk, matrix[row])
+        hash_index.add(user.pk, user.image_hash)
+    for _, i in accepted:
+        results[i].update(status=201, message="User registered successfully.")
+    return results
@@ -0,0 +1,139 @@
+"""
+Face pipeline helpers shared by the API views, batch enrollment and management commands.
+"""
+import base64
+import io
+
+import cv2
+import numpy as np
+import scipy.fftpack
+from django.conf import settings
+from PIL import Image
+
+from .gallery import get_gallery, member_embeddings, template_distance
+from .hash_index import get_hash_index
+from .metrics import stage
+from .models import User
+
+# pHash: 8x8 low-frequency DCT bits of a 32x32 grayscale thumbnail (imagehash.phash defaults).
+PHASH_SIZE = 8
+PHASH_THUMBNAIL = 32
+
+# Face match threshold: same person if distance <= this. Tune (e.g. 0.35–0.45) if needed.
+FACE_MATCH_TOLERANCE = 0.4
+
+
+# JPEG can be decoded directly at 1/2, 1/4 or 1/8 scale (scaled IDCT), largest reduction first.
+_REDUCED_DECODE = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def _decode_flag(img_data, max_side):
+    """Strongest reduced-decode flag that keeps a JPEG's longest side at or above ``max_side``."""
+    try:
+        # Image.open only parses the header; no pixels are decoded here.
+        with Image.open(io.BytesIO(img_data)) as header:
+            if header.format != 'JPEG':
+                return cv2.IMREAD_COLOR
+            longest = max(header.size)
+    except Exception:
+        return cv2.IMREAD_COLOR
+    for factor, flag in _REDUCED_DECODE:
+        if longest // factor >= max_side:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_image_bytes(img_data, max_side=None):
+    """
+    Decode encoded image bytes (JPEG, PNG, ...) to a BGR numpy array, or None.
+
+    With ``max_side``, a JPEG much larger than that is decoded at a reduced scale
+    whose longest side is still at least ``max_side``, which is faster and uses
+    a fraction of the memory of a full decode.
+    """
+    try:
+        with stage("imdecode"):
+            np_arr = np.frombuffer(img_data, np.uint8)
+            flag = _decode_flag(img_data, max_side) if max_side else cv2.IMREAD_COLOR
+            return cv2.imdecode(np_arr, flag)
+    except Exception:
+        return None
+
+
+# Helper function to decode base64 image to numpy array
+def decode_base64_image(base64_string, max_side=None):
+    try:
+        with stage("base64_decode"):
+            img_data = base64.b64decode(base64_string)
+    except Exception:
+        return None
+    return decode_image_bytes(img_data, max_side)
+
+
+def exceeds_size_limit(face_image, limit_kb):
+    """
+    True if ``face_image`` (a base64 string or raw image bytes) is over
+    ``limit_kb`` kilobytes once decoded (no limit if falsy).
+    """
+    if not limit_kb:
+        return False
+    if isinstance(face_image, str):
+        decoded_size = len(face_image) * 3 // 4 - face_image[-2:].count('=')
+    else:
+        decoded_size = len(face_image)
+    return decoded_size > limit_kb * 1024
+
+
+def image_phash(img):
+    """
+    Perceptual hash of a BGR image, as stored in User.image_hash (16 hex digits).
+
+    Bit-for-bit the same as ``str(imagehash.phash(...))`` on the RGB image, which
+    is how existing hashes were made, but Pillow reads the BGR buffer directly
+    (no RGB copy) and the bits are packed straight from the DCT. The full-frame
+    luma + Lanczos pass to the 32x32 thumbnail is kept as is: any other
+    thumbnail changes bits of stored hashes.
+    """
+    height, width = img.shape[:2]
+    gray = Image.frombuffer('RGB', (width, height), np.ascontiguousarray(img), 'raw', 'BGR', 0, 1).convert('L')
+    pixels = np.asarray(gray.resize((PHASH_THUMBNAIL, PHASH_THUMBNAIL), Image.LANCZOS), dtype=np.float64)
+    dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=0), axis=1)[:PHASH_SIZE, :PHASH_SIZE]
+    return np.packbits(dct.ravel() > np.median(dct)).tobytes().hex()
+
+
+def find_face_match(face_encoding):
+    """Return (user, distance) for the nearest registered member, user is None if beyond FACE_MATCH_TOLERANCE."""
+    with stage("gallery_search"):
+        user_id, distance = get_gallery().best_match(face_encoding)
+    if user_id is None or distance > FACE_MATCH_TOLERANCE:
+        return None, distance
+    with stage("db_read"):
+        return User.objects.filter(pk=user_id).first(), distance
+
+
+def verify_face(unique_id, face_encoding):
+    """
+    1:1 check of ``face_encoding`` against the member ``unique_id`` only: returns
+    (user, distance), user is None if unknown or beyond FACE_MATCH_TOLERANCE.
+    Reads just that member's embeddings, so the cost does not depend on the gallery size.
+    """
+    with stage("db_read"):
+        user = User.objects.filter(unique_id=unique_id).only('id', 'unique_id', 'name').first()
+        if user is None:
+            return None, float('inf')
+        _, embeddings = next(member_embeddings([user.pk]))
+    probe = np.asarray(face_encoding, dtype=np.float32)
+    distance = template_distance(probe, embeddings, settings.FACE_TEMPLATE_AGGREGATION)
+    if distance > FACE_MATCH_TOLERANCE:
+        return None, distance
+    return user, distance
+
+
+def find_similar_image(image_hash):
+    """Return (user, bit distance) for the closest stored image hash within FACE_HASH_MAX_DISTANCE, or (None, None)."""
+    with stage("hash_search"):
+        user_id, distance = get_hash_index().nearest(image_hash, settings.FACE_HASH_MAX_DISTANCE)
+    if user_id is None:
+        return None, None
+    with stage("db_read"):
+        return User.objects.filter(pk=user_id).first(), distance
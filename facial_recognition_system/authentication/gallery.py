@@ -0,0 +1,347 @@
+"""
+Process-wide in-memory gallery of registered face embeddings.
+
+All stored encodings are kept in one contiguous float32 matrix with a parallel
+array of User primary keys, so a probe is matched against every member with a
+single batched distance computation instead of a per-row Python loop. For very
+large galleries a search index (see ``index.py``) narrows the rows scored.
+With ``FACE_GALLERY_FILE`` set, the matrix lives in a memory-mapped file shared
+by every worker process on the host instead (see ``gallery_file.py``).
+
+A member may have several rows: the registered face plus any templates added
+later (``FaceTemplate``). Searches score rows and then combine each member's
+rows as ``FACE_TEMPLATE_AGGREGATION`` says.
+"""
+import threading
+import uuid
+from itertools import chain
+
+import numpy as np
+from django.conf import settings
+
+from .changes import ChangeFollower, chunked
+from .index import create_index
+from .models import (EMBEDDING_BYTES, EMBEDDING_DIM, EMBEDDING_DTYPE, EMBEDDING_MODEL, FaceTemplate, User,
+                     embedding_from_bytes)
+
+# Upper bound on probes x gallery rows scored per block in best_matches (~64 MB of float32).
+_BLOCK_ELEMENTS = 16 * 1024 * 1024
+
+
+def load_embeddings():
+    """
+    Return (ids, float32 matrix) for every usable embedding from the current
+    model: one row per User and per FaceTemplate, so ids repeat for members with templates.
+    """
+    ids, blobs = [], []
+    users = User.objects.filter(embedding_model=EMBEDDING_MODEL).values_list("id", "face_embedding")
+    templates = (FaceTemplate.objects.filter(embedding_model=EMBEDDING_MODEL).order_by("id")
+                 .values_list("user_id", "face_embedding"))
+    for user_id, data in chain(users.iterator(), templates.iterator()):
+        if data is not None and len(data) == EMBEDDING_BYTES:
+            ids.append(user_id)
+            blobs.append(data)
+    # Rows are raw float32 already: one join + frombuffer, no per-row parsing.
+    matrix = np.frombuffer(b"".join(blobs), dtype=EMBEDDING_DTYPE).reshape(-1, EMBEDDING_DIM)
+    return np.asarray(ids, dtype=np.int64), matrix
+
+
+def member_embeddings(user_ids):
+    """
+    Yield (user_id, float32 matrix of the member's usable embeddings) for each
+    id, in the order ``load_embeddings`` returns them; no rows if the member is gone.
+    """
+    for chunk in chunked(user_ids):
+        found = {user_id: [] for user_id in chunk}
+        users = User.objects.filter(pk__in=chunk, embedding_model=EMBEDDING_MODEL).values_list("id", "face_embedding")
+        templates = (FaceTemplate.objects.filter(user_id__in=chunk, embedding_model=EMBEDDING_MODEL).order_by("id")
+                     .values_list("user_id", "face_embedding"))
+        for user_id, data in chain(users, templates):
+            vector = embedding_from_bytes(data)
+            if vector is not None:
+                found[user_id].append(vector)
+        for user_id in chunk:
+            yield user_id, np.array(found[user_id], dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+
+
+def template_distance(probe, rows, aggregation):
+    """Distance from ``probe`` to a member with embeddings ``rows`` under ``aggregation``; inf without rows."""
+    if aggregation not in ("min", "mean", "centroid"):
+        raise ValueError(f"Unknown FACE_TEMPLATE_AGGREGATION: {aggregation!r}")
+    if not len(rows):
+        return np.inf
+    if aggregation == "centroid":
+        return float(np.linalg.norm(rows.mean(axis=0) - probe))
+    distances = np.linalg.norm(rows - probe, axis=1)
+    return float(distances.min() if aggregation == "min" else distances.mean())
+
+
+class FaceGallery:
+    """
+    Embedding matrix + id array with amortised appends and tombstoned removals.
+
+    Searches read a snapshot of the arrays, so they never block on writers; rows
+    are only ever appended past the snapshot or marked dead, and compaction swaps
+    in fresh arrays rather than mutating the ones a reader may hold.
+    """
+
+    def __init__(self, index_factory=create_index):
+        self._index_factory = index_factory
+        self._lock = threading.RLock()
+        self._follower = ChangeFollower()
+        self._reset()
+
+    def _reset(self):
+        self._token = uuid.uuid4().hex
+        self._changes = 0
+        self._loaded = False
+        self._index = None
+        self._count = 0
+        self._dead = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._matrix = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        self._positions = {}  # user id -> row positions of its live embeddings
+        self._max_templates = 1
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def __len__(self):
+        """Number of members (not rows) searchable."""
+        return len(self._positions)
+
+    @property
+    def generation(self):
+        """Opaque token that changes whenever the set of searchable members may have changed."""
+        return f"{self._token}:{self._changes}"
+
+    def invalidate(self):
+        """Drop all cached embeddings; the next search reloads from the database."""
+        with self._lock:
+            self._reset()
+
+    def load(self):
+        """(Re)build the gallery from every User row with a usable embedding."""
+        self._follower.start()
+        ids, matrix = load_embeddings()
+        with self._lock:
+            self._reset()
+            self._index = self._index_factory()
+            self._set_arrays(ids, matrix)
+            self._index.reset(self._ids, self._matrix)
+            self._loaded = True
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+        else:
+            self.follow_changes()
+
+    def follow_changes(self):
+        """Apply registrations and deletions published by other processes (see ``changes.py``)."""
+        user_ids = self._follower.poll()
+        if user_ids is None:
+            self.load()
+            return
+        for user_id, vectors in member_embeddings(user_ids):
+            if len(vectors):
+                self.add(user_id, vectors)
+            else:
+                self.remove(user_id)
+
+    def _set_arrays(self, ids, matrix):
+        self._ids = ids
+        self._matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self._sq_norms = np.einsum("ij,ij->i", self._matrix, self._matrix)
+        self._alive = np.ones(len(ids), dtype=bool)
+        self._set_positions(ids, np.arange(len(ids)))
+        self._count = len(ids)
+        self._dead = 0
+
+    def _set_positions(self, ids, rows):
+        """Rebuild the member -> rows map from the live row positions ``rows``."""
+        self._positions = {}
+        for pos, user_id in zip(rows.tolist(), ids[rows].tolist()):
+            self._positions.setdefault(user_id, []).append(pos)
+        self._max_templates = max(map(len, self._positions.values()), default=1)
+
+    def _same_rows(self, user_id, vectors):
+        positions = self._positions.get(int(user_id))
+        return positions is not None and np.array_equal(self._matrix[positions], vectors)
+
+    def _grow(self, capacity):
+        ids = np.empty(capacity, dtype=np.int64)
+        matrix = np.empty((capacity, EMBEDDING_DIM), dtype=np.float32)
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        alive = np.zeros(capacity, dtype=bool)
+        n = self._count
+        ids[:n] = self._ids[:n]
+        matrix[:n] = self._matrix[:n]
+        sq_norms[:n] = self._sq_norms[:n]
+        alive[:n] = self._alive[:n]
+        self._ids, self._matrix, self._sq_norms, self._alive = ids, matrix, sq_norms, alive
+
+    def add(self, user_id, encodings):
+        """
+        Set the embeddings of ``user_id`` (one vector, or one row per template),
+        replacing any it had. No-op until the gallery is loaded.
+        """
+        vectors = np.asarray(encodings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        with self._lock:
+            if not self._loaded or self._same_rows(user_id, vectors):
+                return
+            self.remove(user_id)
+            positions = []
+            for vector in vectors:
+                if self._count == len(self._ids):
+                    self._grow(max(1024, 2 * len(self._ids)))
+                pos = self._count
+                self._ids[pos] = user_id
+                self._matrix[pos] = vector
+                self._sq_norms[pos] = vector @ vector
+                self._alive[pos] = True
+                positions.append(pos)
+                self._count += 1
+                self._index.add(self._ids[:self._count], self._matrix[:self._count], pos)
+            self._positions[int(user_id)] = positions
+            self._max_templates = max(self._max_templates, len(positions))
+            self._changes += 1
+
+    def remove(self, user_id):
+        """Tombstone the embeddings of ``user_id``; compacts once half the rows are dead."""
+        with self._lock:
+            positions = self._positions.pop(int(user_id), None)
+            if positions is None:
+                return
+            self._alive[positions] = False
+            self._dead += len(positions)
+            self._changes += 1
+            if self._dead * 2 > self._count:
+                keep = np.flatnonzero(self._alive[:self._count])
+                self._set_arrays(self._ids[keep], self._matrix[keep])
+                self._index.compact(self._ids, self._matrix, keep)
+
+    def search(self, encoding, k=1, exact=False):
+        """
+        Return (user ids, distances) of the ``k`` nearest live members, closest first.
+
+        A member with several embeddings is scored by ``FACE_TEMPLATE_AGGREGATION``:
+        its nearest one (``min``), the mean distance to them (``mean``) or the
+        distance to their centroid (``centroid``), among the members owning the
+        nearest rows. ``exact=True`` bypasses the index and scores every row.
+        """
+        self.ensure_loaded()
+        probe = np.asarray(encoding, dtype=np.float32).reshape(EMBEDDING_DIM)
+        with self._lock:
+            n = self._count
+            ids, matrix, sq_norms, alive = self._ids[:n], self._matrix[:n], self._sq_norms[:n], self._alive[:n]
+            candidates = None if exact else self._index.candidates(probe, n)
+            templates = self._max_templates
+        if candidates is not None:
+            ids, matrix, sq_norms, alive = ids[candidates], matrix[candidates], sq_norms[candidates], alive[candidates]
+        # ||a - b||^2 = ||a||^2 - 2ab + ||b||^2: one BLAS matrix-vector product for all rows.
+        sq = sq_norms - 2.0 * (matrix @ probe) + probe @ probe
+        dist = np.sqrt(np.maximum(sq, 0.0))
+        dist[~alive] = np.inf
+        # Enough of the nearest rows to cover k members even if each has the most templates.
+        rows = min(k * templates, len(dist))
+        if rows <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(dist, rows - 1)[:rows]
+        top = top[np.argsort(dist[top])]
+        top = top[np.isfinite(dist[top])]
+        if templates == 1:
+            return ids[top], dist[top]
+        return self._aggregate(probe, ids[top], dist[top], k)
+
+    def _aggregate(self, probe, ids, dist, k):
+        """The ``k`` best members among rows ``ids``/``dist`` (nearest first), one score per member."""
+        _, first = np.unique(ids, return_index=True)
+        first.sort()
+        members, scores = ids[first], dist[first]
+        aggregation = settings.FACE_TEMPLATE_AGGREGATION
+        if aggregation != "min":
+            with self._lock:
+                rows = [self._matrix[self._positions.get(int(user_id), [])] for user_id in members]
+            scores = np.array([template_distance(probe, r, aggregation) for r in rows], dtype=np.float32)
+            order = np.argsort(scores, kind="stable")
+            order = order[np.isfinite(scores[order])]
+            members, scores = members[order], scores[order]
+        return members[:k], scores[:k]
+
+    def member_distance(self, user_id, encoding, aggregation=None):
+        """
+        Distance from ``encoding`` to member ``user_id`` under ``aggregation``
+        (default ``FACE_TEMPLATE_AGGREGATION``), or inf if it is not in the gallery.
+        """
+        self.ensure_loaded()
+        probe = np.asarray(encoding, dtype=np.float32).reshape(EMBEDDING_DIM)
+        with self._lock:
+            rows = self._matrix[self._positions.get(int(user_id), [])]
+        return template_distance(probe, rows, aggregation or settings.FACE_TEMPLATE_AGGREGATION)
+
+    def best_match(self, encoding):
+        """Return (user_id, distance) of the nearest member, or (None, inf) for an empty gallery."""
+        ids, dist = self.search(encoding, k=1)
+        if not len(ids):
+            return None, float("inf")
+        return int(ids[0]), float(dist[0])
+
+    def best_matches(self, encodings, exact=False):
+        """
+        Nearest member for each row of ``encodings``: returns (user ids, distances),
+        with id -1 and distance inf where the gallery is empty.
+
+        With an exact index all probes are scored against the gallery as one
+        (probes x rows) matrix product, in blocks that bound memory; a member's
+        nearest row is its ``min`` score, so other aggregations search per probe.
+        """
+        probes = np.asarray(encodings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        best_ids = np.full(len(probes), -1, dtype=np.int64)
+        best_dist = np.full(len(probes), np.inf, dtype=np.float32)
+        self.ensure_loaded()
+        with self._lock:
+            n = self._count
+            ids, matrix, sq_norms, alive = self._ids[:n], self._matrix[:n], self._sq_norms[:n], self._alive[:n]
+            per_probe = ((self._index.approximate and not exact)
+                         or (self._max_templates > 1 and settings.FACE_TEMPLATE_AGGREGATION != "min"))
+        if per_probe:
+            for i, probe in enumerate(probes):
+                match_ids, match_dist = self.search(probe, exact=exact)
+                if len(match_ids):
+                    best_ids[i], best_dist[i] = match_ids[0], match_dist[0]
+            return best_ids, best_dist
+        if not n:
+            return best_ids, best_dist
+        block = max(1, _BLOCK_ELEMENTS // n)
+        for start in range(0, len(probes), block):
+            chunk = probes[start:start + block]
+            sq = sq_norms[None, :] - 2.0 * (chunk @ matrix.T) + np.einsum("ij,ij->i", chunk, chunk)[:, None]
+            sq[:, ~alive] = np.inf
+            nearest = np.argmin(sq, axis=1)
+            dist = np.sqrt(np.maximum(sq[np.arange(len(chunk)), nearest], 0.0))
+            found = np.isfinite(dist)
+            best_ids[start:start + block] = np.where(found, ids[nearest], -1)
+            best_dist[start:start + block] = dist
+        return best_ids, best_dist
+
+
+def _create_gallery():
+    if settings.FACE_GALLERY_FILE:
+        from .gallery_file import SharedFaceGallery
+
+        return SharedFaceGallery(settings.FACE_GALLERY_FILE)
+    return FaceGallery()
+
+
+_gallery = _create_gallery()
+
+
+def get_gallery():
+    """Return the process-wide gallery instance."""
+    return _gallery
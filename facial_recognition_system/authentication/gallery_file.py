@@ -0,0 +1,339 @@
+"""
+Embedding gallery shared by every worker process on a host through one memory-mapped file.
+
+File layout (little-endian)::
+
+    header  64 bytes                 magic, version, dim, capacity, count, generation, retired, epoch, model
+    ids     int64[capacity]          User primary key of each row
+    matrix  float32[capacity, dim]   embeddings
+    dead    uint8[capacity / 8]      tombstone bitmap, bit set = row removed
+
+Rows ``[0, count)`` are in use and everything after them is the append log:
+a registration writes its rows (one per template) at ``count`` and a deletion
+sets their tombstone bits. Every worker maps the file read-only, so the matrix
+is held in memory once per host however many workers search it. Writes go
+through ``os.pwrite`` under an exclusive ``flock`` and bump ``generation``
+last; a worker whose generation differs from the header's applies just the rows
+and tombstones added since, without reloading. When the file is full, or half
+its rows are dead, the writer compacts the live rows into a new file, swaps it
+in with ``os.replace`` and flags the old one ``retired`` so the other workers
+map the new one.
+
+Requires ``fcntl`` (Linux/macOS) and a local filesystem.
+"""
+import fcntl
+import logging
+import mmap
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+from .gallery import FaceGallery, load_embeddings
+from .index import create_index
+from .models import EMBEDDING_DIM, EMBEDDING_MODEL
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"FACEGAL1"
+VERSION = 1
+HEADER = np.dtype([
+    ("magic", "S8"), ("version", "<u4"), ("dim", "<u4"), ("capacity", "<u8"), ("count", "<u8"),
+    ("generation", "<u8"), ("retired", "<u8"), ("epoch", "<u8"), ("model", "S16"),
+])
+
+
+def _capacity(count):
+    """Rows to allocate for ``count`` members: room to double, in whole bitmap bytes."""
+    return -(-max(1024, 2 * count) // 8) * 8
+
+
+def _offsets(capacity, dim=EMBEDDING_DIM):
+    """Byte offsets of the ids, matrix and tombstone sections, and the file size."""
+    ids = HEADER.itemsize
+    matrix = ids + 8 * capacity
+    dead = matrix + 4 * dim * capacity
+    return ids, matrix, dead, dead + capacity // 8
+
+
+def write_gallery_file(path, ids, matrix, generation=0):
+    """Write ``ids``/``matrix`` (all live) as a new gallery file and atomically move it to ``path``."""
+    count = len(ids)
+    capacity = _capacity(count)
+    ids_at, matrix_at, _, size = _offsets(capacity)
+    header = np.zeros((), dtype=HEADER)
+    header["magic"], header["version"], header["dim"] = MAGIC, VERSION, EMBEDDING_DIM
+    header["capacity"], header["count"], header["generation"] = capacity, count, generation
+    header["epoch"] = int.from_bytes(os.urandom(8), "little")
+    header["model"] = EMBEDDING_MODEL.encode()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as fh:
+        # Unused rows and the tombstone bitmap stay sparse zeros (= live).
+        fh.truncate(size)
+        fh.write(header.tobytes())
+        fh.seek(ids_at)
+        fh.write(np.ascontiguousarray(ids, dtype="<i8"))
+        fh.seek(matrix_at)
+        fh.write(np.ascontiguousarray(matrix, dtype="<f4"))
+    os.replace(tmp, path)
+
+
+class GalleryFile:
+    """
+    A read-only mapping of a gallery file, plus ``pwrite`` helpers for the
+    process holding the file lock. Raises ``ValueError`` for a file that is
+    not a gallery of the current embedding model.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR)
+        try:
+            size = os.fstat(self._fd).st_size
+            if size < HEADER.itemsize:
+                raise ValueError(f"{path} is not a face gallery file")
+            self._map = mmap.mmap(self._fd, size, access=mmap.ACCESS_READ)
+            self._header = np.ndarray((), dtype=HEADER, buffer=self._map)
+            header = self._header
+            if (header["magic"] != MAGIC or header["version"] != VERSION or header["dim"] != EMBEDDING_DIM
+                    or header["model"] != EMBEDDING_MODEL.encode()):
+                raise ValueError(f"{path} is not a {EMBEDDING_MODEL} face gallery file")
+            capacity = int(header["capacity"])
+            self._ids_at, self._matrix_at, self._dead_at, end = _offsets(capacity)
+            if size < end:
+                raise ValueError(f"{path} is truncated")
+        except BaseException:
+            os.close(self._fd)
+            raise
+        self.capacity = capacity
+        self.epoch = int(header["epoch"])
+        self.ids = np.ndarray(capacity, dtype="<i8", buffer=self._map, offset=self._ids_at)
+        self.matrix = np.ndarray((capacity, EMBEDDING_DIM), dtype="<f4", buffer=self._map, offset=self._matrix_at)
+        self.dead = np.ndarray(capacity // 8, dtype=np.uint8, buffer=self._map, offset=self._dead_at)
+
+    @property
+    def count(self):
+        return int(self._header["count"])
+
+    @property
+    def generation(self):
+        return int(self._header["generation"])
+
+    @property
+    def retired(self):
+        return bool(self._header["retired"])
+
+    def alive(self, count):
+        """Boolean liveness of rows ``[0, count)`` from the tombstone bitmap."""
+        return np.unpackbits(self.dead[:-(-count // 8)], bitorder="little")[:count] == 0
+
+    def _write_field(self, name, value):
+        os.pwrite(self._fd, np.asarray(value, dtype=HEADER.fields[name][0]).tobytes(), HEADER.fields[name][1])
+
+    def append(self, pos, user_id, vector):
+        os.pwrite(self._fd, np.asarray(user_id, dtype="<i8").tobytes(), self._ids_at + 8 * pos)
+        os.pwrite(self._fd, np.asarray(vector, dtype="<f4").tobytes(), self._matrix_at + 4 * EMBEDDING_DIM * pos)
+
+    def set_dead(self, pos):
+        byte = self.dead[pos // 8] | (1 << (pos % 8))
+        os.pwrite(self._fd, bytes([byte]), self._dead_at + pos // 8)
+
+    def publish(self, count):
+        """Make rows up to ``count`` and all tombstones written so far visible to other processes."""
+        self._write_field("count", count)
+        self._write_field("generation", self.generation + 1)
+
+    def retire(self):
+        self._write_field("retired", 1)
+
+    def close(self):
+        # The mapping stays valid (it holds its own descriptor) while searches still use its arrays.
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock serialising writers to the gallery file at ``path`` across processes."""
+    # A fresh open file description per use: flock on one inherited across fork would not exclude.
+    with open(f"{path}.lock", "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        yield
+
+
+class SharedFaceGallery(FaceGallery):
+    """
+    ``FaceGallery`` whose rows live in the gallery file at ``path``.
+
+    ``load()`` rebuilds the file from the database; ``ensure_loaded()`` maps
+    the existing file (building it only when it is missing or unusable) and
+    then applies changes made by other processes, both those written to the
+    file and those only published to the change feed. ``add``/``remove`` write to
+    the file, so every worker sharing it sees them.
+    """
+
+    def __init__(self, path, index_factory=create_index):
+        self.path = path
+        self._rebuild = False
+        super().__init__(index_factory)
+
+    def _reset(self):
+        file = getattr(self, "_file", None)
+        if file is not None:
+            file.close()
+        super()._reset()
+        self._file = None
+        self._synced = 0
+
+    @property
+    def generation(self):
+        """Changes whenever any process changes the file; equal across processes that are in sync."""
+        if self._file is None:
+            return super().generation
+        self.sync()
+        return f"{self._file.epoch:016x}:{self._synced}"
+
+    def invalidate(self):
+        """Drop the mapping; the next search rebuilds the file from the database."""
+        with self._lock:
+            self._reset()
+            self._rebuild = True
+
+    def load(self):
+        """Rebuild the gallery file from every User row with a usable embedding, and map it."""
+        self._follower.start()
+        ids, matrix = load_embeddings()
+        with self._lock, file_lock(self.path):
+            self._replace(ids, matrix)
+            self._rebuild = False
+
+    def ensure_loaded(self):
+        self._ensure_mapped()
+        self.follow_changes()
+
+    def _ensure_mapped(self):
+        if not self._loaded:
+            with self._lock:
+                if self._rebuild:
+                    self.load()
+                elif not self._loaded:
+                    try:
+                        self._follower.start()
+                        self._map(GalleryFile(self.path))
+                    except (FileNotFoundError, ValueError):
+                        self.load()
+        self.sync()
+
+    def _replace(self, ids, matrix):
+        """Write a new file at ``path`` (lock held), retire the one it replaces and map it."""
+        try:
+            old = GalleryFile(self.path)
+        except (FileNotFoundError, ValueError):
+            old = None
+        write_gallery_file(self.path, ids, matrix, generation=old.generation + 1 if old else 0)
+        if old is not None:
+            old.retire()
+            old.close()
+        self._map(GalleryFile(self.path))
+
+    def _map(self, file):
+        self._reset()
+        count = file.count
+        self._file = file
+        self._synced = file.generation
+        self._index = self._index_factory()
+        self._ids, self._matrix = file.ids, file.matrix
+        self._sq_norms = np.zeros(file.capacity, dtype=np.float32)
+        self._sq_norms[:count] = np.einsum("ij,ij->i", file.matrix[:count], file.matrix[:count])
+        self._alive = np.zeros(file.capacity, dtype=bool)
+        self._alive[:count] = file.alive(count)
+        live = np.flatnonzero(self._alive[:count])
+        self._set_positions(file.ids, live)
+        self._count = count
+        self._dead = count - len(live)
+        self._index.reset(self._ids[:count], self._matrix[:count])
+        self._loaded = True
+
+    def sync(self):
+        """Apply rows appended and tombstones set by other processes since this one last looked."""
+        file = self._file
+        if file is None or (file.generation == self._synced and not file.retired):
+            return
+        with self._lock:
+            if self._file is None:
+                return
+            if self._file.retired:
+                self._map(GalleryFile(self.path))
+            elif self._file.generation != self._synced:
+                self._apply()
+
+    def _apply(self):
+        file = self._file
+        # Writers publish count before generation, so reading generation first never skips a row.
+        generation = file.generation
+        count = file.count
+        known = self._count
+        alive = file.alive(count)
+        for pos in np.flatnonzero(self._alive[:known] & ~alive[:known]):
+            self._alive[pos] = False
+            self._dead += 1
+            user_id = int(self._ids[pos])
+            positions = self._positions.get(user_id, [])
+            if pos in positions:
+                positions.remove(pos)
+                if not positions:
+                    del self._positions[user_id]
+        if count > known:
+            new = self._matrix[known:count]
+            self._sq_norms[known:count] = np.einsum("ij,ij->i", new, new)
+            self._alive[known:count] = alive[known:count]
+            for pos in range(known, count):
+                if alive[pos]:
+                    positions = self._positions.setdefault(int(self._ids[pos]), [])
+                    positions.append(pos)
+                    self._max_templates = max(self._max_templates, len(positions))
+                else:
+                    self._dead += 1
+                self._count = pos + 1
+                self._index.add(self._ids[:pos + 1], self._matrix[:pos + 1], pos)
+        self._synced = generation
+
+    def _compact(self):
+        live = np.flatnonzero(self._alive[:self._count])
+        logger.info("Compacting face gallery file %s: %d live of %d rows", self.path, len(live), self._count)
+        self._replace(self._ids[live], self._matrix[live])
+
+    def add(self, user_id, encodings):
+        """Set the embeddings of ``user_id`` in the shared file, replacing any it had."""
+        vectors = np.asarray(encodings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        self._ensure_mapped()
+        with self._lock, file_lock(self.path):
+            self.sync()
+            if self._same_rows(user_id, vectors):
+                return
+            if self._count + len(vectors) > self._file.capacity:
+                self._compact()
+            file = self._file
+            for pos in self._positions.get(int(user_id), ()):
+                file.set_dead(pos)
+            count = file.count
+            for i, vector in enumerate(vectors):
+                file.append(count + i, user_id, vector)
+            file.publish(count + len(vectors))
+            self._apply()
+
+    def remove(self, user_id):
+        """Tombstone the embeddings of ``user_id`` in the shared file; compacts once half the rows are dead."""
+        self._ensure_mapped()
+        with self._lock, file_lock(self.path):
+            self.sync()
+            positions = self._positions.get(int(user_id))
+            if positions is None:
+                return
+            for pos in positions:
+                self._file.set_dead(pos)
+            self._file.publish(self._file.count)
+            self._apply()
+            if self._dead * 2 > self._count:
+                self._compact()
@@ -0,0 +1,160 @@
+"""
+Process-wide Hamming-distance index over User.image_hash.
+
+The perceptual hash of a re-saved or slightly cropped copy of a photo differs
+from the original in a few bits, so an equality lookup misses it. The index
+finds stored hashes within a bit distance using multi-index hashing: each
+64-bit hash is split into four 16-bit words, and by the pigeonhole principle a
+hash within ``r`` bits of the probe agrees with it to within ``r // 4`` bits in
+at least one word. Only the buckets of those nearby words are probed and each
+candidate is verified with a full popcount.
+"""
+import itertools
+import threading
+
+from .changes import ChangeFollower, chunked
+from .models import User
+
+HASH_BITS = 64
+WORD_BITS = 16
+_WORDS = HASH_BITS // WORD_BITS
+_WORD_MASK = (1 << WORD_BITS) - 1
+# Beyond this many bits per word, enumerating nearby words costs more than a scan.
+_MAX_WORD_RADIUS = 3
+
+
+def parse_hash(image_hash):
+    """Return a stored hex image_hash as an int, or None if it is not a 64-bit hex hash."""
+    if not image_hash or len(image_hash) != HASH_BITS // 4:
+        return None
+    try:
+        return int(image_hash, 16)
+    except ValueError:
+        return None
+
+
+def _words(value):
+    return [(value >> (i * WORD_BITS)) & _WORD_MASK for i in range(_WORDS)]
+
+
+def _nearby_words(word, radius):
+    """Every 16-bit word within ``radius`` bits of ``word``, including itself."""
+    for r in range(radius + 1):
+        for bits in itertools.combinations(range(WORD_BITS), r):
+            flip = 0
+            for bit in bits:
+                flip |= 1 << bit
+            yield word ^ flip
+
+
+class HashIndex:
+    """Stored image hashes by user primary key, with one bucket table per 16-bit word."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._follower = ChangeFollower()
+        self._reset()
+
+    def _reset(self):
+        self._loaded = False
+        self._hashes = {}
+        self._tables = [{} for _ in range(_WORDS)]
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def invalidate(self):
+        """Drop all cached hashes; the next lookup reloads from the database."""
+        with self._lock:
+            self._reset()
+
+    def load(self):
+        """(Re)build the index from every User row with a hex image hash."""
+        self._follower.start()
+        rows = User.objects.exclude(image_hash=None).values_list("id", "image_hash")
+        with self._lock:
+            self._reset()
+            for user_id, image_hash in rows.iterator():
+                self._insert(user_id, parse_hash(image_hash))
+            self._loaded = True
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+        else:
+            self.follow_changes()
+
+    def follow_changes(self):
+        """Apply image hashes saved or deleted by other processes (see ``changes.py``)."""
+        user_ids = self._follower.poll()
+        if user_ids is None:
+            self.load()
+            return
+        for chunk in chunked(user_ids):
+            hashes = dict(User.objects.filter(pk__in=chunk).values_list("id", "image_hash"))
+            with self._lock:
+                for user_id in chunk:
+                    self.remove(user_id)
+                    self._insert(user_id, parse_hash(hashes.get(user_id)))
+
+    def _insert(self, user_id, value):
+        if value is None:
+            return
+        self._hashes[user_id] = value
+        for table, word in zip(self._tables, _words(value)):
+            table.setdefault(word, set()).add(user_id)
+
+    def add(self, user_id, image_hash):
+        """Insert or replace the hash for ``user_id``. No-op until the index is loaded."""
+        with self._lock:
+            if not self._loaded:
+                return
+            self.remove(user_id)
+            self._insert(user_id, parse_hash(image_hash))
+
+    def remove(self, user_id):
+        with self._lock:
+            value = self._hashes.pop(user_id, None)
+            if value is None:
+                return
+            for table, word in zip(self._tables, _words(value)):
+                bucket = table[word]
+                bucket.discard(user_id)
+                if not bucket:
+                    del table[word]
+
+    def nearest(self, image_hash, max_distance):
+        """Return (user_id, bit distance) of the closest stored hash within ``max_distance``, or (None, None)."""
+        value = parse_hash(image_hash)
+        if value is None:
+            return None, None
+        self.ensure_loaded()
+        word_radius = max_distance // _WORDS
+        with self._lock:
+            if word_radius > _MAX_WORD_RADIUS:
+                candidates = self._hashes.keys()
+            else:
+                candidates = set()
+                for table, word in zip(self._tables, _words(value)):
+                    for nearby in _nearby_words(word, word_radius):
+                        candidates.update(table.get(nearby, ()))
+            best_id, best_distance = None, None
+            for user_id in candidates:
+                distance = bin(self._hashes[user_id] ^ value).count("1")
+                if distance <= max_distance and (best_distance is None or distance < best_distance):
+                    best_id, best_distance = user_id, distance
+        return best_id, best_distance
+
+
+_hash_index = HashIndex()
+
+
+def get_hash_index():
+    """Return the process-wide image-hash index."""
+    return _hash_index
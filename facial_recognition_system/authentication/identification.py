@@ -0,0 +1,73 @@
+"""
+Batch identification: resolve several probe images against the gallery at once.
+
+Probes are decoded and encoded in parallel, then all of them are matched with a
+single (probes x members) distance computation.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+
+from .engine import FaceImageError, get_engine
+from .faces import FACE_MATCH_TOLERANCE, decode_base64_image
+from .gallery import get_gallery
+from .models import User
+
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def _encode_probe(face_image_b64):
+    """Decode and encode one probe. Returns (encoding, error message, timing dict)."""
+    start = time.perf_counter()
+    img = decode_base64_image(face_image_b64, settings.FACE_DECODE_MAX_SIDE) if face_image_b64 else None
+    timing = {"decode_ms": _elapsed_ms(start)}
+    if img is None:
+        return None, "Invalid image data.", timing
+    start = time.perf_counter()
+    try:
+        encoding = get_engine().encode(img)
+    except FaceImageError as e:
+        return None, str(e), timing
+    finally:
+        timing["encode_ms"] = _elapsed_ms(start)
+    return encoding, None, timing
+
+
+def authenticate_batch(face_images, workers=None):
+    """
+    Identify each base64 image in ``face_images``. Returns (results, search_ms)
+    where results holds one dict per image, in order, with ``status`` 200, 401 or 400.
+    """
+    workers = workers or settings.FACE_BATCH_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        probes = list(pool.map(_encode_probe, face_images))
+
+    results = []
+    encoded = []
+    for i, (encoding, error, timing) in enumerate(probes):
+        results.append({"index": i, "status": 400, "message": error, "timing": timing})
+        if error is None:
+            encoded.append(i)
+    if not encoded:
+        return results, 0.0
+
+    start = time.perf_counter()
+    match_ids, match_dist = get_gallery().best_matches(np.vstack([probes[i][0] for i in encoded]))
+    search_ms = _elapsed_ms(start)
+
+    matched = [int(u) for u, d in zip(match_ids, match_dist) if d <= FACE_MATCH_TOLERANCE]
+    users = User.objects.only('id', 'unique_id', 'name').in_bulk(matched)
+    for i, user_id, distance in zip(encoded, match_ids, match_dist):
+        user = users.get(int(user_id)) if distance <= FACE_MATCH_TOLERANCE else None
+        if user:
+            results[i].update(status=200, message="Authentication successful.", name=user.name,
+                              unique_id=user.unique_id, distance=round(float(distance), 4))
+        else:
+            results[i].update(status=401, message="Authentication failed. No matching user found.")
+            if np.isfinite(distance):  # an empty gallery has no nearest member
+                results[i]["distance"] = round(float(distance), 4)
+    return results, search_ms
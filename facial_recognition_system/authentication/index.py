@@ -0,0 +1,273 @@
+"""
+Search indexes over the face gallery.
+
+An index never computes final distances itself: it narrows the gallery down to
+candidate row positions and the gallery scores those exactly. ``ExactIndex``
+returns no narrowing (brute force); ``IVFIndex`` is a pure-NumPy inverted-file
+index (k-means coarse quantizer) whose ``nprobe`` setting trades recall for
+latency. Both share the same small interface:
+
+    reset(ids, matrix)         rebuild after the gallery was (re)loaded
+    add(ids, matrix, pos)      row ``pos`` was appended (arrays cover rows 0..pos)
+    compact(ids, matrix, keep) the gallery kept only old rows ``keep``, in order
+    candidates(probe, n)       positions to score, or None to scan all ``n`` rows
+    approximate                True while ``candidates`` narrows the search
+"""
+import logging
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def nearest_centroids(vectors, centroids, block=16384):
+    """Return the index of the nearest centroid for every row of ``vectors``."""
+    c_sq = np.einsum("ij,ij->i", centroids, centroids)
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block):
+        chunk = vectors[start:start + block]
+        # argmin ||x - c||^2 == argmin (||c||^2 - 2xc); ||x||^2 is constant per row.
+        out[start:start + block] = np.argmin(c_sq - 2.0 * (chunk @ centroids.T), axis=1)
+    return out
+
+
+def train_kmeans(vectors, nlist, iterations=10, seed=0):
+    """Lloyd's k-means on (a sample of) ``vectors``; returns float32 centroids."""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > 256 * nlist:
+        vectors = vectors[rng.choice(len(vectors), 256 * nlist, replace=False)]
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assign = nearest_centroids(vectors, centroids)
+        counts = np.bincount(assign, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+class ExactIndex:
+    """Brute-force search: every live row is scored."""
+
+    name = "exact"
+    trained = True
+    approximate = False
+
+    def reset(self, ids, matrix):
+        pass
+
+    def add(self, ids, matrix, pos):
+        pass
+
+    def compact(self, ids, matrix, keep):
+        pass
+
+    def candidates(self, probe, n):
+        return None
+
+
+class IVFIndex:
+    """
+    Inverted-file index: rows are bucketed by nearest k-means centroid and a
+    search only scores the ``nprobe`` buckets closest to the probe.
+
+    Bucket membership is kept as a CSR layout (rows sorted by bucket plus
+    offsets) built over the first ``built`` rows; rows appended since then sit
+    in an exactly-scanned tail until the layout is rebuilt. Centroids and
+    per-user bucket assignments are persisted to ``path`` on every rebuild, so a
+    restart only assigns members registered since the last save. Until the
+    gallery reaches ``min_train_size`` rows the index stays untrained and
+    searches fall back to an exact scan. When registrations push the gallery
+    past that size the centroids are fitted on a background thread, on a copy
+    of the rows, so the registering request neither waits for k-means nor
+    holds the gallery lock; searches stay exact until the trained index is
+    swapped in.
+    """
+
+    name = "ivf"
+
+    def __init__(self, nlist=1024, nprobe=16, min_train_size=10000, path=None):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.path = path
+        self._lock = threading.RLock()
+        self._centroids = None
+        self._centroid_sq = None
+        self._assign = np.empty(0, dtype=np.int32)
+        self._layout = None  # (order, offsets, built)
+        self._trainer = None  # background training thread, while one runs
+        self._pending = []  # (pos, id, vector) of rows added while it runs
+        self._generation = 0  # bumped by reset/retrain/compact: a running training is discarded
+
+    @property
+    def trained(self):
+        return self._centroids is not None
+
+    @property
+    def approximate(self):
+        return self._layout is not None
+
+    def _set_centroids(self, centroids):
+        self._centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self._centroid_sq = np.einsum("ij,ij->i", self._centroids, self._centroids)
+
+    def reset(self, ids, matrix):
+        with self._lock:
+            self._generation += 1
+            self._centroids = None
+            self._layout = None
+            self._assign = np.zeros(len(ids), dtype=np.int32)
+            if self._load(ids, matrix) or self.train(ids, matrix):
+                self._rebuild_layout(ids)
+
+    def train(self, ids, matrix, force=False):
+        """Fit centroids on ``matrix`` and assign every row; False if the gallery is still too small."""
+        if not len(matrix) or (len(matrix) < self.min_train_size and not force):
+            return False
+        nlist = max(1, min(self.nlist, len(matrix) // 39))
+        logger.info("Training IVF face index: %d vectors, %d lists", len(matrix), nlist)
+        self._set_centroids(train_kmeans(matrix, nlist))
+        self._assign = nearest_centroids(matrix, self._centroids)
+        return True
+
+    def retrain(self, ids, matrix):
+        """Fit fresh centroids on the whole gallery, ignoring any saved state, and persist them."""
+        with self._lock:
+            self._generation += 1
+            self._centroids = None
+            self._layout = None
+            if self.train(ids, matrix, force=True):
+                self._rebuild_layout(ids)
+
+    def _load(self, ids, matrix):
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path) as saved:
+                centroids = saved["centroids"]
+                saved_ids, saved_assign = saved["ids"], saved["assign"]
+        except (OSError, KeyError, ValueError):
+            logger.warning("Ignoring unreadable face index file %s", self.path)
+            return False
+        if centroids.ndim != 2 or centroids.shape[1] != matrix.shape[1] or not len(saved_ids):
+            return False
+        self._set_centroids(centroids)
+        # Reuse persisted assignments by user id; only rows new since the save, and the rows of
+        # members with several (which one id cannot tell apart), are assigned here.
+        order = np.argsort(saved_ids)
+        sorted_ids = saved_ids[order]
+        idx = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        unique, counts = np.unique(ids, return_counts=True)
+        found = (sorted_ids[idx] == ids) & ~np.isin(ids, unique[counts > 1])
+        self._assign[found] = saved_assign[order[idx[found]]]
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            self._assign[missing] = nearest_centroids(matrix[missing], self._centroids)
+        return True
+
+    def save(self, ids):
+        if not self.path or not self.trained:
+            return
+        # Only members with a single row: a re-registered user's old row is still there (tombstoned)
+        # and a member with templates has one row per template.
+        unique, counts = np.unique(ids, return_counts=True)
+        rows = np.flatnonzero(np.isin(ids, unique[counts == 1]))
+        tmp = f"{self.path}.tmp.npz"
+        np.savez(tmp, centroids=self._centroids, ids=ids[rows], assign=self._assign[rows])
+        os.replace(tmp, self.path)
+
+    def _rebuild_layout(self, ids):
+        n = len(ids)
+        assign = self._assign[:n]
+        order = np.argsort(assign, kind="stable")
+        offsets = np.searchsorted(assign[order], np.arange(len(self._centroids) + 1))
+        self._layout = (order, offsets, n)
+        try:
+            self.save(ids)
+        except OSError:
+            logger.exception("Could not persist face index to %s", self.path)
+
+    def add(self, ids, matrix, pos):
+        with self._lock:
+            if pos >= len(self._assign):
+                self._assign = np.resize(self._assign, max(1024, 2 * len(self._assign)))
+            if not self.trained:
+                if self._trainer is not None:
+                    self._pending.append((pos, ids[pos], matrix[pos].copy()))
+                elif len(matrix) >= self.min_train_size:
+                    self._start_training(ids, matrix)
+                return
+            self._assign[pos] = nearest_centroids(matrix[pos:pos + 1], self._centroids)[0]
+            built = self._layout[2]
+            if len(ids) - built > max(1024, built // 20):
+                self._rebuild_layout(ids)
+
+    def _start_training(self, ids, matrix):
+        generation, ids, matrix = self._generation, ids.copy(), matrix.copy()
+        self._pending = []
+        self._trainer = threading.Thread(target=self._train_in_background, args=(generation, ids, matrix),
+                                         name="ivf-train", daemon=True)
+        self._trainer.start()
+
+    def _train_in_background(self, generation, ids, matrix):
+        nlist = max(1, min(self.nlist, len(matrix) // 39))
+        logger.info("Training IVF face index in the background: %d vectors, %d lists", len(matrix), nlist)
+        try:
+            centroids = train_kmeans(matrix, nlist)
+            assign = nearest_centroids(matrix, centroids)
+        except Exception:
+            logger.exception("Background IVF training failed; searches stay exact")
+            with self._lock:
+                self._trainer = None
+            return
+        with self._lock:
+            self._trainer = None
+            pending, self._pending = self._pending, []
+            if generation != self._generation or self.trained:
+                return
+            self._set_centroids(centroids)
+            self._assign[:len(assign)] = assign
+            if pending:
+                positions = np.array([pos for pos, _, _ in pending])
+                self._assign[positions] = nearest_centroids(np.vstack([v for _, _, v in pending]), self._centroids)
+                ids = np.concatenate([ids, np.array([user_id for _, user_id, _ in pending], dtype=ids.dtype)])
+            self._rebuild_layout(ids)
+
+    def compact(self, ids, matrix, keep):
+        with self._lock:
+            self._generation += 1
+            self._assign = self._assign[keep]
+            if self.trained:
+                self._rebuild_layout(ids)
+
+    def candidates(self, probe, n):
+        layout = self._layout
+        if layout is None:
+            return None
+        order, offsets, built = layout
+        c_dist = self._centroid_sq - 2.0 * (self._centroids @ probe)
+        nprobe = min(self.nprobe, len(c_dist))
+        lists = np.argpartition(c_dist, nprobe - 1)[:nprobe]
+        parts = [order[offsets[c]:offsets[c + 1]] for c in lists]
+        parts.append(np.arange(built, n))
+        return np.concatenate(parts)
+
+
+def create_index():
+    """Build the search index configured by ``settings.FACE_INDEX_BACKEND``."""
+    backend = settings.FACE_INDEX_BACKEND
+    if backend == "exact":
+        return ExactIndex()
+    if backend == "ivf":
+        return IVFIndex(
+            nlist=settings.FACE_INDEX_NLIST,
+            nprobe=settings.FACE_INDEX_NPROBE,
+            min_train_size=settings.FACE_INDEX_MIN_TRAIN_SIZE,
+            path=settings.FACE_INDEX_PATH,
+        )
+    raise ValueError(f"Unknown FACE_INDEX_BACKEND: {backend!r}")
@@ -0,0 +1,108 @@
+"""
+Listing registered users for users/: filters, keyset pagination and streaming exports.
+
+Only ``unique_id`` and ``name`` are ever selected, never the embedding. Pages
+and exports walk the primary key (``WHERE id > last ORDER BY id LIMIT n``), so
+the cost of a page does not grow with its position and an export holds one
+batch in memory at a time however many users there are.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+from .models import User
+
+# Rows fetched per query while streaming an export.
+EXPORT_BATCH_SIZE = 2000
+EXPORT_FORMATS = ('json', 'ndjson')
+
+
+class UserCursorPagination(CursorPagination):
+    """Opaque ``cursor`` links over the primary key; ``limit`` sets the page size."""
+
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+
+    def get_paginated_response(self, data):
+        return Response({'users': data, 'next': self.get_next_link(), 'previous': self.get_previous_link()})
+
+
+def filter_users(query_params):
+    """Users matching the ``name`` (case-insensitive substring) and ``unique_id_prefix`` filters."""
+    users = User.objects.all()
+    if query_params.get('name'):
+        users = users.filter(name__icontains=query_params['name'])
+    if query_params.get('unique_id_prefix'):
+        users = users.filter(unique_id__startswith=query_params['unique_id_prefix'])
+    return users
+
+
+def _batch(users, last):
+    return list(users.filter(id__gt=last).order_by('id').values_list('id', 'unique_id', 'name')[:EXPORT_BATCH_SIZE])
+
+
+def _batches(users):
+    last = 0
+    while True:
+        rows = _batch(users, last)
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][0]
+
+
+async def _abatches(users):
+    last = 0
+    while True:
+        rows = await sync_to_async(_batch)(users, last)
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][0]
+
+
+def _encode(rows, export, first):
+    # Same compact, non-ASCII-escaping JSON as DRF's renderer.
+    items = [json.dumps({'unique_id': unique_id, 'name': name}, ensure_ascii=False, separators=(',', ':'))
+             for _, unique_id, name in rows]
+    if export == 'ndjson':
+        return ''.join(item + '\n' for item in items)
+    return ('' if first else ',') + ','.join(items)
+
+
+def _export_chunks(users, export):
+    if export == 'json':
+        yield '{"users":['
+    first = True
+    for rows in _batches(users):
+        yield _encode(rows, export, first)
+        first = False
+    if export == 'json':
+        yield ']}'
+
+
+async def _aexport_chunks(users, export):
+    if export == 'json':
+        yield '{"users":['
+    first = True
+    async for rows in _abatches(users):
+        yield _encode(rows, export, first)
+        first = False
+    if export == 'json':
+        yield ']}'
+
+
+def export_chunks(users, export):
+    """
+    The whole listing as ``json`` (the usual ``{"users": [...]}`` document) or
+    ``ndjson`` (one user object per line), produced batch by batch. Under ASGI
+    the iterator is asynchronous so the server streams it instead of buffering it.
+    """
+    if settings.FACE_ASYNC_VIEWS:
+        return _aexport_chunks(users, export)
+    return _export_chunks(users, export)
@@ -0,0 +1,89 @@
+import json
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from authentication import benchmark
+
+DEFAULT_IMAGE = settings.BASE_DIR.parent / 'face_test.jpeg'
+
+
+class Command(BaseCommand):
+    help = ("Benchmark register/, authenticate/ and users/ against synthetic galleries in a throwaway "
+            "database, reporting p50/p99 latency, requests/sec and per-stage latency.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,100000',
+                            help='Comma-separated gallery sizes (default: 1000,100000; add 1000000 for a full run).')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per scenario (default: 50).')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per scenario (default: 2).')
+        parser.add_argument('--scenarios', default=','.join(benchmark.SCENARIOS),
+                            help=f"Comma-separated subset of: {', '.join(benchmark.SCENARIOS)}.")
+        parser.add_argument('--image', default=str(DEFAULT_IMAGE), help='Face image to send (default: face_test.jpeg).')
+        parser.add_argument('--output', help='Also write the results as JSON to this file.')
+        parser.add_argument('--baseline', help='Results JSON of an earlier run; fail if any p50 regressed.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed p50 slowdown against --baseline, as a fraction (default: 0.2).')
+
+    def handle(self, *args, **options):
+        if settings.FACE_GALLERY_FILE:
+            raise CommandError("Unset FACE_GALLERY_FILE: the benchmark must not rewrite the shared gallery file.")
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError("--sizes must be comma-separated integers.")
+        scenarios = options['scenarios'].split(',')
+        unknown = set(scenarios) - set(benchmark.SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}.")
+        try:
+            with open(options['image'], 'rb') as f:
+                image_bytes = f.read()
+        except OSError as e:
+            raise CommandError(f"Cannot read {options['image']}: {e}")
+
+        results = {'environment': benchmark.environment(), 'iterations': options['iterations'], 'runs': []}
+        # A throwaway test database, and a throwaway IVF index file, so nothing real is touched.
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with tempfile.TemporaryDirectory() as tmp, override_settings(
+                    FACE_SERVER_TIMING=True, FACE_METRICS_DIR='', FACE_INDEX_PATH=f'{tmp}/face_index.npz'):
+                for size in sizes:
+                    self.stdout.write(f"Gallery of {size} members...")
+                    load_seconds = benchmark.build_gallery(size)
+                    try:
+                        scenario_results = benchmark.run_scenarios(
+                            image_bytes, options['iterations'], options['warmup'], scenarios)
+                    except ValueError as e:
+                        raise CommandError(str(e))
+                    results['runs'].append({'gallery_size': size, 'gallery_load_seconds': round(load_seconds, 3),
+                                            'scenarios': scenario_results})
+                    self._print_run(results['runs'][-1])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}.")
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                regressions = benchmark.compare(results, json.load(f), options['tolerance'])
+            if regressions:
+                raise CommandError("Regressions against baseline:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against baseline."))
+
+    def _print_run(self, run):
+        self.stdout.write(f"  gallery load: {run['gallery_load_seconds']:.3f} s")
+        for name, summary in run['scenarios'].items():
+            self.stdout.write(
+                f"  {name:<20} p50 {summary['p50_ms']:8.1f} ms  p99 {summary['p99_ms']:8.1f} ms  "
+                f"{summary['requests_per_second']:7.1f} req/s  errors {summary['errors']}"
+            )
+            for stage, times in summary['stages'].items():
+                self.stdout.write(f"    {stage:<18} p50 {times['p50_ms']:8.2f} ms  p99 {times['p99_ms']:8.2f} ms")
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from authentication.gallery import load_embeddings
+from authentication.index import IVFIndex
+
+
+class Command(BaseCommand):
+    help = "Train the IVF face search index on all stored embeddings and save it to FACE_INDEX_PATH."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nlist', type=int, default=settings.FACE_INDEX_NLIST,
+                            help='Number of k-means lists (default: FACE_INDEX_NLIST).')
+        parser.add_argument('--path', default=settings.FACE_INDEX_PATH,
+                            help='Output file (default: FACE_INDEX_PATH).')
+
+    def handle(self, *args, **options):
+        ids, matrix = load_embeddings()
+        if not len(ids):
+            self.stdout.write("No stored embeddings; nothing to index.")
+            return
+        index = IVFIndex(nlist=options['nlist'], path=options['path'])
+        index.retrain(ids, matrix)
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(ids)} embeddings at {options['path']}."
+        ))
@@ -0,0 +1,81 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.enrollment import register_batch
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def items_from_directory(directory):
+    """One user per image file; the file name (without extension) is both unique_id and name."""
+    for entry in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(entry)
+        if ext.lower() in IMAGE_EXTENSIONS:
+            yield {'unique_id': stem, 'name': stem, 'image_bytes': _read_file(os.path.join(directory, entry))}
+
+
+def items_from_jsonl(path):
+    """
+    One JSON object per line with unique_id, name and either face_image (base64)
+    or image_path (relative to the JSONL file).
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                raise CommandError(f"{path}:{line_no}: invalid JSON ({e})")
+            if item.get('image_path'):
+                item['image_bytes'] = _read_file(os.path.join(base, item.pop('image_path')))
+            yield item
+
+
+class Command(BaseCommand):
+    help = "Register many users from a directory of face images or a JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Directory of images, or a .jsonl file.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Users inserted per transaction (default: 500).')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Parallel encoding workers (default: FACE_BATCH_WORKERS).')
+
+    def handle(self, *args, **options):
+        source = options['source']
+        if os.path.isdir(source):
+            items = items_from_directory(source)
+        elif os.path.isfile(source):
+            items = items_from_jsonl(source)
+        else:
+            raise CommandError(f"{source} is neither a directory nor a file.")
+
+        registered = rejected = 0
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= options['batch_size']:
+                r, j = self._register(batch, options['workers'])
+                registered, rejected, batch = registered + r, rejected + j, []
+        if batch:
+            r, j = self._register(batch, options['workers'])
+            registered, rejected = registered + r, rejected + j
+        self.stdout.write(self.style.SUCCESS(f"Registered {registered} users, rejected {rejected}."))
+
+    def _register(self, batch, workers):
+        registered = 0
+        for result in register_batch(batch, workers=workers):
+            if result['status'] == 201:
+                registered += 1
+            else:
+                self.stderr.write(f"{result['unique_id']}: {result['message']}")
+        return registered, len(batch) - registered
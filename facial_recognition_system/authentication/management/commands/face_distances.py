@@ -0,0 +1,80 @@
+import json
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.distances import accepted_share, distance_histograms, threshold_for_rate
+from authentication.faces import FACE_MATCH_TOLERANCE
+from authentication.gallery import load_embeddings
+
+
+def _rates(value):
+    try:
+        return [float(rate) for rate in value.split(',')]
+    except ValueError:
+        raise CommandError(f"--rates must be comma-separated numbers, got {value!r}")
+
+
+class Command(BaseCommand):
+    help = ("Compute the distribution of distances between all stored embeddings and suggest "
+            "FACE_MATCH_TOLERANCE values for target false-match rates.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=0,
+                            help='Use this many randomly chosen members instead of all (pairs grow quadratically).')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for --sample.')
+        parser.add_argument('--bin-width', type=float, default=0.005, help='Histogram bin width (default: 0.005).')
+        parser.add_argument('--max-distance', type=float, default=1.5,
+                            help='Last histogram edge; larger distances fall in the last bin (default: 1.5).')
+        parser.add_argument('--rates', type=_rates, default=[1e-3, 1e-4, 1e-5, 1e-6],
+                            help='Comma-separated impostor pair false-match rates to suggest thresholds for.')
+        parser.add_argument('--output', help='Write the histograms and suggestions to this JSON file.')
+
+    def handle(self, *args, **options):
+        ids, matrix = load_embeddings()
+        if options['sample']:
+            members = np.unique(ids)
+            if options['sample'] < len(members):
+                rng = np.random.default_rng(options['seed'])
+                keep = np.isin(ids, rng.choice(members, options['sample'], replace=False))
+                ids, matrix = ids[keep], matrix[keep]
+        if len(ids) < 2:
+            raise CommandError("At least two stored embeddings are needed.")
+
+        bins = max(1, int(round(options['max_distance'] / options['bin_width'])))
+        edges = np.linspace(0.0, bins * options['bin_width'], bins + 1)
+        impostor, genuine = distance_histograms(ids, matrix, edges)
+
+        self.stdout.write(f"{len(np.unique(ids))} members, {len(ids)} embeddings: "
+                          f"{impostor.sum()} impostor pairs, {genuine.sum()} genuine (same-member) pairs")
+        if impostor.sum():
+            nearest = edges[np.flatnonzero(impostor)[0]]
+            self.stdout.write(f"Closest impostor pair: {nearest:.3f}-{nearest + options['bin_width']:.3f}")
+        suggestions = []
+        for rate in options['rates']:
+            threshold = threshold_for_rate(impostor, edges, rate)
+            suggestions.append({'false_match_rate': rate, 'threshold': round(threshold, 4),
+                                'genuine_accepted': round(accepted_share(genuine, edges, threshold), 4)})
+        current = {'threshold': FACE_MATCH_TOLERANCE,
+                   'false_match_rate': accepted_share(impostor, edges, FACE_MATCH_TOLERANCE),
+                   'genuine_accepted': round(accepted_share(genuine, edges, FACE_MATCH_TOLERANCE), 4)}
+
+        self.stdout.write(f"{'false match rate':>18}  {'threshold':>9}  {'genuine accepted':>16}")
+        for row in suggestions:
+            genuine_text = f"{row['genuine_accepted']:.2%}" if genuine.sum() else 'n/a'
+            self.stdout.write(f"{row['false_match_rate']:>18g}  {row['threshold']:>9.3f}  {genuine_text:>16}")
+        self.stdout.write(f"Current FACE_MATCH_TOLERANCE {FACE_MATCH_TOLERANCE}: "
+                          f"false match rate {current['false_match_rate']:.2g} per pair")
+
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump({
+                    'members': int(len(np.unique(ids))),
+                    'embeddings': int(len(ids)),
+                    'edges': [round(float(edge), 6) for edge in edges],
+                    'impostor': impostor.tolist(),
+                    'genuine': genuine.tolist(),
+                    'suggestions': suggestions,
+                    'current': current,
+                }, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}."))
@@ -0,0 +1,280 @@
+"""
+Per-stage latency of the face pipeline, exported in the Prometheus text format.
+
+Code wraps each pipeline step in ``stage(name)``; the duration goes into the
+``face_stage_seconds`` histogram and, during a request, into that request's
+timings, which ``StageTimingMiddleware`` turns into a ``Server-Timing`` header
+when ``FACE_SERVER_TIMING`` is on. Detection and encoding run in engine worker
+processes, so the engine reports their durations back with each result.
+
+Each process keeps its own counts. With several server processes, set
+``FACE_METRICS_DIR`` and every process also writes its counts there (about once
+a second), so ``/metrics`` on any of them reports the sum over all of them.
+Files of processes that have exited are folded into ``retired.json`` and
+removed, so restarted workers neither lose nor double-count earlier requests.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HISTOGRAMS = {
+    "face_stage_seconds": ("stage", "Time spent in each face pipeline stage."),
+    "face_request_seconds": ("view", "Time to answer a request, by URL name."),
+}
+COUNTERS = {
+    "face_probe_cache_lookups_total": ("result", "Probe cache lookups by authenticate/, by result."),
+}
+
+_lock = threading.Lock()
+# name -> label value -> [count per bucket ..., count above the last bucket, sum of observations]
+_histograms = {name: {} for name in HISTOGRAMS}
+_counters = {name: {} for name in COUNTERS}
+_next_flush = 0.0
+# File name stem of this process in FACE_METRICS_DIR: "<pid>-<token>", so a reused pid gets a new file.
+_process_name = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+RETIRED = "retired.json"
+
+_request_timings = contextvars.ContextVar("face_request_timings", default=None)
+
+
+def observe(name, label, seconds):
+    """Add one observation to histogram ``name``."""
+    with _lock:
+        values = _histograms[name].get(label)
+        if values is None:
+            values = _histograms[name][label] = [0] * (len(BUCKETS) + 2)
+        index = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+        values[index] += 1
+        values[-1] += seconds
+    _maybe_flush()
+
+
+def increment(name, label, amount=1):
+    with _lock:
+        _counters[name][label] = _counters[name].get(label, 0) + amount
+    _maybe_flush()
+
+
+def record_stage(name, seconds):
+    """Record a stage measured elsewhere (e.g. in an engine worker process)."""
+    observe("face_stage_seconds", name, seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as pipeline stage ``name``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def _snapshot():
+    with _lock:
+        return {
+            "histograms": {name: {label: list(v) for label, v in values.items()} for name, values in _histograms.items()},
+            "counters": {name: dict(values) for name, values in _counters.items()},
+        }
+
+
+def _after_fork():
+    # A forked child starts counting from zero under its own name; the parent's counts stay in the parent's file.
+    global _process_name, _next_flush
+    _process_name = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    _next_flush = 0.0
+    with _lock:
+        for values in (*_histograms.values(), *_counters.values()):
+            values.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _write(path, data):
+    with open(f"{path}.tmp", "w") as fh:
+        json.dump(data, fh)
+    os.replace(f"{path}.tmp", path)
+
+
+def _read(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _maybe_flush(force=False):
+    global _next_flush
+    directory = settings.FACE_METRICS_DIR
+    if not directory or (not force and time.monotonic() < _next_flush):
+        return
+    _next_flush = time.monotonic() + 1.0
+    _write(os.path.join(directory, f"{_process_name}.json"), _snapshot())
+
+
+def _empty():
+    return {"histograms": {name: {} for name in HISTOGRAMS}, "counters": {name: {} for name in COUNTERS}}
+
+
+def _add(merged, snapshot):
+    for name, values in snapshot.get("histograms", {}).items():
+        for label, counts in values.items():
+            total = merged["histograms"].setdefault(name, {}).setdefault(label, [0] * len(counts))
+            merged["histograms"][name][label] = [a + b for a, b in zip(total, counts)]
+    for name, values in snapshot.get("counters", {}).items():
+        for label, value in values.items():
+            merged["counters"].setdefault(name, {})[label] = merged["counters"][name].get(label, 0) + value
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _dead_process_files(directory):
+    for filename in os.listdir(directory):
+        stem, ext = os.path.splitext(filename)
+        pid = stem.split("-")[0]
+        if ext == ".json" and pid.isdigit() and not _alive(int(pid)):
+            yield filename
+
+
+def _retire_dead(directory):
+    """Fold the counts of exited processes into RETIRED and delete their files (like mark_process_dead)."""
+    dead = list(_dead_process_files(directory))
+    if not dead:
+        return
+    retired = _read(os.path.join(directory, RETIRED)) or _empty()
+    for filename in dead:
+        _add(retired, _read(os.path.join(directory, filename)) or {})
+    _write(os.path.join(directory, RETIRED), retired)
+    for filename in dead:
+        os.remove(os.path.join(directory, filename))
+
+
+def _merged():
+    """Counts of this process, or of every process (running or exited) writing to FACE_METRICS_DIR."""
+    directory = settings.FACE_METRICS_DIR
+    if not directory:
+        return _snapshot()
+    import fcntl
+
+    _maybe_flush(force=True)
+    merged = _empty()
+    # Retiring and reading under one lock, so no scrape sees a dead process's counts twice.
+    with open(os.path.join(directory, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        _retire_dead(directory)
+        for filename in os.listdir(directory):
+            if filename.endswith(".json"):
+                _add(merged, _read(os.path.join(directory, filename)) or {})
+    return merged
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    from .gallery import get_gallery
+    from .hash_index import get_hash_index
+
+    data = _merged()
+    lines = []
+    for name, (label_name, help_text) in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for label, values in sorted(data["histograms"].get(name, {}).items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), values[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{label_name}="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{label_name}="{label}"}} {_format(values[-1])}')
+            lines.append(f'{name}_count{{{label_name}="{label}"}} {cumulative}')
+    for name, (label_name, help_text) in COUNTERS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for label, value in sorted(data["counters"].get(name, {}).items()):
+            lines.append(f'{name}{{{label_name}="{label}"}} {value}')
+
+    lookups = data["counters"].get("face_probe_cache_lookups_total", {})
+    total = sum(lookups.values())
+    gauges = [
+        ("face_gallery_size", "Members searchable by this process.", len(get_gallery())),
+        ("face_hash_index_size", "Image hashes in this process's near-duplicate index.", len(get_hash_index())),
+        ("face_probe_cache_hit_ratio", "Share of probe cache lookups that were hits.",
+         lookups.get("hit", 0) / total if total else 0.0),
+    ]
+    for name, help_text, value in gauges:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {_format(value)}"]
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class StageTimingMiddleware:
+    """Collect stage timings per request, observe its total, and add ``Server-Timing`` if enabled."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        timings, token, start = self._begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self._finish(request, response, timings, start)
+
+    async def _acall(self, request):
+        timings, token, start = self._begin()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self._finish(request, response, timings, start)
+
+    def _begin(self):
+        # A mutable list, so stages recorded in sync_to_async threads (which run in a copy of this context) land here.
+        timings = []
+        return timings, _request_timings.set(timings), time.perf_counter()
+
+    def _finish(self, request, response, timings, start):
+        elapsed = time.perf_counter() - start
+        match = getattr(request, "resolver_match", None)
+        if match is not None and match.url_name:
+            observe("face_request_seconds", match.url_name, elapsed)
+        if settings.FACE_SERVER_TIMING and timings:
+            entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings]
+            entries.append(f"total;dur={elapsed * 1000:.1f}")
+            response["Server-Timing"] = ", ".join(entries)
+        return response
@@ -0,0 +1,61 @@
+# Convert face_embedding from a Python list repr (TextField) to 128 x float32 bytes.
+
+import ast
+
+import numpy as np
+from django.db import migrations, models
+
+EMBEDDING_DIM = 128
+
+
+def text_to_binary(apps, schema_editor):
+    User = apps.get_model('authentication', 'User')
+    for user in User.objects.all().only('id', 'face_embedding').iterator():
+        try:
+            vector = np.asarray(ast.literal_eval(user.face_embedding), dtype='<f4')
+        except (ValueError, SyntaxError, TypeError):
+            vector = None
+        if vector is None or vector.shape != (EMBEDDING_DIM,):
+            data = b''
+        else:
+            data = vector.tobytes()
+        User.objects.filter(pk=user.pk).update(face_embedding_bin=data)
+
+
+def binary_to_text(apps, schema_editor):
+    User = apps.get_model('authentication', 'User')
+    for user in User.objects.all().only('id', 'face_embedding_bin').iterator():
+        data = bytes(user.face_embedding_bin or b'')
+        text = str(np.frombuffer(data, dtype='<f4').astype(float).tolist()) if data else ''
+        User.objects.filter(pk=user.pk).update(face_embedding=text)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0002_user_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='face_embedding_bin',
+            field=models.BinaryField(default=b''),
+        ),
+        # Give the text column a default so the reverse RemoveField can re-add it.
+        migrations.AlterField(
+            model_name='user',
+            name='face_embedding',
+            field=models.TextField(default=''),
+        ),
+        migrations.RunPython(text_to_binary, binary_to_text),
+        migrations.RemoveField(
+            model_name='user',
+            name='face_embedding',
+        ),
+        migrations.RenameField(
+            model_name='user',
+            old_name='face_embedding_bin',
+            new_name='face_embedding',
+        ),
+    ]
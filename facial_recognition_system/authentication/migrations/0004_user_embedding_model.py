@@ -0,0 +1,18 @@
+# Generated manually for tracking which model produced each face embedding
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_binary_face_embedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='embedding_model',
+            field=models.CharField(db_index=True, default='dlib_resnet_v1', max_length=50),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated manually for multi-embedding member templates
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0005_gallerychange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaceTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('face_embedding', models.BinaryField()),
+                ('embedding_model', models.CharField(default='dlib_resnet_v1', max_length=50)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='templates', to='authentication.user')),
+            ],
+        ),
+    ]
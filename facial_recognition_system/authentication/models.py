@@ -1,12 +1,46 @@
+import numpy as np
 from django.db import models
 
-# Create your models here.
+# dlib face encodings are 128 floats; stored as little-endian float32 (512 bytes per member).
+EMBEDDING_DIM = 128
+EMBEDDING_DTYPE = np.dtype('<f4')
+EMBEDDING_BYTES = EMBEDDING_DIM * EMBEDDING_DTYPE.itemsize
+# Identifies the network that produced an embedding; vectors from different models are not comparable.
+EMBEDDING_MODEL = 'dlib_resnet_v1'
+
+
+def embedding_to_bytes(encoding):
+    """Serialize a face encoding to the compact binary format stored in User.face_embedding."""
+    return np.asarray(encoding, dtype=EMBEDDING_DTYPE).reshape(EMBEDDING_DIM).tobytes()
+
+
+def embedding_from_bytes(data):
+    """Return a stored face_embedding as a float32 vector, or None if it is empty or malformed."""
+    if data is None or len(data) != EMBEDDING_BYTES:
+        return None
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPE)
+
 
 class User(models.Model):
     unique_id = models.CharField(max_length=100, unique=True)
     name = models.CharField(max_length=100)
-    face_embedding = models.TextField()  # Store as JSON or string
+    face_embedding = models.BinaryField(default=b'')  # 128 x float32, see embedding_to_bytes()
+    embedding_model = models.CharField(max_length=50, default=EMBEDDING_MODEL, db_index=True)
     image_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)  # Perceptual hash for duplicate detection
 
     def __str__(self):
         return self.name
+
+
+class FaceTemplate(models.Model):
+    """An additional embedding of a member (other lighting, pose, glasses); matched alongside User.face_embedding."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='templates')
+    face_embedding = models.BinaryField()  # 128 x float32, see embedding_to_bytes()
+    embedding_model = models.CharField(max_length=50, default=EMBEDDING_MODEL)
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class GalleryChange(models.Model):
+    """A User row whose embedding or image hash changed; see changes.py."""
+    user_id = models.BigIntegerField()  # not a foreign key: deleted users are published too
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
@@ -0,0 +1,65 @@
+"""
+Cache of authenticate/ probe results keyed by image content.
+
+Kiosks often resend the identical image after a network hiccup. The first
+request stores the probe's encoding together with its match and the gallery
+generation it was found in; a retry skips decoding, detection and encoding, and
+also the search unless the gallery has changed since (a member was added,
+re-registered or deleted), in which case the cached encoding is searched again.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .metrics import increment
+from .models import embedding_from_bytes, embedding_to_bytes
+
+
+def _cache():
+    return caches['face_probes']
+
+
+def probe_key(face_image, options):
+    """Cache key for an uploaded image (base64 string or bytes) and the options that affect its encoding."""
+    if not settings.FACE_PROBE_CACHE_TTL:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(face_image.encode() if isinstance(face_image, str) else face_image)
+    digest.update(repr(sorted(options.items())).encode())
+    return f"probe:{digest.hexdigest()}"
+
+
+def get_probe(key):
+    """Return (encoding, user_id, distance, generation) cached under ``key``, or None."""
+    if key is None:
+        return None
+    entry = _cache().get(key)
+    increment("face_probe_cache_lookups_total", "miss" if entry is None else "hit")
+    if entry is None:
+        return None
+    encoding = embedding_from_bytes(entry['encoding'])
+    if encoding is None:
+        return None
+    return encoding, entry['user_id'], entry['distance'], entry['generation']
+
+
+def set_probe(key, encoding, user_id, distance, generation):
+    if key is not None:
+        _cache().set(key, {
+            'encoding': embedding_to_bytes(encoding),
+            'user_id': user_id,
+            'distance': distance,
+            'generation': generation,
+        })
+
+
+def remember_encoding(key, encoding):
+    """Cache just the encoding, for a request that did not search the gallery, unless ``key`` has an entry already."""
+    if key is not None:
+        _cache().add(key, {
+            'encoding': embedding_to_bytes(encoding),
+            'user_id': None,
+            'distance': None,
+            'generation': None,
+        })
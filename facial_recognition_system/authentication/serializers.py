@@ -1,15 +1,75 @@
+import base64
+import binascii
+
+import numpy as np
 from rest_framework import serializers
-from .models import User
+from .models import EMBEDDING_BYTES, EMBEDDING_DIM, EMBEDDING_DTYPE, EMBEDDING_MODEL, User
+
+
+class EmbeddingField(serializers.Field):
+    """A 128-d face embedding sent as a JSON array of numbers or base64 of 128 little-endian float32s."""
+
+    default_error_messages = {
+        'invalid': f'Expected a list of {EMBEDDING_DIM} numbers or base64 of {EMBEDDING_BYTES} bytes.',
+        'not_finite': 'Embedding values must be finite numbers.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            try:
+                raw = base64.b64decode(data, validate=True)
+            except (binascii.Error, ValueError):
+                self.fail('invalid')
+            if len(raw) != EMBEDDING_BYTES:
+                self.fail('invalid')
+            vector = np.frombuffer(raw, dtype=EMBEDDING_DTYPE)
+        elif isinstance(data, list) and len(data) == EMBEDDING_DIM and all(
+                isinstance(x, (int, float)) and not isinstance(x, bool) for x in data):
+            vector = np.asarray(data, dtype=EMBEDDING_DTYPE)
+        else:
+            self.fail('invalid')
+        if not np.all(np.isfinite(vector)):
+            self.fail('not_finite')
+        return vector
+
+    def to_representation(self, value):
+        return np.frombuffer(value, dtype=EMBEDDING_DTYPE).tolist()
+
 
 class UserSerializer(serializers.ModelSerializer):
-    unique_id = serializers.CharField(required=False)
-    name = serializers.CharField(required=False)
+    unique_id = serializers.CharField(required=False, max_length=100)
+    name = serializers.CharField(required=False, max_length=100)
     image_width = serializers.IntegerField(required=False, min_value=1)
     image_height = serializers.IntegerField(required=False, min_value=1)
     image_depth = serializers.IntegerField(required=False, min_value=1)
-    image_size_limit = serializers.IntegerField(required=False, min_value=1)  # in bytes or KB
-    face_embedding = serializers.CharField(required=False)  # <-- Add required=False here
+    image_size_limit = serializers.IntegerField(required=False, min_value=1)  # in KB
+    face_embedding = EmbeddingField(required=False)  # Pre-computed by the client instead of face_image
+    embedding_model = serializers.ChoiceField(choices=[EMBEDDING_MODEL], required=False)
+    # Face already located by the client: [top, right, bottom, left] in pixels, or the whole image is the face.
+    face_box = serializers.ListField(child=serializers.IntegerField(min_value=0), min_length=4, max_length=4, required=False)
+    face_cropped = serializers.BooleanField(required=False)
+
+    # Request-only options that are not User columns.
+    REQUEST_FIELDS = ('image_width', 'image_height', 'image_depth', 'image_size_limit', 'face_box', 'face_cropped')
 
     class Meta:
         model = User
-        fields = ['unique_id', 'name', 'face_embedding', 'image_width', 'image_height', 'image_depth', 'image_size_limit', 'image_hash'] 
\ No newline at end of file
+        fields = ['unique_id', 'name', 'face_embedding', 'embedding_model', 'image_width', 'image_height', 'image_depth', 'image_size_limit', 'image_hash',
+                  'face_box', 'face_cropped']
+
+    def validate_face_box(self, value):
+        top, right, bottom, left = value
+        if bottom <= top or right <= left:
+            raise serializers.ValidationError("face_box must be [top, right, bottom, left] with bottom > top and right > left.")
+        return value
+
+    def create(self, validated_data):
+        for field in self.REQUEST_FIELDS:
+            validated_data.pop(field, None)
+        return super().create(validated_data)
+
+
+class SearchSerializer(serializers.Serializer):
+    """Options of search/: how many members to return and whether to bypass the approximate index."""
+    k = serializers.IntegerField(required=False, default=5, min_value=1, max_value=100)
+    exact = serializers.BooleanField(required=False, default=False)
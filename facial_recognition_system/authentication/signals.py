@@ -0,0 +1,61 @@
+"""
+Keep the in-memory face gallery and image-hash index in sync with User and
+FaceTemplate rows, and tell other processes about the change.
+
+The change is published inside the saving transaction (it is a row of its
+own), but the in-memory structures are only updated once that transaction
+commits, so a rolled-back save leaves no phantom member behind.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .changes import publish_changes
+from .gallery import get_gallery, member_embeddings
+from .hash_index import get_hash_index
+from .models import EMBEDDING_MODEL, FaceTemplate, User, embedding_from_bytes
+
+
+def _set_member(user_id, vectors):
+    if len(vectors):
+        get_gallery().add(user_id, vectors)
+    else:
+        get_gallery().remove(user_id)
+
+
+@receiver(post_save, sender=User)
+def add_user_to_gallery(sender, instance, created=False, **kwargs):
+    user_id, image_hash = instance.pk, instance.image_hash
+    if created:
+        # A new member has no templates yet, so there is nothing to read back.
+        vector = embedding_from_bytes(instance.face_embedding)
+        vectors = [vector] if vector is not None and instance.embedding_model == EMBEDDING_MODEL else []
+
+    def apply():
+        if created:
+            _set_member(user_id, vectors)
+        else:
+            _set_member(*next(member_embeddings([user_id])))
+        get_hash_index().add(user_id, image_hash)
+
+    transaction.on_commit(apply)
+    publish_changes([user_id])
+
+
+@receiver(post_delete, sender=User)
+def remove_user_from_gallery(sender, instance, **kwargs):
+    user_id = instance.pk
+
+    def apply():
+        get_gallery().remove(user_id)
+        get_hash_index().remove(user_id)
+
+    transaction.on_commit(apply)
+    publish_changes([user_id])
+
+
+@receiver([post_save, post_delete], sender=FaceTemplate)
+def update_member_templates(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: _set_member(*next(member_embeddings([user_id]))))
+    publish_changes([user_id])
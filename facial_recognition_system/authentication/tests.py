@@ -2,20 +2,47 @@
 Comprehensive tests for registration and authentication APIs.
 Uses mocks for face_recognition so all branches are tested without real face images.
 """
-from unittest.mock import patch, MagicMock
+import asyncio
+import base64
+import io
+import json
+import os
+import tempfile
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+import cv2
+import imagehash
 import numpy as np
-from django.test import TestCase
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import transaction
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import QueryDict
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from .models import User
+from . import benchmark, warmup
+from .changes import DatabaseChangeFeed
+from .distances import distance_histograms, threshold_for_rate
+from .gallery import FaceGallery, get_gallery
+from .gallery_file import SharedFaceGallery
+from .hash_index import HashIndex, get_hash_index
+from .engine import EncodingEngine, FaceImageError, detection_scale, encode_face
+from .faces import decode_image_bytes, image_phash
+from .index import IVFIndex, nearest_centroids, train_kmeans
+from .serializers import UserSerializer
+from .uploads import ImageUploadParser, UploadTooLarge
+from .views import AsyncAuthenticateUser, AsyncRegisterUser
+from .models import EMBEDDING_BYTES, FaceTemplate, GalleryChange, User, embedding_from_bytes, embedding_to_bytes
 
 
 # Placeholder for "valid" image in tests. We mock decode_base64_image to return a real array.
 VALID_IMAGE_B64_PLACEHOLDER = "valid_image_b64_placeholder"
 
 
-def _fake_decode_base64_image(base64_string):
+def _fake_decode_base64_image(base64_string, max_side=None):
     """Return a valid BGR image so view proceeds; used when we mock face_recognition."""
     if base64_string == VALID_IMAGE_B64_PLACEHOLDER:
         return np.zeros((100, 100, 3), dtype=np.uint8)
@@ -26,8 +53,19 @@ def _mock_face_encoding():
     return np.zeros(128, dtype=np.float64)
 
 
-class RegisterAPITests(TestCase):
+class FreshStateMixin:
+    """Start every test with the process-wide gallery and hash index unloaded and the probe cache empty."""
+
     def setUp(self):
+        super().setUp()
+        get_gallery().invalidate()
+        get_hash_index().invalidate()
+        caches["face_probes"].clear()
+
+
+class RegisterAPITests(FreshStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
         self.client = APIClient()
         self.register_url = "/api/authentication/register/"
 
@@ -53,7 +91,7 @@ class RegisterAPITests(TestCase):
         self.assertIn("Invalid", data["message"])
 
     @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
-    @patch("authentication.views.face_recognition.face_locations")
+    @patch("authentication.engine.face_recognition.face_locations")
     def test_register_no_face_in_image_returns_400(self, mock_face_locations):
         """When no face is detected, return 400 with 'No face found'."""
         mock_face_locations.return_value = []
@@ -67,8 +105,8 @@ class RegisterAPITests(TestCase):
         self.assertIn("No face found", response.json().get("message", ""))
 
     @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
-    @patch("authentication.views.face_recognition.face_encodings")
-    @patch("authentication.views.face_recognition.face_locations")
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
     def test_register_face_encoding_fails_returns_400(
         self, mock_face_locations, mock_face_encodings
     ):
@@ -85,15 +123,14 @@ class RegisterAPITests(TestCase):
         self.assertIn("Could not extract face encoding", response.json().get("message", ""))
 
     @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
-    @patch("authentication.views.face_recognition.face_distance")
-    @patch("authentication.views.face_recognition.face_encodings")
-    @patch("authentication.views.face_recognition.face_locations")
-    @patch("authentication.views.imagehash.phash")
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
+    @patch("authentication.views.image_phash")
     def test_register_success_returns_201(
-        self, mock_phash, mock_face_locations, mock_face_encodings, mock_face_distance
+        self, mock_phash, mock_face_locations, mock_face_encodings
     ):
         """Valid new user registration returns 201."""
-        mock_phash.return_value = MagicMock(__str__=lambda s: "hash1")
+        mock_phash.return_value = "hash1"
         mock_face_locations.return_value = [(10, 20, 30, 10)]
         mock_face_encodings.return_value = [_mock_face_encoding()]
         payload = {
@@ -107,23 +144,24 @@ class RegisterAPITests(TestCase):
         self.assertEqual(User.objects.count(), 1)
         u = User.objects.get(unique_id="user1")
         self.assertEqual(u.name, "Alice")
+        self.assertEqual(len(u.face_embedding), EMBEDDING_BYTES)
+        np.testing.assert_array_equal(embedding_from_bytes(u.face_embedding), _mock_face_encoding())
 
     @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
-    @patch("authentication.views.face_recognition.face_distance")
-    @patch("authentication.views.face_recognition.face_encodings")
-    @patch("authentication.views.face_recognition.face_locations")
-    @patch("authentication.views.imagehash.phash")
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
+    @patch("authentication.views.image_phash")
     def test_register_duplicate_image_same_hash_returns_400(
-        self, mock_phash, mock_face_locations, mock_face_encodings, mock_face_distance
+        self, mock_phash, mock_face_locations, mock_face_encodings
     ):
         """Same image (same perceptual hash) for different unique_id returns 400."""
-        mock_phash.return_value = MagicMock(__str__=lambda s: "samehash")
+        mock_phash.return_value = "samehash"
         mock_face_locations.return_value = [(10, 20, 30, 10)]
         mock_face_encodings.return_value = [_mock_face_encoding()]
         User.objects.create(
             unique_id="existing",
             name="Existing",
-            face_embedding=str(_mock_face_encoding().tolist()),
+            face_embedding=embedding_to_bytes(_mock_face_encoding()),
             image_hash="samehash",
         )
         payload = {
@@ -139,22 +177,22 @@ class RegisterAPITests(TestCase):
         self.assertIn("existing", data["message"])
 
     @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
-    @patch("authentication.views.face_recognition.face_distance")
-    @patch("authentication.views.face_recognition.face_encodings")
-    @patch("authentication.views.face_recognition.face_locations")
-    @patch("authentication.views.imagehash.phash")
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
+    @patch("authentication.views.image_phash")
     def test_register_same_face_different_photo_returns_400(
-        self, mock_phash, mock_face_locations, mock_face_encodings, mock_face_distance
+        self, mock_phash, mock_face_locations, mock_face_encodings
     ):
         """Same person (face match) registering with different photo under new ID returns 400."""
-        mock_phash.return_value = MagicMock(__str__=lambda s: "differenthash")
+        mock_phash.return_value = "differenthash"
         mock_face_locations.return_value = [(10, 20, 30, 10)]
         mock_face_encodings.return_value = [_mock_face_encoding()]
-        mock_face_distance.return_value = np.array([0.35])
+        stored = _mock_face_encoding()
+        stored[0] = 0.35
         User.objects.create(
             unique_id="member25",
             name="Member 25",
-            face_embedding=str(_mock_face_encoding().tolist()),
+            face_embedding=embedding_to_bytes(stored),
             image_hash="hash25",
         )
         payload = {
@@ -168,25 +206,24 @@ class RegisterAPITests(TestCase):
         self.assertIn("message", data)
         self.assertIn("already registered", data["message"].lower())
         self.assertIn("member25", data["message"])
+        self.assertAlmostEqual(data["distance"], 0.35, places=4)
         self.assertEqual(User.objects.count(), 1)
 
     @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
-    @patch("authentication.views.face_recognition.face_distance")
-    @patch("authentication.views.face_recognition.face_encodings")
-    @patch("authentication.views.face_recognition.face_locations")
-    @patch("authentication.views.imagehash.phash")
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
+    @patch("authentication.views.image_phash")
     def test_register_duplicate_unique_id_returns_400(
-        self, mock_phash, mock_face_locations, mock_face_encodings, mock_face_distance
+        self, mock_phash, mock_face_locations, mock_face_encodings
     ):
         """Registering again with same unique_id returns 400 (IntegrityError)."""
-        mock_phash.return_value = MagicMock(__str__=lambda s: "hash2")
+        mock_phash.return_value = "hash2"
         mock_face_locations.return_value = [(10, 20, 30, 10)]
         mock_face_encodings.return_value = [_mock_face_encoding()]
-        mock_face_distance.return_value = np.array([0.5])
         User.objects.create(
             unique_id="dup",
             name="First",
-            face_embedding=str(_mock_face_encoding().tolist()),
+            face_embedding=embedding_to_bytes(np.full(128, 0.5)),
             image_hash="hash1",
         )
         payload = {
@@ -199,8 +236,9 @@ class RegisterAPITests(TestCase):
         self.assertIn("already exists", response.json().get("message", "").lower())
 
 
-class AuthenticateAPITests(TestCase):
+class AuthenticateAPITests(FreshStateMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.client = APIClient()
         self.auth_url = "/api/authentication/authenticate/"
 
@@ -219,7 +257,7 @@ class AuthenticateAPITests(TestCase):
         self.assertIn("Invalid", response.json().get("message", ""))
 
     @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
-    @patch("authentication.views.face_recognition.face_locations")
+    @patch("authentication.engine.face_recognition.face_locations")
     def test_authenticate_no_face_returns_400(self, mock_face_locations):
         """When no face in image, return 400."""
         mock_face_locations.return_value = []
@@ -229,8 +267,8 @@ class AuthenticateAPITests(TestCase):
         self.assertIn("No face found", response.json().get("message", ""))
 
     @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
-    @patch("authentication.views.face_recognition.face_encodings")
-    @patch("authentication.views.face_recognition.face_locations")
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
     def test_authenticate_no_match_returns_401(
         self, mock_face_locations, mock_face_encodings
     ):
@@ -242,16 +280,851 @@ class AuthenticateAPITests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
         self.assertIn("No matching user found", response.json().get("message", ""))
 
+    @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
+    def test_authenticate_returns_nearest_user(
+        self, mock_face_locations, mock_face_encodings
+    ):
+        """The closest member within tolerance wins, not the first one stored."""
+        mock_face_locations.return_value = [(10, 20, 30, 10)]
+        mock_face_encodings.return_value = [_mock_face_encoding()]
+        User.objects.create(
+            unique_id="far", name="Far", face_embedding=embedding_to_bytes([0.02] * 128), image_hash="hfar"
+        )
+        User.objects.create(
+            unique_id="near", name="Near", face_embedding=embedding_to_bytes([0.01] * 128), image_hash="hnear"
+        )
+        payload = {"face_image": VALID_IMAGE_B64_PLACEHOLDER}
+        response = self.client.post(self.auth_url, payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json().get("unique_id"), "near")
+
+    @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
+    def test_authenticate_after_delete_returns_401(
+        self, mock_face_locations, mock_face_encodings
+    ):
+        """Deleting a member removes them from the loaded gallery."""
+        mock_face_locations.return_value = [(10, 20, 30, 10)]
+        mock_face_encodings.return_value = [_mock_face_encoding()]
+        User.objects.create(
+            unique_id="gone", name="Gone", face_embedding=embedding_to_bytes(_mock_face_encoding()), image_hash="hgone"
+        )
+        payload = {"face_image": VALID_IMAGE_B64_PLACEHOLDER}
+        self.assertEqual(self.client.post(self.auth_url, payload, format="json").status_code, status.HTTP_200_OK)
+        self.client.delete("/api/authentication/delete/gone/")
+        response = self.client.post(self.auth_url, payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ProbeCacheTests(FreshStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.auth_url = "/api/authentication/authenticate/"
+        self.payload = {"face_image": VALID_IMAGE_B64_PLACEHOLDER}
+        User.objects.create(
+            unique_id="kiosk", name="Kiosk", face_embedding=embedding_to_bytes(_mock_face_encoding()), image_hash="hk"
+        )
+
+    @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
+    def test_retry_reuses_cached_probe_until_gallery_changes(self, mock_face_locations, mock_face_encodings):
+        mock_face_locations.return_value = [(10, 20, 30, 10)]
+        mock_face_encodings.return_value = [_mock_face_encoding()]
+        for _ in range(2):
+            response = self.client.post(self.auth_url, self.payload, format="json")
+            self.assertEqual(response.json().get("unique_id"), "kiosk")
+        self.assertEqual(mock_face_encodings.call_count, 1)
 
-class DeleteUserAPITests(TestCase):
+        self.client.delete("/api/authentication/delete/kiosk/")
+        response = self.client.post(self.auth_url, self.payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(mock_face_encodings.call_count, 1)
+
+    @override_settings(FACE_PROBE_CACHE_TTL=0)
+    @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
+    def test_cache_disabled_encodes_every_request(self, mock_face_locations, mock_face_encodings):
+        mock_face_locations.return_value = [(10, 20, 30, 10)]
+        mock_face_encodings.return_value = [_mock_face_encoding()]
+        for _ in range(2):
+            self.client.post(self.auth_url, self.payload, format="json")
+        self.assertEqual(mock_face_encodings.call_count, 2)
+
+
+class VerifyAPITests(FreshStateMixin, TestCase):
     def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.auth_url = "/api/authentication/authenticate/"
+        User.objects.create(unique_id="door", name="Door", face_embedding=embedding_to_bytes(np.full(128, 0.1)))
+        User.objects.create(unique_id="other", name="Other", face_embedding=embedding_to_bytes(np.full(128, 0.5)))
+
+    def test_verify_compares_only_the_claimed_member(self):
+        probe = np.full(128, 0.11).tolist()
+        response = self.client.post(self.auth_url, {"unique_id": "door", "face_embedding": probe}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["unique_id"], "door")
+        for unique_id in ("other", "nobody"):
+            response = self.client.post(self.auth_url, {"unique_id": unique_id, "face_embedding": probe}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED, unique_id)
+        self.assertFalse(get_gallery().loaded)
+
+    @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
+    def test_verify_result_is_not_reused_for_identification(self, mock_face_locations, mock_face_encodings):
+        mock_face_locations.return_value = [(10, 20, 30, 10)]
+        mock_face_encodings.return_value = [np.full(128, 0.1)]
+        payload = {"face_image": VALID_IMAGE_B64_PLACEHOLDER}
+        response = self.client.post(self.auth_url, {**payload, "unique_id": "other"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(self.auth_url, payload, format="json")
+        self.assertEqual(response.json().get("unique_id"), "door")
+        self.assertEqual(mock_face_encodings.call_count, 1)
+
+
+class SearchAPITests(FreshStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        for i, value in enumerate((0.1, 0.12, 0.2, 0.5)):
+            User.objects.create(unique_id=f"k{i}", name=f"K{i}", face_embedding=embedding_to_bytes(np.full(128, value)))
+
+    def test_returns_k_nearest_with_distances(self):
+        probe = np.full(128, 0.1).tolist()
+        response = self.client.post("/api/authentication/search/", {"face_embedding": probe, "k": 3}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()["results"]
+        self.assertEqual([r["unique_id"] for r in results], ["k0", "k1", "k2"])
+        self.assertEqual([r["match"] for r in results], [True, True, False])
+        self.assertAlmostEqual(results[1]["distance"], 0.02 * np.sqrt(128), places=3)
+        response = self.client.post("/api/authentication/search/", {"face_embedding": probe, "k": 0}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DistanceDistributionTests(TestCase):
+    def test_histograms_agree_with_brute_force(self):
+        rng = np.random.default_rng(0)
+        matrix = rng.normal(scale=0.1, size=(60, 128)).astype(np.float32)
+        ids = np.repeat(np.arange(30), 2)
+        edges = np.linspace(0.0, 2.0, 201)
+        with patch("authentication.distances.BLOCK_ELEMENTS", 500):
+            impostor, genuine = distance_histograms(ids, matrix, edges)
+        i, j = np.triu_indices(60, k=1)
+        dist = np.linalg.norm(matrix[i] - matrix[j], axis=1)
+        same = ids[i] == ids[j]
+        np.testing.assert_array_equal(impostor, np.histogram(dist[~same], edges)[0])
+        np.testing.assert_array_equal(genuine, np.histogram(dist[same], edges)[0])
+        threshold = threshold_for_rate(impostor, edges, 0.01)
+        self.assertLessEqual((dist[~same] < threshold).mean(), 0.01)
+
+    def test_command_writes_suggestions(self):
+        for i, vector in enumerate(np.random.default_rng(1).normal(scale=0.1, size=(20, 128))):
+            User.objects.create(unique_id=f"d{i}", name=f"D{i}", face_embedding=embedding_to_bytes(vector))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "distances.json")
+            call_command("face_distances", "--rates", "0.01,0.1", "--output", path, stdout=open(os.devnull, "w"))
+            with open(path) as fh:
+                report = json.load(fh)
+        self.assertEqual(sum(report["impostor"]), 190)
+        self.assertEqual([s["false_match_rate"] for s in report["suggestions"]], [0.01, 0.1])
+
+
+class HashIndexTests(FreshStateMixin, TestCase):
+    def test_nearest_agrees_with_brute_force(self):
+        rng = np.random.default_rng(3)
+        stored = [int(v) for v in rng.integers(0, 2 ** 63, 300, dtype=np.int64)]
+        User.objects.bulk_create([
+            User(unique_id=f"h{i}", name=f"H{i}", image_hash=f"{v:016x}") for i, v in enumerate(stored)
+        ])
+        pks = dict(User.objects.values_list("unique_id", "pk"))
+        index = HashIndex()
+        for i, v in enumerate(stored[:50]):
+            probe = v ^ (1 << int(rng.integers(64))) ^ (1 << int(rng.integers(64)))
+            for radius in (1, 6, 20):
+                distances = [bin(probe ^ s).count("1") for s in stored]
+                expected = min(distances)
+                user_id, bits = index.nearest(f"{probe:016x}", radius)
+                if expected <= radius:
+                    self.assertEqual(bits, expected)
+                    self.assertEqual(user_id, pks[f"h{distances.index(expected)}"])
+                else:
+                    self.assertIsNone(user_id)
+        index.remove(pks["h0"])
+        self.assertNotEqual(index.nearest(f"{stored[0]:016x}", 0)[0], pks["h0"])
+
+    @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
+    @patch("authentication.views.image_phash")
+    def test_register_near_identical_image_returns_400(self, mock_phash):
+        User.objects.create(unique_id="orig", name="Original", face_embedding=embedding_to_bytes(_mock_face_encoding()),
+                            image_hash="c3d2a1b0f0e1d2c3")
+        mock_phash.return_value = "c3d2a1b0f0e1d2c0"  # 2 bits away
+        payload = {"unique_id": "copy", "name": "Copy", "face_image": VALID_IMAGE_B64_PLACEHOLDER}
+        response = self.client.post("/api/authentication/register/", payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("near-identical image", response.json()["message"])
+        self.assertEqual(response.json()["hash_distance"], 2)
+
+
+class EmbeddingStorageTests(TestCase):
+    def test_embedding_round_trips_as_float32_bytes(self):
+        vector = np.linspace(-1, 1, 128)
+        data = embedding_to_bytes(vector)
+        self.assertEqual(len(data), EMBEDDING_BYTES)
+        np.testing.assert_allclose(embedding_from_bytes(data), vector, rtol=1e-6)
+
+    def test_malformed_embedding_is_ignored(self):
+        self.assertIsNone(embedding_from_bytes(b""))
+        self.assertIsNone(embedding_from_bytes(b"\x00" * 10))
+
+
+class ClientFaceBoxTests(FreshStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.auth_url = "/api/authentication/authenticate/"
+
+    @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
+    def test_face_box_skips_detection(self, mock_face_locations, mock_face_encodings):
+        mock_face_encodings.return_value = [_mock_face_encoding()]
+        payload = {"face_image": VALID_IMAGE_B64_PLACEHOLDER, "face_box": [20, 80, 80, 20]}
+        response = self.client.post(self.auth_url, payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        mock_face_locations.assert_not_called()
+        crop, locations = mock_face_encodings.call_args[0]
+        self.assertEqual(crop.shape[:2], (100, 100))
+        self.assertEqual(locations, [(20, 80, 80, 20)])
+
+    @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
+    def test_face_cropped_uses_whole_image(self, mock_face_locations, mock_face_encodings):
+        mock_face_encodings.return_value = [_mock_face_encoding()]
+        payload = {"face_image": VALID_IMAGE_B64_PLACEHOLDER, "face_cropped": True}
+        self.client.post(self.auth_url, payload, format="json")
+        mock_face_locations.assert_not_called()
+        self.assertEqual(mock_face_encodings.call_args[0][1], [(0, 100, 100, 0)])
+
+    def test_invalid_face_box_returns_400(self):
+        payload = {"face_image": VALID_IMAGE_B64_PLACEHOLDER, "face_box": [80, 20, 20, 80]}
+        response = self.client.post(self.auth_url, payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("face_box", response.json())
+
+    @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.views.image_phash")
+    def test_register_with_request_options_saves_user(self, mock_phash, mock_face_encodings):
+        """Request-only fields such as image_width and face_box are not passed to the model."""
+        mock_phash.return_value = "hashopts"
+        mock_face_encodings.return_value = [_mock_face_encoding()]
+        payload = {
+            "unique_id": "opts",
+            "name": "Options",
+            "face_image": VALID_IMAGE_B64_PLACEHOLDER,
+            "image_width": 640,
+            "face_box": [10, 90, 90, 10],
+        }
+        response = self.client.post("/api/authentication/register/", payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(User.objects.filter(unique_id="opts").exists())
+
+
+class BinaryUploadTests(FreshStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.png = cv2.imencode(".png", np.zeros((60, 80, 3), dtype=np.uint8))[1].tobytes()
+
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
+    def test_authenticate_multipart_file_is_decoded(self, mock_face_locations, mock_face_encodings):
+        mock_face_locations.return_value = [(10, 50, 50, 10)]
+        mock_face_encodings.return_value = [_mock_face_encoding()]
+        upload = SimpleUploadedFile("face.png", self.png, content_type="image/png")
+        response = self.client.post("/api/authentication/authenticate/", {"face_image": upload}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(mock_face_locations.call_args[0][0].shape, (60, 80, 3))
+
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
+    @patch("authentication.views.image_phash")
+    def test_register_octet_stream_takes_fields_from_query(self, mock_phash, mock_face_locations, mock_face_encodings):
+        mock_phash.return_value = "hashraw"
+        mock_face_locations.return_value = [(10, 50, 50, 10)]
+        mock_face_encodings.return_value = [_mock_face_encoding()]
+        response = self.client.post("/api/authentication/register/?unique_id=raw&name=Raw",
+                                    self.png, content_type="application/octet-stream")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(User.objects.get(unique_id="raw").image_hash, "hashraw")
+
+    @override_settings(FACE_UPLOAD_MAX_BYTES=100)
+    def test_oversized_uploads_return_413(self):
+        response = self.client.post("/api/authentication/authenticate/", self.png,
+                                    content_type="application/octet-stream")
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        upload = SimpleUploadedFile("face.png", self.png, content_type="image/png")
+        response = self.client.post("/api/authentication/register/",
+                                    {"unique_id": "big", "name": "Big", "face_image": upload}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(User.objects.filter(unique_id="big").exists())
+
+    @override_settings(FACE_UPLOAD_MAX_BYTES=1000)
+    def test_raw_body_is_read_without_growing_past_the_limit(self):
+        context = {"request": SimpleNamespace(META={"CONTENT_LENGTH": "600"}, query_params=QueryDict())}
+        data = ImageUploadParser().parse(io.BytesIO(b"x" * 600), parser_context=context)
+        self.assertEqual(bytes(data["face_image"]), b"x" * 600)
+        self.assertEqual(len(data["face_image"].obj), 600)
+
+        stream = io.BytesIO(b"x" * 5000)
+        context["request"].META = {}
+        with self.assertRaises(UploadTooLarge):
+            ImageUploadParser().parse(stream, parser_context=context)
+        self.assertLessEqual(stream.tell(), 1001)
+
+    def test_raw_body_respects_image_size_limit(self):
+        noise = np.random.default_rng(0).integers(0, 256, (60, 80, 3), dtype=np.uint8)
+        response = self.client.post("/api/authentication/authenticate/?image_size_limit=1",
+                                    cv2.imencode(".png", noise)[1].tobytes(), content_type="application/octet-stream")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()["message"], "Image exceeds image_size_limit.")
+
+
+@patch("authentication.engine.face_recognition.face_encodings", lambda img, locations: [_mock_face_encoding()])
+@patch("authentication.engine.face_recognition.face_locations", lambda img, **kwargs: [(10, 50, 50, 10)])
+class MetricsTests(FreshStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.png = base64.b64encode(cv2.imencode(".png", np.zeros((60, 80, 3), dtype=np.uint8))[1]).decode()
+
+    def _authenticate(self):
+        return self.client.post("/api/authentication/authenticate/", {"face_image": self.png}, format="json")
+
+    @override_settings(FACE_SERVER_TIMING=True)
+    def test_server_timing_header_lists_stages(self):
+        response = self._authenticate()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        stages = [entry.split(";")[0] for entry in response["Server-Timing"].split(", ")]
+        for name in ("probe_cache", "base64_decode", "imdecode", "face_locations", "face_encodings", "encode",
+                     "gallery_search", "total"):
+            self.assertIn(name, stages)
+
+    def test_metrics_endpoint(self):
+        self._authenticate()
+        self._authenticate()
+        self.assertNotIn("Server-Timing", self._authenticate())
+        body = self.client.get("/metrics").content.decode()
+        self.assertIn("# TYPE face_stage_seconds histogram", body)
+        self.assertIn('face_stage_seconds_bucket{stage="face_encodings",le="+Inf"}', body)
+        self.assertIn('face_request_seconds_count{view="authenticate"}', body)
+        self.assertIn("face_gallery_size 0", body)
+        self.assertRegex(body, r"face_probe_cache_hit_ratio 0\.\d+")
+
+    def test_metrics_dir_sums_processes(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(FACE_METRICS_DIR=directory):
+            other = {"histograms": {"face_stage_seconds": {"only_elsewhere": [1] + [0] * 13 + [0.5]}},
+                     "counters": {}}
+            with open(os.path.join(directory, "1.json"), "w") as fh:
+                json.dump(other, fh)
+            body = self.client.get("/metrics").content.decode()
+        self.assertIn('face_stage_seconds_count{stage="only_elsewhere"} 1', body)
+        self.assertIn('face_stage_seconds_sum{stage="only_elsewhere"} 0.5', body)
+
+    def test_exited_processes_are_retired_once(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(FACE_METRICS_DIR=directory):
+            exited = {"histograms": {}, "counters": {"face_probe_cache_lookups_total": {"exited": 3}}}
+            for name in ("999999991-aaaa.json", "999999992-bbbb.json"):
+                with open(os.path.join(directory, name), "w") as fh:
+                    json.dump(exited, fh)
+            for _ in range(2):
+                body = self.client.get("/metrics").content.decode()
+                self.assertIn('face_probe_cache_lookups_total{result="exited"} 6', body)
+            self.assertEqual(sorted(f for f in os.listdir(directory) if not f.startswith(str(os.getpid()))),
+                             [".lock", "retired.json"])
+
+
+@patch("authentication.engine.face_recognition.face_encodings", lambda img, locations: [np.ones(128)])
+@patch("authentication.engine.face_recognition.face_locations", lambda img, **kwargs: [(10, 50, 50, 10)])
+class BenchmarkTests(FreshStateMixin, TransactionTestCase):
+    """Runs in autocommit, like the benchmark itself: each request's gallery update happens on commit."""
+
+    @override_settings(FACE_SERVER_TIMING=True)
+    def test_scenarios_report_latency_and_stages(self):
+        benchmark.build_gallery(30)
+        self.assertEqual(len(get_gallery()), 30)
+        png = cv2.imencode(".png", np.zeros((60, 80, 3), dtype=np.uint8))[1].tobytes()
+        results = benchmark.run_scenarios(png, iterations=3, warmup=1)
+        self.assertEqual(set(results), set(benchmark.SCENARIOS))
+        for summary in results.values():
+            self.assertEqual(summary["errors"], 0)
+            self.assertLessEqual(summary["p50_ms"], summary["p99_ms"])
+        self.assertIn("face_locations", results["authenticate"]["stages"])
+        self.assertNotIn("face_locations", results["authenticate_cached"]["stages"])
+        self.assertEqual(User.objects.count(), 31)
+
+    def test_compare_flags_slower_p50(self):
+        baseline = {"runs": [{"gallery_size": 10, "scenarios": {"list": {"p50_ms": 1.0}, "register": {"p50_ms": 5.0}}}]}
+        results = {"runs": [{"gallery_size": 10, "scenarios": {"list": {"p50_ms": 1.5}, "register": {"p50_ms": 5.5}}}]}
+        self.assertEqual(benchmark.compare(results, baseline, 0.2), ["list @ 10: p50 1.0 ms -> 1.5 ms"])
+
+
+class ReducedDecodeTests(TestCase):
+    def test_large_jpeg_is_decoded_at_reduced_scale(self):
+        jpeg = cv2.imencode(".jpg", np.zeros((2000, 2600, 3), dtype=np.uint8))[1].tobytes()
+        self.assertEqual(decode_image_bytes(jpeg).shape, (2000, 2600, 3))
+        self.assertEqual(decode_image_bytes(jpeg, max_side=640).shape, (500, 650, 3))
+        self.assertEqual(decode_image_bytes(jpeg, max_side=3000).shape, (2000, 2600, 3))
+
+    def test_non_jpeg_is_decoded_at_full_size(self):
+        png = cv2.imencode(".png", np.zeros((2000, 2600, 3), dtype=np.uint8))[1].tobytes()
+        self.assertEqual(decode_image_bytes(png, max_side=640).shape, (2000, 2600, 3))
+
+
+class ImagePhashTests(TestCase):
+    def test_matches_imagehash_phash(self):
+        """Stored hashes were made by imagehash; every bit must agree, for downscaled and upscaled frames."""
+        from PIL import Image
+        rng = np.random.default_rng(5)
+        sizes = [(1, 1), (20, 45), (32, 32), (240, 320), (777, 513), (1080, 1920)]
+        images = [rng.integers(0, 256, (h, w, 3), dtype=np.uint8) for h, w in sizes]
+        images += [cv2.GaussianBlur(img, (31, 31), 0) for img in images[3:]]
+        for img in images:
+            expected = str(imagehash.phash(Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))))
+            self.assertEqual(image_phash(img), expected)
+
+
+class PrecomputedEmbeddingTests(FreshStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+    @patch("authentication.views.get_engine")
+    def test_authenticate_with_embedding_skips_image_pipeline(self, mock_get_engine):
+        User.objects.create(unique_id="edge", name="Edge", face_embedding=embedding_to_bytes(np.full(128, 0.1)))
+        vector = np.full(128, 0.11, dtype=np.float32)
+        for embedding in (vector.tolist(), base64.b64encode(vector.tobytes()).decode()):
+            response = self.client.post(
+                "/api/authentication/authenticate/", {"face_embedding": embedding}, format="json"
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()["unique_id"], "edge")
+        mock_get_engine.assert_not_called()
+
+    def test_register_with_embedding_stores_vector(self):
+        payload = {
+            "unique_id": "edge2",
+            "name": "Edge Two",
+            "face_embedding": [0.25] * 128,
+            "embedding_model": "dlib_resnet_v1",
+        }
+        response = self.client.post("/api/authentication/register/", payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user = User.objects.get(unique_id="edge2")
+        self.assertIsNone(user.image_hash)
+        np.testing.assert_array_equal(embedding_from_bytes(user.face_embedding), np.full(128, 0.25))
+
+    def test_invalid_embedding_or_model_returns_400(self):
+        for payload in (
+            {"face_embedding": [0.1] * 127},
+            {"face_embedding": "bm90IGEgdmVjdG9y"},
+            {"face_embedding": [0.1] * 128, "embedding_model": "other_net"},
+        ):
+            response = self.client.post("/api/authentication/authenticate/", payload, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, payload)
+        serializer = UserSerializer(data={"face_embedding": [0.1] * 127 + [float("nan")]})
+        self.assertFalse(serializer.is_valid())
+
+
+class FaceGalleryTests(TestCase):
+    def test_best_match_matches_face_distance(self):
+        """Batched distances agree with face_recognition.face_distance."""
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(scale=0.1, size=(50, 128))
+        for i, vector in enumerate(vectors):
+            User.objects.create(unique_id=f"g{i}", name=f"G{i}", face_embedding=embedding_to_bytes(vector))
+        gallery = FaceGallery()
+        probe = vectors[7] + 0.001
+        user_id, distance = gallery.best_match(probe)
+        self.assertEqual(User.objects.get(pk=user_id).unique_id, "g7")
+        expected = np.linalg.norm(vectors - probe, axis=1)
+        self.assertAlmostEqual(distance, float(expected.min()), places=4)
+
+    def test_add_and_remove_update_loaded_gallery(self):
+        gallery = FaceGallery()
+        gallery.ensure_loaded()
+        gallery.add(1, np.zeros(128))
+        gallery.add(2, np.ones(128))
+        self.assertEqual(len(gallery), 2)
+        self.assertEqual(gallery.best_match(np.ones(128))[0], 2)
+        gallery.remove(2)
+        self.assertEqual(len(gallery), 1)
+        self.assertEqual(gallery.best_match(np.ones(128))[0], 1)
+        gallery.remove(1)
+        self.assertEqual(gallery.best_match(np.ones(128)), (None, float("inf")))
+
+    def test_saved_user_joins_gallery_only_when_committed(self):
+        gallery, hash_index = get_gallery(), get_hash_index()
+        gallery.invalidate()
+        hash_index.invalidate()
+        gallery.ensure_loaded()
+        fields = {"unique_id": "commit", "name": "Commit", "face_embedding": embedding_to_bytes(np.ones(128)),
+                  "image_hash": "0123456789abcdef"}
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            User.objects.create(**fields)
+            raise RuntimeError("rolled back")
+        self.assertEqual(gallery.best_match(np.ones(128)), (None, float("inf")))
+        self.assertEqual(hash_index.nearest(fields["image_hash"], 0), (None, None))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.create(**fields)
+        self.assertEqual(gallery.best_match(np.ones(128))[0], user.pk)
+        self.assertEqual(hash_index.nearest(fields["image_hash"], 0), (user.pk, 0))
+
+
+def _axis(x):
+    vector = np.zeros(128, dtype=np.float32)
+    vector[0] = x
+    return vector
+
+
+class FaceTemplateTests(FreshStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+    def test_members_are_scored_by_aggregation(self):
+        """Member 1 has templates at 0 and 1, member 2 one at 0.45; the probe is at 0.9."""
+        gallery = FaceGallery()
+        gallery.ensure_loaded()
+        gallery.add(1, [_axis(0.0), _axis(1.0)])
+        gallery.add(2, _axis(0.45))
+        self.assertEqual(len(gallery), 2)
+        expected = {"min": (1, 0.1), "mean": (2, 0.45), "centroid": (1, 0.4)}
+        for aggregation, (user_id, distance) in expected.items():
+            with self.subTest(aggregation), override_settings(FACE_TEMPLATE_AGGREGATION=aggregation):
+                ids, dist = gallery.search(_axis(0.9), k=2)
+                self.assertEqual(ids.tolist(), [user_id, 3 - user_id])
+                self.assertAlmostEqual(float(dist[0]), distance, places=5)
+                self.assertEqual(gallery.best_matches([_axis(0.9)])[0].tolist(), [user_id])
+        gallery.add(1, _axis(0.0))
+        self.assertEqual(gallery.best_match(_axis(0.9))[0], 2)
+
+    def test_added_template_is_matched_until_deleted(self):
+        User.objects.create(unique_id="tpl", name="Tpl", face_embedding=embedding_to_bytes(_axis(0.0)))
+        User.objects.create(unique_id="other", name="Other", face_embedding=embedding_to_bytes(_axis(2.0)))
+        url = "/api/authentication/users/tpl/templates/"
+        probe = {"face_embedding": _axis(0.5).tolist()}
+        self.assertEqual(self.client.post("/api/authentication/authenticate/", probe, format="json").status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {"face_embedding": _axis(0.55).tolist()}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()["templates"], 2)
+        response = self.client.post("/api/authentication/authenticate/", probe, format="json")
+        self.assertEqual(response.json()["unique_id"], "tpl")
+
+        for embedding in (_axis(1.3), _axis(1.9)):  # too far from tpl; another member's face
+            response = self.client.post(url, {"face_embedding": embedding.tolist()}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(FACE_MAX_TEMPLATES=2):
+            response = self.client.post(url, {"face_embedding": _axis(0.1).tolist()}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post("/api/authentication/users/nobody/templates/", probe,
+                                          format="json").status_code, status.HTTP_404_NOT_FOUND)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(url)
+        self.assertEqual(response.json()["deleted"], 1)
+        self.assertEqual(self.client.post("/api/authentication/authenticate/", probe, format="json").status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(FACE_CHANGE_POLL_INTERVAL=0)
+    def test_templates_reach_other_galleries(self):
+        other = FaceGallery()
+        other.ensure_loaded()
+        user = User.objects.create(unique_id="tpl", name="Tpl", face_embedding=embedding_to_bytes(_axis(0.0)))
+        FaceTemplate.objects.create(user=user, face_embedding=embedding_to_bytes(_axis(1.0)))
+        self.assertEqual(other.best_match(_axis(1.0)), (user.pk, 0.0))
+        fresh = FaceGallery()
+        self.assertEqual(fresh.best_match(_axis(1.0)), (user.pk, 0.0))
+        self.assertEqual(fresh._count, 2)
+        user.delete()
+        self.assertEqual(other.best_match(_axis(1.0)), (None, float("inf")))
+
+
+class SharedFaceGalleryTests(TestCase):
+    """Two SharedFaceGallery instances stand in for two worker processes mapping one file."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "gallery.bin")
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(scale=0.1, size=(20, 128)).astype(np.float32)
+        for i, vector in enumerate(self.vectors):
+            User.objects.create(unique_id=f"s{i}", name=f"S{i}", face_embedding=embedding_to_bytes(vector))
+        self.pks = list(User.objects.order_by("pk").values_list("pk", flat=True))
+
+    def test_workers_share_the_file_built_from_the_database(self):
+        first, second = SharedFaceGallery(self.path), SharedFaceGallery(self.path)
+        first.ensure_loaded()
+        self.assertTrue(os.path.exists(self.path))
+        self.assertEqual(second.best_match(self.vectors[3])[0], self.pks[3])
+        self.assertFalse(second._matrix.flags.writeable)
+        self.assertEqual(len(second), 20)
+        self.assertEqual(first.generation, second.generation)
+
+    def test_changes_reach_other_workers_without_reload(self):
+        first, second = SharedFaceGallery(self.path), SharedFaceGallery(self.path)
+        first.ensure_loaded()
+        second.ensure_loaded()
+        mapping = second._file
+        first.add(999, np.ones(128))
+        first.remove(self.pks[0])
+        self.assertEqual(second.best_match(np.ones(128))[0], 999)
+        self.assertNotEqual(second.best_match(self.vectors[0])[0], self.pks[0])
+        self.assertIs(second._file, mapping)
+        self.assertEqual(len(second), 20)
+        self.assertEqual(first.generation, second.generation)
+
+    def test_member_templates_share_the_file(self):
+        first, second = SharedFaceGallery(self.path), SharedFaceGallery(self.path)
+        first.ensure_loaded()
+        second.ensure_loaded()
+        first.add(999, [np.ones(128), -np.ones(128)])
+        self.assertEqual(second.best_match(-np.ones(128))[0], 999)
+        first.add(999, np.ones(128))
+        self.assertNotEqual(second.best_match(-np.ones(128))[0], 999)
+        self.assertEqual(len(second), 21)
+        first.remove(999)
+        self.assertNotEqual(second.best_match(np.ones(128))[0], 999)
+
+    def test_compaction_remaps_other_workers(self):
+        first, second = SharedFaceGallery(self.path), SharedFaceGallery(self.path)
+        first.ensure_loaded()
+        second.ensure_loaded()
+        mapping = second._file
+        for pk in self.pks[:11]:
+            first.remove(pk)
+        self.assertEqual(first._count, 9)
+        self.assertEqual(second.best_match(self.vectors[15])[0], self.pks[15])
+        self.assertIsNot(second._file, mapping)
+        self.assertEqual(len(second), 9)
+
+    def test_invalidate_rebuilds_from_database(self):
+        gallery = SharedFaceGallery(self.path)
+        gallery.ensure_loaded()
+        User.objects.filter(pk=self.pks[1]).update(embedding_model="other")
+        gallery.invalidate()
+        gallery.ensure_loaded()
+        self.assertEqual(len(gallery), 19)
+
+
+@override_settings(FACE_CHANGE_POLL_INTERVAL=0)
+class ChangeFeedTests(TestCase):
+    """Separate gallery/index instances stand in for other worker processes following the feed."""
+
+    def test_other_gallery_applies_changes_without_reload(self):
+        other = FaceGallery()
+        other.ensure_loaded()
+        generation = other.generation.split(":")[0]
+        user = User.objects.create(unique_id="feed", name="Feed", face_embedding=embedding_to_bytes(np.ones(128)))
+        self.assertEqual(other.best_match(np.ones(128))[0], user.pk)
+        user.delete()
+        self.assertEqual(other.best_match(np.ones(128)), (None, float("inf")))
+        self.assertEqual(other.generation.split(":")[0], generation)
+
+    def test_other_hash_index_applies_changes(self):
+        other = HashIndex()
+        other.ensure_loaded()
+        user = User.objects.create(unique_id="feed", name="Feed", image_hash="00000000000000ff")
+        self.assertEqual(other.nearest("00000000000000fe", 2), (user.pk, 1))
+        user.delete()
+        self.assertEqual(other.nearest("00000000000000fe", 2), (None, None))
+
+    def test_poll_revisits_ids_of_uncommitted_changes(self):
+        feed = DatabaseChangeFeed()
+        cursor = feed.latest()
+        feed.publish([1, 2, 3])
+        first, skipped, last = GalleryChange.objects.order_by("id")
+        skipped.delete()  # as if its transaction had not committed yet
+        cursor, user_ids = feed.poll(cursor)
+        self.assertEqual(user_ids, [1, 3])
+        GalleryChange.objects.create(id=skipped.id, user_id=2)
+        self.assertEqual(feed.poll(cursor)[1], [2])
+
+
+def _fake_decode_tagged_image(base64_string, max_side=None):
+    """Decode "img:<n>" to a uniform image of value n, so encodings can be derived from pixels."""
+    if base64_string.startswith("img:"):
+        return np.full((10, 10, 3), int(base64_string[4:]), dtype=np.uint8)
+    return None
+
+
+def _encoding_from_pixels(img, known_face_locations=None):
+    return [np.full(128, img[0, 0, 0] / 100.0)]
+
+
+def _phash_from_pixels(img):
+    return f"hash{img[0, 0, 0]}"
+
+
+@patch("authentication.enrollment.image_phash", _phash_from_pixels)
+@patch("authentication.engine.face_recognition.face_encodings", _encoding_from_pixels)
+@patch("authentication.engine.face_recognition.face_locations", lambda img, **kwargs: [(1, 9, 9, 1)])
+class RegisterBatchAPITests(FreshStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.batch_url = "/api/authentication/register/batch/"
+
+    @patch("authentication.views.decode_base64_image", _fake_decode_tagged_image)
+    @patch("authentication.enrollment.decode_base64_image", _fake_decode_tagged_image)
+    def test_batch_reports_per_item_results(self):
+        User.objects.create(
+            unique_id="old", name="Old", face_embedding=embedding_to_bytes(np.full(128, 0.5)), image_hash="hold"
+        )
+        users = [
+            {"unique_id": "u1", "name": "One", "face_image": "img:10"},
+            {"unique_id": "u2", "name": "Two", "face_image": "img:10"},
+            {"unique_id": "u3", "name": "Three", "face_image": "img:12"},
+            {"unique_id": "u4", "name": "Four", "face_image": "img:90"},
+            {"unique_id": "u5", "face_image": "img:70"},
+            {"unique_id": "u6", "name": "Six", "face_image": "img:52"},
+            {"unique_id": "old", "name": "Again", "face_image": "img:30"},
+            {"unique_id": "u8", "name": "Eight", "face_image": "bad"},
+        ]
+        response = self.client.post(self.batch_url, {"users": users}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data["registered"], 2)
+        self.assertEqual(data["rejected"], 6)
+        results = {r["unique_id"]: r for r in data["results"] if r["unique_id"] != "old"}
+        self.assertEqual(results["u1"]["status"], 201)
+        self.assertEqual(results["u4"]["status"], 201)
+        self.assertIn("exact image", results["u2"]["message"])
+        self.assertIn("earlier in the batch", results["u3"]["message"])
+        self.assertIn("required", results["u5"]["message"])
+        self.assertIn("unique_id: old", results["u6"]["message"])
+        self.assertAlmostEqual(results["u6"]["distance"], 0.02 * np.sqrt(128), places=3)
+        self.assertIn("already exists", data["results"][6]["message"])
+        self.assertIn("Invalid image", results["u8"]["message"])
+        self.assertEqual(set(User.objects.values_list("unique_id", flat=True)), {"old", "u1", "u4"})
+
+        # The gallery picked up the bulk-created members.
+        response = self.client.post("/api/authentication/authenticate/", {"face_image": "img:90"}, format="json")
+        self.assertEqual(response.json().get("unique_id"), "u4")
+
+    @patch("authentication.enrollment.decode_base64_image", _fake_decode_tagged_image)
+    def test_batch_validates_each_item(self):
+        users = [
+            {"unique_id": ["u1"], "name": "One", "face_image": "img:10"},
+            {"unique_id": "u2", "name": "x" * 101, "face_image": "img:50"},
+            {"unique_id": "u3", "name": "Three", "face_image": "img:90"},
+        ]
+        response = self.client.post(self.batch_url, {"users": users}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()["results"]
+        self.assertEqual([r["status"] for r in results], [400, 400, 201])
+        self.assertIn("unique_id:", results[0]["message"])
+        self.assertIn("name:", results[1]["message"])
+        self.assertEqual(list(User.objects.values_list("unique_id", flat=True)), ["u3"])
+
+    def test_batch_ignores_raw_image_bytes_from_clients(self):
+        users = [{"unique_id": "raw", "name": "Raw", "image_bytes": "10"}]
+        with patch("authentication.enrollment.decode_image_bytes") as decode:
+            response = self.client.post(self.batch_url, {"users": users}, format="json")
+        decode.assert_not_called()
+        self.assertIn("required", response.json()["results"][0]["message"])
+        self.assertFalse(User.objects.exists())
+
+    @patch("authentication.enrollment.decode_base64_image", _fake_decode_tagged_image)
+    def test_batch_rejects_near_identical_images_within_batch(self):
+        users = [
+            {"unique_id": "u1", "name": "One", "face_image": "img:10"},
+            {"unique_id": "u2", "name": "Two", "face_image": "img:90"},
+        ]
+        # Different faces whose image hashes differ in one bit.
+        with patch("authentication.enrollment.image_phash", lambda img: f"{int(img[0, 0, 0] > 50):016x}"):
+            response = self.client.post(self.batch_url, {"users": users}, format="json")
+        results = response.json()["results"]
+        self.assertEqual(results[0]["status"], 201)
+        self.assertEqual(results[1]["status"], 400)
+        self.assertIn("near-identical image appears earlier in the batch (unique_id: u1)", results[1]["message"])
+        self.assertEqual(results[1]["hash_distance"], 1)
+
+    def test_batch_rejects_bad_payload(self):
+        response = self.client.post(self.batch_url, {"users": []}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with patch("authentication.views.BATCH_MAX_SIZE", 1):
+            users = [{"unique_id": "a"}, {"unique_id": "b"}]
+            response = self.client.post(self.batch_url, {"users": users}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch("authentication.enrollment.decode_image_bytes",
+           lambda data, max_side=None: np.full((10, 10, 3), int(data), dtype=np.uint8))
+    def test_bulk_register_command_reads_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name, value in [("alice.jpg", b"10"), ("bob.jpg", b"90"), ("notes.txt", b"x")]:
+                with open(os.path.join(directory, name), "wb") as f:
+                    f.write(value)
+            call_command("bulk_register", directory, stdout=open(os.devnull, "w"))
+        self.assertEqual(set(User.objects.values_list("unique_id", flat=True)), {"alice", "bob"})
+
+
+@patch("authentication.engine.face_recognition.face_encodings", _encoding_from_pixels)
+@patch("authentication.engine.face_recognition.face_locations", lambda img, **kwargs: [(1, 9, 9, 1)])
+class AuthenticateBatchAPITests(FreshStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.batch_url = "/api/authentication/authenticate/batch/"
+
+    @patch("authentication.identification.decode_base64_image", _fake_decode_tagged_image)
+    def test_batch_authenticates_each_image(self):
+        User.objects.create(unique_id="a", name="A", face_embedding=embedding_to_bytes(np.full(128, 0.1)))
+        User.objects.create(unique_id="b", name="B", face_embedding=embedding_to_bytes(np.full(128, 0.5)))
+        response = self.client.post(
+            self.batch_url, {"face_images": ["img:51", "img:10", "img:90", "bad"]}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data["matched"], 2)
+        results = data["results"]
+        self.assertEqual([r["status"] for r in results], [200, 200, 401, 400])
+        self.assertEqual(results[0]["unique_id"], "b")
+        self.assertAlmostEqual(results[0]["distance"], 0.01 * np.sqrt(128), places=3)
+        self.assertEqual(results[1]["unique_id"], "a")
+        self.assertAlmostEqual(results[2]["distance"], 0.4 * np.sqrt(128), places=3)
+        self.assertIn("decode_ms", results[0]["timing"])
+        self.assertIn("encode_ms", results[0]["timing"])
+        self.assertIn("Invalid image", results[3]["message"])
+
+    def test_batch_requires_list_of_images(self):
+        response = self.client.post(self.batch_url, {"face_images": "img:1"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DeleteUserAPITests(FreshStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
         self.client = APIClient()
 
     def test_delete_existing_user_returns_200(self):
         user = User.objects.create(
             unique_id="del1",
             name="To Delete",
-            face_embedding=str(_mock_face_encoding().tolist()),
+            face_embedding=embedding_to_bytes(_mock_face_encoding()),
             image_hash="hash_del1",
         )
         url = f"/api/authentication/delete/{user.unique_id}/"
@@ -267,8 +1140,9 @@ class DeleteUserAPITests(TestCase):
         self.assertIn("User not found.", response.json().get("message", ""))
 
 
-class ListUsersAPITests(TestCase):
+class ListUsersAPITests(FreshStateMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.client = APIClient()
         self.list_url = "/api/authentication/users/"
 
@@ -281,13 +1155,13 @@ class ListUsersAPITests(TestCase):
         User.objects.create(
             unique_id="u1",
             name="User One",
-            face_embedding=str(_mock_face_encoding().tolist()),
+            face_embedding=embedding_to_bytes(_mock_face_encoding()),
             image_hash="h1",
         )
         User.objects.create(
             unique_id="u2",
             name="User Two",
-            face_embedding=str(_mock_face_encoding().tolist()),
+            face_embedding=embedding_to_bytes(_mock_face_encoding()),
             image_hash="h2",
         )
         response = self.client.get(self.list_url)
@@ -304,3 +1178,239 @@ class ListUsersAPITests(TestCase):
         names = {u["name"] for u in data["users"]}
         self.assertEqual(unique_ids, {"u1", "u2"})
         self.assertEqual(names, {"User One", "User Two"})
+
+    def _create_users(self, count):
+        User.objects.bulk_create(
+            User(unique_id=f"p{i:03d}", name=f"Person {i}", face_embedding=embedding_to_bytes(_mock_face_encoding()))
+            for i in range(count)
+        )
+
+    def test_cursor_pagination_walks_all_users(self):
+        self._create_users(25)
+        seen, url = [], f"{self.list_url}?limit=10"
+        while url:
+            data = self.client.get(url).json()
+            self.assertLessEqual(len(data["users"]), 10)
+            seen.extend(u["unique_id"] for u in data["users"])
+            url = data["next"]
+        self.assertEqual(seen, [f"p{i:03d}" for i in range(25)])
+
+    def test_filters(self):
+        self._create_users(12)
+        response = self.client.get(self.list_url, {"unique_id_prefix": "p01"})
+        self.assertEqual([u["unique_id"] for u in response.json()["users"]], ["p010", "p011"])
+        response = self.client.get(self.list_url, {"name": "PERSON 3"})
+        self.assertEqual(response.json()["users"], [{"unique_id": "p003", "name": "Person 3"}])
+
+    @patch("authentication.listing.EXPORT_BATCH_SIZE", 4)
+    def test_streaming_exports(self):
+        self._create_users(10)
+        response = self.client.get(self.list_url, {"export": "ndjson"})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)["unique_id"] for line in lines], [f"p{i:03d}" for i in range(10)])
+        response = self.client.get(self.list_url, {"export": "json"})
+        exported = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(exported, self.client.get(self.list_url).json())
+        response = self.client.get(self.list_url, {"export": "xml"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(FACE_ASYNC_VIEWS=True)
+    async def test_export_streams_asynchronously_under_asgi(self):
+        await User.objects.acreate(unique_id="a1", name="Async One")
+        response = await self.async_client.get(self.list_url, {"export": "ndjson"})
+        self.assertTrue(response.is_async)
+        body = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(json.loads(body), {"unique_id": "a1", "name": "Async One"})
+
+
+class IVFIndexTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        centers = rng.normal(size=(20, 128))
+        self.vectors = (centers[rng.integers(0, 20, 2000)] + rng.normal(scale=0.05, size=(2000, 128))).astype(np.float32)
+        User.objects.bulk_create([
+            User(unique_id=f"ivf{i}", name=f"IVF {i}", face_embedding=embedding_to_bytes(v))
+            for i, v in enumerate(self.vectors)
+        ])
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "index.npz")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _gallery(self):
+        return FaceGallery(index_factory=lambda: IVFIndex(nlist=20, nprobe=3, min_train_size=500, path=self.path))
+
+    def test_ivf_search_agrees_with_exact_search(self):
+        gallery = self._gallery()
+        for i in range(0, 2000, 97):
+            probe = self.vectors[i] + 0.001
+            ivf_ids, ivf_dist = gallery.search(probe)
+            exact_ids, exact_dist = gallery.search(probe, exact=True)
+            self.assertEqual(ivf_ids[0], exact_ids[0])
+            self.assertAlmostEqual(float(ivf_dist[0]), float(exact_dist[0]), places=5)
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_ivf_index_reloads_from_disk_and_indexes_new_members(self):
+        self._gallery().ensure_loaded()
+        gallery = self._gallery()
+        gallery.ensure_loaded()
+        np.testing.assert_equal(gallery._index._centroids.shape, (20, 128))
+        new_vector = self.vectors[0] * -1
+        gallery.add(999999, new_vector)
+        self.assertEqual(gallery.best_match(new_vector)[0], 999999)
+
+    def test_small_gallery_falls_back_to_exact_scan(self):
+        index = IVFIndex(min_train_size=10**6)
+        index.reset(np.arange(3), self.vectors[:3])
+        self.assertFalse(index.trained)
+        self.assertIsNone(index.candidates(self.vectors[0], 3))
+
+    def test_index_trains_in_background_when_gallery_grows(self):
+        ids = np.arange(len(self.vectors))
+        index = IVFIndex(nlist=20, nprobe=3, min_train_size=500)
+        index.reset(ids[:499], self.vectors[:499])
+        release = threading.Event()
+
+        def blocked_kmeans(vectors, nlist):
+            release.wait(5)
+            return train_kmeans(vectors, nlist)
+
+        with patch("authentication.index.train_kmeans", blocked_kmeans):
+            for pos in range(499, 510):
+                index.add(ids[:pos + 1], self.vectors[:pos + 1], pos)
+            # add() returned without training; searches stay exact until the swap.
+            self.assertIsNone(index.candidates(self.vectors[0], 510))
+            trainer = index._trainer
+            release.set()
+            trainer.join(5)
+        self.assertTrue(index.approximate)
+        np.testing.assert_array_equal(index._assign[:510], nearest_centroids(self.vectors[:510], index._centroids))
+        self.assertIn(509, index.candidates(self.vectors[509], 510))
+
+
+class AsyncViewTests(FreshStateMixin, TransactionTestCase):
+    """The ASGI register/ and authenticate/ views behave like the sync ones."""
+
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+
+    async def _post(self, view, payload):
+        request = self.factory.post("/", payload, content_type="application/json")
+        return await view.as_view()(request)
+
+    @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
+    @patch("authentication.views.image_phash")
+    async def test_register_then_authenticate(self, mock_phash, mock_face_locations, mock_face_encodings):
+        mock_phash.return_value = "async1"
+        mock_face_locations.return_value = [(10, 20, 30, 10)]
+        mock_face_encodings.return_value = [_mock_face_encoding()]
+        payload = {"unique_id": "async", "name": "Async", "face_image": VALID_IMAGE_B64_PLACEHOLDER}
+        response = await self._post(AsyncRegisterUser, payload)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = await self._post(AsyncRegisterUser, payload)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = await self._post(AsyncAuthenticateUser, {"face_image": VALID_IMAGE_B64_PLACEHOLDER})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)["unique_id"], "async")
+
+    @override_settings(FACE_UPLOAD_MAX_BYTES=10)
+    async def test_oversized_upload_returns_413(self):
+        request = self.factory.post("/", b"x" * 100, content_type="application/octet-stream")
+        response = await AsyncAuthenticateUser.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+
+class ReadinessTests(FreshStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.addCleanup(setattr, warmup, "_models_loaded", False)
+
+    @patch("authentication.warmup.threading.Thread")
+    def test_not_ready_starts_warm_up(self, mock_thread):
+        response = self.client.get("/api/authentication/ready/")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn("gallery", response.data["waiting_for"])
+        mock_thread.return_value.start.assert_called_once()
+        warmup._warming.release()
+
+    @patch("authentication.warmup.load_models")
+    def test_ready_after_warm_up(self, mock_load_models):
+        User.objects.create(unique_id="warm", name="Warm", face_embedding=embedding_to_bytes(_mock_face_encoding()),
+                            image_hash="ffffffffffffffff")
+        warmup.warm_up()
+        mock_load_models.assert_called_once()
+        response = self.client.get("/api/authentication/ready/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"ready": True, "gallery_size": 1})
+
+
+class EncodingEngineTests(TestCase):
+    @patch("authentication.views.decode_base64_image", _fake_decode_base64_image)
+    def test_engine_at_capacity_returns_503(self):
+        busy = EncodingEngine(max_pending=1, queue_timeout=0.01)
+        busy._slots.acquire()
+        with patch("authentication.views.get_engine", return_value=busy):
+            response = APIClient().post(
+                "/api/authentication/authenticate/", {"face_image": VALID_IMAGE_B64_PLACEHOLDER}, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn("retry", response.json()["message"])
+
+    def test_cancelled_queued_encode_gives_its_slot_back(self):
+        engine = EncodingEngine(workers=1, max_pending=1, queue_timeout=5)
+        engine._slots.acquire()
+
+        async def cancel_while_queued():
+            task = asyncio.ensure_future(engine.encode_async(np.zeros((10, 10, 3), dtype=np.uint8)))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            engine._slots.release()  # the queued acquire now takes the slot and hands it back
+            await asyncio.sleep(0.05)
+
+        asyncio.run(cancel_while_queued())
+        self.assertTrue(engine._slots.acquire(timeout=1))
+
+    @patch("authentication.engine.face_recognition.face_encodings")
+    @patch("authentication.engine.face_recognition.face_locations")
+    def test_detects_on_downscaled_copy_and_encodes_face_crop(self, mock_face_locations, mock_face_encodings):
+        mock_face_locations.return_value = [(50, 150, 150, 50)]
+        mock_face_encodings.return_value = [_mock_face_encoding()]
+        img = np.zeros((1000, 2000, 3), dtype=np.uint8)
+        encode_face(img, max_side=500)
+        small = mock_face_locations.call_args[0][0]
+        self.assertEqual(small.shape[:2], (250, 500))
+        crop, locations = mock_face_encodings.call_args[0]
+        # Box (200, 600, 600, 200) at full resolution, cropped with a 50% margin.
+        self.assertEqual(crop.shape[:2], (800, 800))
+        self.assertEqual(locations, [(200, 600, 600, 200)])
+
+    def test_detection_scale_honours_all_bounds(self):
+        self.assertEqual(detection_scale((1000, 2000), max_side=4000), 1.0)
+        self.assertEqual(detection_scale((1000, 2000), max_side=1000), 0.5)
+        self.assertEqual(detection_scale((1000, 2000), max_side=1000, max_height=250), 0.25)
+        self.assertEqual(detection_scale((1000, 2000), max_width=200), 0.1)
+
+    def test_image_size_limit_is_enforced(self):
+        payload = {"face_image": "A" * 4000, "image_size_limit": 2}
+        response = APIClient().post("/api/authentication/authenticate/", payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("image_size_limit", response.json()["message"])
+
+    def test_worker_process_encodes_and_reports_missing_face(self):
+        engine = EncodingEngine(workers=1, timeout=120).start()
+        try:
+            with self.assertRaisesMessage(FaceImageError, "No face found"):
+                engine.encode(np.zeros((100, 100, 3), dtype=np.uint8))
+            with self.assertRaisesMessage(FaceImageError, "No face found"):
+                asyncio.run(engine.encode_async(np.zeros((100, 100, 3), dtype=np.uint8)))
+        finally:
+            engine.shutdown()
@@ -0,0 +1,92 @@
+"""
+Binary image uploads for register/ and authenticate/.
+
+Besides base64 inside JSON, ``face_image`` may arrive as a multipart file part or
+as the whole body of an ``application/octet-stream`` request (other fields then
+go in the query string). Both are size-limited while streaming, before anything
+is decoded, and handed to OpenCV straight from the upload buffer.
+"""
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import BaseParser
+
+# Growth step of the buffer for a body without a declared Content-Length.
+_GROW_BYTES = 1024 * 1024
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "Image upload is too large."
+    default_code = "upload_too_large"
+
+    def __init__(self):
+        super().__init__(f"Image upload exceeds {settings.FACE_UPLOAD_MAX_BYTES} bytes.")
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    """Abort a multipart upload as soon as any file part exceeds FACE_UPLOAD_MAX_BYTES."""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.FACE_UPLOAD_MAX_BYTES:
+            raise UploadTooLarge()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+class ImageUploadParser(BaseParser):
+    """
+    Parse a raw ``application/octet-stream`` body as ``face_image``, merged with
+    the query parameters. A body with a declared Content-Length is read into one
+    buffer of exactly that size; an undeclared (chunked) body grows its buffer in
+    bounded steps and is rejected as soon as it passes FACE_UPLOAD_MAX_BYTES.
+    """
+
+    media_type = 'application/octet-stream'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        limit = settings.FACE_UPLOAD_MAX_BYTES
+        try:
+            declared = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            declared = 0
+        if declared > limit:
+            raise UploadTooLarge()
+
+        buffer = bytearray(declared or min(64 * 1024, limit + 1))
+        size = 0
+        while stream is not None and (not declared or size < declared):
+            if size == len(buffer):
+                buffer.extend(bytes(min(_GROW_BYTES, limit + 1 - size)))
+            chunk = stream.read(len(buffer) - size)
+            if not chunk:
+                break
+            if size + len(chunk) > limit:
+                raise UploadTooLarge()
+            buffer[size:size + len(chunk)] = chunk
+            size += len(chunk)
+
+        data = request.query_params.dict()
+        data['face_image'] = memoryview(buffer)[:size]
+        return data
+
+
+def image_buffer(value):
+    """Bytes-like view of an uploaded image without copying when it is held in memory."""
+    if isinstance(value, UploadedFile):
+        raw = getattr(value.file, 'getbuffer', None)
+        if raw is not None:
+            return raw()
+        value.seek(0)
+        return value.read()
+    return value
@@ -1,9 +1,25 @@
+from django.conf import settings
 from django.urls import path
-from .views import RegisterUser, AuthenticateUser, DeleteUser, ListUsers
+from django.views.decorators.csrf import csrf_exempt
+from .views import (AsyncAuthenticateUser, AsyncRegisterUser, AuthenticateUser, AuthenticateUserBatch, DeleteUser,
+                    ListUsers, MemberTemplates, Readiness, RegisterUser, RegisterUserBatch, SearchFaces)
+
+# Under ASGI the single-image endpoints are served by async views (see asgi.py).
+if settings.FACE_ASYNC_VIEWS:
+    register_view = csrf_exempt(AsyncRegisterUser.as_view())
+    authenticate_view = csrf_exempt(AsyncAuthenticateUser.as_view())
+else:
+    register_view = RegisterUser.as_view()
+    authenticate_view = AuthenticateUser.as_view()
 
 urlpatterns = [
-    path('register/', RegisterUser.as_view(), name='register'),
-    path('authenticate/', AuthenticateUser.as_view(), name='authenticate'),
+    path('register/', register_view, name='register'),
+    path('register/batch/', RegisterUserBatch.as_view(), name='register_batch'),
+    path('authenticate/', authenticate_view, name='authenticate'),
+    path('authenticate/batch/', AuthenticateUserBatch.as_view(), name='authenticate_batch'),
+    path('search/', SearchFaces.as_view(), name='search'),
     path('delete/<str:unique_id>/', DeleteUser.as_view(), name='delete_user'),
     path('users/', ListUsers.as_view(), name='list_users'),
+    path('users/<str:unique_id>/templates/', MemberTemplates.as_view(), name='member_templates'),
+    path('ready/', Readiness.as_view(), name='ready'),
 ]
\ No newline at end of file
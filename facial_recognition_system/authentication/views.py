@@ -1,127 +1,453 @@
-import base64
-import numpy as np
-import cv2
-import face_recognition
-from PIL import Image
-import imagehash
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.views import View
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.request import Request
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .models import User
-from .serializers import UserSerializer
+from .models import FaceTemplate, User, embedding_to_bytes
+from .serializers import SearchSerializer, UserSerializer
+from .engine import EngineUnavailable, FaceImageError, get_engine
+from .faces import (FACE_MATCH_TOLERANCE, decode_base64_image, decode_image_bytes, exceeds_size_limit, find_face_match,
+                    find_similar_image, image_phash, verify_face)
+from .uploads import ImageUploadParser, image_buffer
+from .enrollment import register_batch
+from .gallery import get_gallery
+from .metrics import stage
+from .listing import EXPORT_FORMATS, UserCursorPagination, export_chunks, filter_users
+from .probe_cache import get_probe, probe_key, remember_encoding, set_probe
+from .identification import authenticate_batch
+from .warmup import is_ready, pending
 from django.db import IntegrityError
 
-# Face match threshold: same person if distance <= this. Tune (e.g. 0.35–0.45) if needed.
-FACE_MATCH_TOLERANCE = 0.4
+# Maximum number of users/images accepted by one register/batch/ or authenticate/batch/ request.
+BATCH_MAX_SIZE = 500
 
-# Helper function to decode base64 image to numpy array
-def decode_base64_image(base64_string):
-    try:
-        img_data = base64.b64decode(base64_string)
-        np_arr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        return img
-    except Exception:
+# The fields of one register/batch/ item; anything else (such as register_batch's raw image_bytes) is dropped.
+BATCH_USER_FIELDS = ('unique_id', 'name', 'face_image')
+
+# face_image as base64 JSON, a multipart file part, or a raw application/octet-stream body.
+IMAGE_PARSERS = [JSONParser, MultiPartParser, FormParser, ImageUploadParser]
+
+
+def _encode_options(serializer, img):
+    """
+    Encoding-engine options from the request: image_width/image_height bound the
+    detection resolution, and face_box/face_cropped let the client skip detection.
+    """
+    data = serializer.validated_data
+    face_location = None
+    if data.get('face_cropped'):
+        face_location = (0, img.shape[1], img.shape[0], 0)
+    elif data.get('face_box'):
+        face_location = tuple(data['face_box'])
+    return {
+        "max_width": data.get('image_width'),
+        "max_height": data.get('image_height'),
+        "face_location": face_location,
+    }
+
+
+def _decode_request_image(request, serializer):
+    """
+    Return (img, None) for the request's face_image, or (None, error Response).
+
+    Uploaded files and raw bodies are decoded straight from the upload buffer;
+    strings are base64.
+    """
+    face_image = request.data.get('face_image')
+    if not face_image:
+        return None, Response({"message": "face_image (or face_embedding) is required."}, status=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(face_image, str):
+        face_image = image_buffer(face_image)
+    if exceeds_size_limit(face_image, serializer.validated_data.get('image_size_limit')):
+        return None, Response({"message": "Image exceeds image_size_limit."}, status=status.HTTP_400_BAD_REQUEST)
+    # A client face_box is in full-resolution pixels, so those images are decoded at full size.
+    max_side = None if serializer.validated_data.get('face_box') else settings.FACE_DECODE_MAX_SIDE
+    if isinstance(face_image, str):
+        img = decode_base64_image(face_image, max_side)
+    else:
+        img = decode_image_bytes(face_image, max_side)
+    if img is None:
+        return None, Response({"message": "Invalid image data."}, status=status.HTTP_400_BAD_REQUEST)
+    return img, None
+
+
+def _probe_cache_key(request, serializer):
+    """Probe-cache key for the request's face_image and encoding options, or None."""
+    face_image = request.data.get('face_image')
+    if not face_image:
         return None
+    if not isinstance(face_image, str):
+        face_image = image_buffer(face_image)
+    options = {field: serializer.validated_data.get(field) for field in UserSerializer.REQUEST_FIELDS}
+    return probe_key(face_image, options)
+
+
+def _encode_image(serializer, img):
+    """Return (face encoding, None) for ``img``, or (None, error Response)."""
+    try:
+        with stage("encode"):
+            return get_engine().encode(img, **_encode_options(serializer, img)), None
+    except FaceImageError as e:
+        return None, Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except EngineUnavailable as e:
+        return None, Response({"message": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+async def _encode_image_async(serializer, img):
+    """Awaitable ``_encode_image`` for the async views."""
+    try:
+        with stage("encode"):
+            return await get_engine().encode_async(img, **_encode_options(serializer, img)), None
+    except FaceImageError as e:
+        return None, Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except EngineUnavailable as e:
+        return None, Response({"message": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+# The register/ and authenticate/ views are split into steps so the sync (WSGI) and async (ASGI)
+# views run the same logic: steps that touch the database run via sync_to_async, CPU-bound steps
+# on a worker thread, and encoding is awaited on the encoding engine.
+
+def _validate(data):
+    """Return (valid serializer, None), or (None, error Response)."""
+    serializer = UserSerializer(data=data)
+    if serializer.is_valid():
+        return serializer, None
+    return None, Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+def _hash_image(img):
+    """Return (perceptual hash, None) for ``img``, or (None, error Response)."""
+    try:
+        with stage("phash"):
+            return image_phash(img), None
+    except Exception as e:
+        return None, Response({"message": f"Error generating image hash: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _duplicate_image_response(image_hash):
+    """Error Response if this image, or a near-identical copy, is already registered; otherwise None."""
+    # Check if exact same image already exists (fast database lookup)
+    with stage("db_read"):
+        existing_user = User.objects.filter(image_hash=image_hash).first()
+    if existing_user:
+        return Response({
+            "message": f"This exact image is already registered for user ID: {existing_user.unique_id} (Name: {existing_user.name}). Please use a different photograph."
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    # Re-saved or lightly edited copies differ in a few hash bits (Hamming index lookup)
+    similar_user, bits = find_similar_image(image_hash)
+    if similar_user:
+        return Response({
+            "message": f"A near-identical image is already registered for user ID: {similar_user.unique_id} (Name: {similar_user.name}). Please use a different photograph.",
+            "hash_distance": bits
+        }, status=status.HTTP_400_BAD_REQUEST)
+    return None
+
+
+def _save_registration(serializer, face_encoding, image_hash):
+    """Save the user unless this face is already registered under another member ID."""
+    duplicate, distance = find_face_match(face_encoding)
+    if duplicate:
+        return Response({
+            "message": f"This face is already registered with another member (unique_id: {duplicate.unique_id}, name: {duplicate.name}). One person cannot be registered under multiple member IDs.",
+            "distance": round(distance, 4)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    # Save compact float32 bytes with image hash
+    with stage("db_write"):
+        serializer.save(face_embedding=embedding_to_bytes(face_encoding), image_hash=image_hash)
+    return Response({"message": "User registered successfully."}, status=status.HTTP_201_CREATED)
+
+
+def _register_error(exc):
+    if isinstance(exc, IntegrityError):
+        return Response({"message": "A user with this username already exists. Please choose a different username."}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({"message": f"Server error: {str(exc)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 class RegisterUser(APIView):
+    parser_classes = IMAGE_PARSERS
+
     def post(self, request, *args, **kwargs):
+        # Parse outside the catch-all below so oversized uploads and malformed bodies keep their 4xx status.
+        data = request.data
         try:
-            serializer = UserSerializer(data=request.data)
-            if serializer.is_valid():
-                face_image_b64 = request.data.get('face_image')
-                if not face_image_b64:
-                    return Response({"message": "face_image is required."}, status=status.HTTP_400_BAD_REQUEST)
-                img = decode_base64_image(face_image_b64)
-                if img is None:
-                    return Response({"message": "Invalid image data."}, status=status.HTTP_400_BAD_REQUEST)
-                
-                # Generate image hash for duplicate detection (fast O(1) lookup)
-                try:
-                    img_pil = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-                    image_hash = str(imagehash.phash(img_pil))
-                except Exception as e:
-                    return Response({"message": f"Error generating image hash: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                
-                # Check if exact same image already exists (fast database lookup)
-                existing_user = User.objects.filter(image_hash=image_hash).first()
-                if existing_user:
-                    return Response({
-                        "message": f"This exact image is already registered for user ID: {existing_user.unique_id} (Name: {existing_user.name}). Please use a different photograph."
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                
-                face_locations = face_recognition.face_locations(img)
-                if not face_locations:
-                    return Response({"message": "No face found in the image."}, status=status.HTTP_400_BAD_REQUEST)
-                face_encodings = face_recognition.face_encodings(img, face_locations)
-                if not face_encodings:
-                    return Response({"message": "Could not extract face encoding."}, status=status.HTTP_400_BAD_REQUEST)
-                face_encoding = face_encodings[0].tolist()  # Convert numpy array to list for storage
-                face_encoding_np = np.array(face_encoding)
-
-                # Reject if this face is already registered under another member ID
-                for user in User.objects.exclude(face_embedding=""):
-                    try:
-                        stored_encoding = np.array(eval(user.face_embedding))
-                        distance = face_recognition.face_distance([stored_encoding], face_encoding_np)[0]
-                        if distance <= FACE_MATCH_TOLERANCE:
-                            return Response({
-                                "message": f"This face is already registered with another member (unique_id: {user.unique_id}, name: {user.name}). One person cannot be registered under multiple member IDs."
-                            }, status=status.HTTP_400_BAD_REQUEST)
-                    except (ValueError, SyntaxError):
-                        continue
-
-                # Save with image hash
-                serializer.save(face_embedding=face_encoding, image_hash=image_hash)
-                return Response({"message": "User registered successfully."}, status=status.HTTP_201_CREATED)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        except IntegrityError:
-            return Response({"message": "A user with this username already exists. Please choose a different username."}, status=status.HTTP_400_BAD_REQUEST)
+            serializer, error = _validate(data)
+            if error:
+                return error
+            # Edge devices may send the embedding itself; otherwise compute it from face_image.
+            face_encoding = serializer.validated_data.get('face_embedding')
+            image_hash = None
+            if face_encoding is None:
+                img, error = _decode_request_image(request, serializer)
+                if error:
+                    return error
+                image_hash, error = _hash_image(img)
+                if error:
+                    return error
+                error = _duplicate_image_response(image_hash)
+                if error:
+                    return error
+                face_encoding, error = _encode_image(serializer, img)
+                if error:
+                    return error
+            return _save_registration(serializer, face_encoding, image_hash)
+        except Exception as e:
+            return _register_error(e)
+
+
+class RegisterUserBatch(APIView):
+    def post(self, request, *args, **kwargs):
+        items = request.data.get('users') if hasattr(request.data, 'get') else None
+        if not isinstance(items, list) or not items:
+            return Response({"message": "users must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > BATCH_MAX_SIZE:
+            return Response({"message": f"At most {BATCH_MAX_SIZE} users per batch."}, status=status.HTTP_400_BAD_REQUEST)
+        if not all(isinstance(item, dict) for item in items):
+            return Response({"message": "Each user must be an object."}, status=status.HTTP_400_BAD_REQUEST)
+        items = [{field: item[field] for field in BATCH_USER_FIELDS if field in item} for item in items]
+        try:
+            results = register_batch(items)
+        except EngineUnavailable as e:
+            return Response({"message": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
             return Response({"message": f"Server error: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        registered = sum(1 for r in results if r["status"] == status.HTTP_201_CREATED)
+        return Response({
+            "registered": registered,
+            "rejected": len(results) - registered,
+            "results": results
+        }, status=status.HTTP_200_OK)
+
+
+def _cached_probe(request, serializer, identify=True):
+    """
+    Look the request's image up in the probe cache. Returns (cache key, encoding, Response):
+    a Response when the cached match is still valid, only the encoding when the
+    gallery changed since, and neither on a miss. Verification (``identify=False``)
+    only reuses the encoding and leaves the gallery alone.
+    """
+    if identify:
+        gallery = get_gallery()
+        gallery.ensure_loaded()
+    with stage("probe_cache"):
+        cache_key = _probe_cache_key(request, serializer)
+        cached = get_probe(cache_key)
+    if not cached:
+        return cache_key, None, None
+    face_encoding, user_id, distance, generation = cached
+    if identify and generation == gallery.generation:
+        if user_id is None:
+            return cache_key, face_encoding, _match_response(None)
+        user = User.objects.filter(pk=user_id).first()
+        if user is not None:
+            return cache_key, face_encoding, _match_response(user)
+    return cache_key, face_encoding, None
+
+
+def _match_response(user):
+    if user:
+        return Response({
+            "message": "Authentication successful.",
+            "name": user.name,
+            "unique_id": user.unique_id
+        }, status=status.HTTP_200_OK)
+    return Response({"message": "Authentication failed. No matching user found."}, status=status.HTTP_401_UNAUTHORIZED)
+
+
+def _search(face_encoding, cache_key=None):
+    """Match ``face_encoding`` against the gallery, remember the result for retries, and build the Response."""
+    gallery = get_gallery()
+    gallery.ensure_loaded()
+    generation = gallery.generation
+    # Find the best match with one batched distance computation over the in-memory gallery
+    best_match, best_distance = find_face_match(face_encoding)
+    set_probe(cache_key, face_encoding, best_match.pk if best_match else None, best_distance, generation)
+    return _match_response(best_match)
+
+
+def _verify(face_encoding, unique_id, cache_key=None):
+    """Compare ``face_encoding`` with the member claiming ``unique_id`` only (1:1 verification)."""
+    user, distance = verify_face(unique_id, face_encoding)
+    # Cached for its encoding only: a match against one member says nothing about the 1:N search.
+    remember_encoding(cache_key, face_encoding)
+    if user:
+        return _match_response(user)
+    return Response({"message": "Authentication failed. Face does not match this member."},
+                    status=status.HTTP_401_UNAUTHORIZED)
 
 
 class AuthenticateUser(APIView):
+    """
+    Identify the face among all members (1:N), or with ``unique_id`` verify it
+    against that member only (1:1).
+    """
+    parser_classes = IMAGE_PARSERS
+
     def post(self, request, *args, **kwargs):
-        serializer = UserSerializer(data=request.data)
-        if serializer.is_valid():
-            face_image_b64 = request.data.get('face_image')
-            if not face_image_b64:
-                return Response({"message": "face_image is required."}, status=status.HTTP_400_BAD_REQUEST)
-            img = decode_base64_image(face_image_b64)
-            if img is None:
-                return Response({"message": "Invalid image data."}, status=status.HTTP_400_BAD_REQUEST)
-            face_locations = face_recognition.face_locations(img)
-            if not face_locations:
-                return Response({"message": "No face found in the image."}, status=status.HTTP_400_BAD_REQUEST)
-            face_encodings = face_recognition.face_encodings(img, face_locations)
-            if not face_encodings:
-                return Response({"message": "Could not extract face encoding."}, status=status.HTTP_400_BAD_REQUEST)
-            face_encoding = face_encodings[0]
-            
-            # Find the best match instead of returning the first match
-            users = User.objects.exclude(face_embedding="")
-            best_match = None
-            best_distance = float('inf')
-
-            for user in users:
-                stored_encoding = np.array(eval(user.face_embedding))
-                face_distance = face_recognition.face_distance([stored_encoding], face_encoding)[0]
-                if face_distance <= FACE_MATCH_TOLERANCE and face_distance < best_distance:
-                    best_match = user
-                    best_distance = face_distance
-            
-            if best_match:
-                return Response({
-                    "message": "Authentication successful.", 
-                    "name": best_match.name, 
-                    "unique_id": best_match.unique_id
-                }, status=status.HTTP_200_OK)
-            else:
-                return Response({"message": "Authentication failed. No matching user found."}, status=status.HTTP_401_UNAUTHORIZED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        serializer, error = _validate(request.data)
+        if error:
+            return error
+        face_encoding = serializer.validated_data.get('face_embedding')
+        unique_id = serializer.validated_data.get('unique_id')
+        cache_key = None
+        if face_encoding is None:
+            # A retry of an identical image reuses its encoding, and its match while the gallery is unchanged.
+            cache_key, face_encoding, response = _cached_probe(request, serializer, identify=not unique_id)
+            if response:
+                return response
+            if face_encoding is None:
+                img, error = _decode_request_image(request, serializer)
+                if error:
+                    return error
+                face_encoding, error = _encode_image(serializer, img)
+                if error:
+                    return error
+        if unique_id:
+            return _verify(face_encoding, unique_id, cache_key)
+        return _search(face_encoding, cache_key)
+
+
+def _top_matches(face_encoding, k, exact=False):
+    """Response listing the ``k`` nearest members with their distances."""
+    with stage("gallery_search"):
+        match_ids, match_dist = get_gallery().search(face_encoding, k=k, exact=exact)
+    with stage("db_read"):
+        users = User.objects.only('id', 'unique_id', 'name').in_bulk([int(u) for u in match_ids])
+    results = [
+        {"unique_id": users[int(u)].unique_id, "name": users[int(u)].name, "distance": round(float(d), 4),
+         "match": bool(d <= FACE_MATCH_TOLERANCE)}
+        for u, d in zip(match_ids, match_dist) if int(u) in users
+    ]
+    return Response({"tolerance": FACE_MATCH_TOLERANCE, "results": results}, status=status.HTTP_200_OK)
+
+
+class SearchFaces(APIView):
+    """
+    The ``k`` nearest members to a face with their distances, whether or not
+    they are within FACE_MATCH_TOLERANCE: for auditing matches and tuning it.
+    """
+    parser_classes = IMAGE_PARSERS
+
+    def post(self, request, *args, **kwargs):
+        serializer, error = _validate(request.data)
+        if error:
+            return error
+        options = SearchSerializer(data={field: request.data[field] for field in ('k', 'exact') if field in request.data})
+        if not options.is_valid():
+            return Response(options.errors, status=status.HTTP_400_BAD_REQUEST)
+        face_encoding = serializer.validated_data.get('face_embedding')
+        cache_key = None
+        if face_encoding is None:
+            cache_key, face_encoding, _ = _cached_probe(request, serializer, identify=False)
+            if face_encoding is None:
+                img, error = _decode_request_image(request, serializer)
+                if error:
+                    return error
+                face_encoding, error = _encode_image(serializer, img)
+                if error:
+                    return error
+                remember_encoding(cache_key, face_encoding)
+        return _top_matches(face_encoding, options.validated_data['k'], options.validated_data['exact'])
+
+
+class AuthenticateUserBatch(APIView):
+    def post(self, request, *args, **kwargs):
+        face_images = request.data.get('face_images') if hasattr(request.data, 'get') else None
+        if not isinstance(face_images, list) or not face_images:
+            return Response({"message": "face_images must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(face_images) > BATCH_MAX_SIZE:
+            return Response({"message": f"At most {BATCH_MAX_SIZE} images per batch."}, status=status.HTTP_400_BAD_REQUEST)
+        if not all(isinstance(image, str) for image in face_images):
+            return Response({"message": "Each face image must be a base64 string."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            results, search_ms = authenticate_batch(face_images)
+        except EngineUnavailable as e:
+            return Response({"message": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except Exception as e:
+            return Response({"message": f"Server error: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({
+            "matched": sum(1 for r in results if r["status"] == status.HTTP_200_OK),
+            "search_ms": search_ms,
+            "results": results
+        }, status=status.HTTP_200_OK)
+
+
+def _save_template(user, face_encoding):
+    """Add ``face_encoding`` as a template of ``user`` unless it is too far from the member's face or is someone else's."""
+    templates = 1 + user.templates.count()
+    if templates >= settings.FACE_MAX_TEMPLATES:
+        return Response({
+            "message": f"This member already has {templates} face templates (at most {settings.FACE_MAX_TEMPLATES})."
+        }, status=status.HTTP_400_BAD_REQUEST)
+    gallery = get_gallery()
+    with stage("gallery_search"):
+        own_distance = gallery.member_distance(user.pk, face_encoding, aggregation="min")
+        match_ids, match_dist = gallery.search(face_encoding, k=2)
+    if own_distance > settings.FACE_TEMPLATE_MAX_DISTANCE:
+        return Response({
+            "message": "This face does not match the member's registered face.",
+            "distance": round(own_distance, 4)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    others = [(int(u), float(d)) for u, d in zip(match_ids, match_dist) if u != user.pk and d <= FACE_MATCH_TOLERANCE]
+    if others:
+        other = User.objects.filter(pk=others[0][0]).first()
+        if other:
+            return Response({
+                "message": f"This face is already registered with another member (unique_id: {other.unique_id}, name: {other.name}).",
+                "distance": round(others[0][1], 4)
+            }, status=status.HTTP_400_BAD_REQUEST)
+    with stage("db_write"):
+        FaceTemplate.objects.create(user=user, face_embedding=embedding_to_bytes(face_encoding))
+    return Response({"message": "Face template added.", "templates": templates + 1}, status=status.HTTP_201_CREATED)
+
+
+class MemberTemplates(APIView):
+    """
+    Extra face templates of a member, matched alongside the registered face:
+    POST adds one (face_image or face_embedding), DELETE removes them all.
+    """
+    parser_classes = IMAGE_PARSERS
+
+    def post(self, request, unique_id, *args, **kwargs):
+        user = User.objects.filter(unique_id=unique_id).first()
+        if user is None:
+            return Response({"message": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+        serializer, error = _validate(request.data)
+        if error:
+            return error
+        face_encoding = serializer.validated_data.get('face_embedding')
+        if face_encoding is None:
+            img, error = _decode_request_image(request, serializer)
+            if error:
+                return error
+            face_encoding, error = _encode_image(serializer, img)
+            if error:
+                return error
+        return _save_template(user, face_encoding)
+
+    def delete(self, request, unique_id, *args, **kwargs):
+        user = User.objects.filter(unique_id=unique_id).first()
+        if user is None:
+            return Response({"message": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+        deleted, _ = user.templates.all().delete()
+        return Response({"message": "Face templates deleted.", "deleted": deleted}, status=status.HTTP_200_OK)
+
+
+class Readiness(APIView):
+    """200 once models, gallery and encoding workers are loaded; 503 (and warming in the background) before."""
+
+    def get(self, request, *args, **kwargs):
+        if is_ready():
+            return Response({"ready": True, "gallery_size": len(get_gallery())}, status=status.HTTP_200_OK)
+        return Response({"ready": False, "waiting_for": pending()}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
 
 class DeleteUser(APIView):
@@ -136,7 +462,102 @@ class DeleteUser(APIView):
 
 
 class ListUsers(APIView):
+    """
+    unique_id and name of registered users, optionally filtered by ``name`` and
+    ``unique_id_prefix``. ``limit``/``cursor`` return one page with next/previous
+    links; ``export=json`` or ``export=ndjson`` streams the full listing.
+    """
+
     def get(self, request, *args, **kwargs):
-        users = User.objects.all()
-        data = [{"unique_id": u.unique_id, "name": u.name} for u in users]
+        users = filter_users(request.query_params)
+        export = request.query_params.get('export')
+        if export is not None:
+            if export not in EXPORT_FORMATS:
+                return Response({"message": f"export must be one of: {', '.join(EXPORT_FORMATS)}."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            content_type = 'application/x-ndjson' if export == 'ndjson' else 'application/json'
+            return StreamingHttpResponse(export_chunks(users, export), content_type=content_type)
+
+        if 'limit' in request.query_params or 'cursor' in request.query_params:
+            paginator = UserCursorPagination()
+            page = paginator.paginate_queryset(users.values('id', 'unique_id', 'name'), request, view=self)
+            return paginator.get_paginated_response([{"unique_id": u["unique_id"], "name": u["name"]} for u in page])
+
+        data = list(users.order_by('id').values('unique_id', 'name'))
         return Response({"users": data}, status=status.HTTP_200_OK)
+
+
+def _cpu(func):
+    """Run a CPU-bound step on a worker thread so it does not block the event loop."""
+    return sync_to_async(func, thread_sensitive=False)
+
+
+class AsyncImageView(View):
+    """
+    Base for the async register/ and authenticate/ views served under ASGI.
+
+    The request body is parsed with the same DRF parsers as the sync views, and
+    ``handle()`` returns the same DRF Responses, sent back as JSON.
+    """
+
+    http_method_names = ['post']
+
+    async def post(self, request, *args, **kwargs):
+        request = Request(request, parsers=[parser() for parser in IMAGE_PARSERS])
+        try:
+            await sync_to_async(lambda: request.data)()
+        except APIException as exc:
+            return JsonResponse({"detail": exc.detail}, status=exc.status_code)
+        response = await self.handle(request)
+        return JsonResponse(response.data, status=response.status_code, safe=False)
+
+
+class AsyncRegisterUser(AsyncImageView):
+    async def handle(self, request):
+        try:
+            serializer, error = await sync_to_async(_validate)(request.data)
+            if error:
+                return error
+            face_encoding = serializer.validated_data.get('face_embedding')
+            image_hash = None
+            if face_encoding is None:
+                img, error = await _cpu(_decode_request_image)(request, serializer)
+                if error:
+                    return error
+                image_hash, error = await _cpu(_hash_image)(img)
+                if error:
+                    return error
+                error = await sync_to_async(_duplicate_image_response)(image_hash)
+                if error:
+                    return error
+                face_encoding, error = await _encode_image_async(serializer, img)
+                if error:
+                    return error
+            return await sync_to_async(_save_registration)(serializer, face_encoding, image_hash)
+        except Exception as e:
+            return _register_error(e)
+
+
+class AsyncAuthenticateUser(AsyncImageView):
+    async def handle(self, request):
+        serializer, error = await sync_to_async(_validate)(request.data)
+        if error:
+            return error
+        face_encoding = serializer.validated_data.get('face_embedding')
+        unique_id = serializer.validated_data.get('unique_id')
+        cache_key = None
+        if face_encoding is None:
+            cache_key, face_encoding, response = await sync_to_async(_cached_probe)(
+                request, serializer, identify=not unique_id)
+            if response:
+                return response
+            if face_encoding is None:
+                img, error = await _cpu(_decode_request_image)(request, serializer)
+                if error:
+                    return error
+                face_encoding, error = await _encode_image_async(serializer, img)
+                if error:
+                    return error
+        if unique_id:
+            return await sync_to_async(_verify)(face_encoding, unique_id, cache_key)
+        return await sync_to_async(_search)(face_encoding, cache_key)
@@ -0,0 +1,73 @@
+"""
+Start-up warm-up and readiness.
+
+Everything the first request would otherwise load lazily — the embedding
+gallery (and its search index), the image-hash index and, when encoding
+inline, the dlib models — is loaded by ``warm_up()``. The production server
+(gunicorn.conf.py) calls it in the master process before forking, so workers
+share the gallery and indexes copy-on-write. Each worker then brings up its
+own encoding pool with ``warm_engine()``, whose spawned processes load the
+models once each. ``is_ready()`` backs the readiness endpoint.
+"""
+import logging
+import threading
+
+from .engine import get_engine, load_models
+from .gallery import get_gallery
+from .hash_index import get_hash_index
+
+logger = logging.getLogger(__name__)
+
+_models_loaded = False
+_warming = threading.Lock()
+
+
+def warm_up():
+    """Load the gallery, the image-hash index and (when encoding inline) the dlib models in this process."""
+    global _models_loaded
+    if not _models_loaded and get_engine().workers <= 0:
+        load_models()
+        _models_loaded = True
+    if not get_gallery().loaded:
+        # A full load: with a shared gallery file this rebuilds it from the database.
+        get_gallery().load()
+    get_hash_index().ensure_loaded()
+    logger.info("Warm: %d faces in gallery", len(get_gallery()))
+
+
+def warm_engine():
+    """Start this process's encoding pool and wait for every worker to load the models."""
+    get_engine().warm_up()
+
+
+def pending():
+    """Names of the components that are not warm yet (empty when ready)."""
+    waiting = []
+    if not _models_loaded and get_engine().workers <= 0:
+        waiting.append("models")
+    if not get_engine().warm:
+        waiting.append("engine")
+    if not get_gallery().loaded:
+        waiting.append("gallery")
+    if not get_hash_index().loaded:
+        waiting.append("hash_index")
+    return waiting
+
+
+def _warm_all():
+    try:
+        warm_up()
+        warm_engine()
+    except Exception:
+        logger.exception("Warm-up failed")
+    finally:
+        _warming.release()
+
+
+def is_ready():
+    """True when no request would pay for lazy loading; otherwise starts warming in the background."""
+    if not pending():
+        return True
+    if _warming.acquire(blocking=False):
+        threading.Thread(target=_warm_all, name="face-warm-up", daemon=True).start()
+    return False
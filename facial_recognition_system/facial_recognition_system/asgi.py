@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'facial_recognition_system.settings')
+# register/ and authenticate/ await face work instead of blocking the event loop.
+os.environ.setdefault('FACE_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -51,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'authentication.metrics.StageTimingMiddleware',
 ]
 
 ROOT_URLCONF = 'facial_recognition_system.urls'
@@ -126,3 +128,86 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CORS_ALLOW_ALL_ORIGINS = True
+
+
+# Face gallery search
+# 'exact' scores every member; 'ivf' is an approximate inverted-file index for very large galleries.
+FACE_INDEX_BACKEND = os.environ.get('FACE_INDEX_BACKEND', 'exact')
+# IVF: number of k-means lists, and how many of them each search scans (higher = better recall, slower).
+FACE_INDEX_NLIST = int(os.environ.get('FACE_INDEX_NLIST', 1024))
+FACE_INDEX_NPROBE = int(os.environ.get('FACE_INDEX_NPROBE', 16))
+# IVF falls back to exact search until the gallery has at least this many members.
+FACE_INDEX_MIN_TRAIN_SIZE = int(os.environ.get('FACE_INDEX_MIN_TRAIN_SIZE', 10000))
+# Trained centroids and bucket assignments are persisted here.
+FACE_INDEX_PATH = os.environ.get('FACE_INDEX_PATH', str(BASE_DIR / 'face_index.npz'))
+# Keep the gallery in this memory-mapped file, shared by all worker processes on the host
+# (local filesystem, Linux/macOS); empty keeps a private in-memory gallery per process.
+FACE_GALLERY_FILE = os.environ.get('FACE_GALLERY_FILE', '')
+# A member can have up to FACE_MAX_TEMPLATES face embeddings: the registered one plus templates
+# added through users/<unique_id>/templates/ (other lighting, pose, glasses). Each must be within
+# FACE_TEMPLATE_MAX_DISTANCE of one the member already has. Searches score a member by its nearest
+# template ('min'), the mean distance to its templates ('mean') or the distance to their centroid ('centroid').
+FACE_MAX_TEMPLATES = int(os.environ.get('FACE_MAX_TEMPLATES', 5))
+FACE_TEMPLATE_MAX_DISTANCE = float(os.environ.get('FACE_TEMPLATE_MAX_DISTANCE', 0.6))
+FACE_TEMPLATE_AGGREGATION = os.environ.get('FACE_TEMPLATE_AGGREGATION', 'min')
+# Registrations and deletions are published to this change feed; every process polls it at most
+# every FACE_CHANGE_POLL_INTERVAL seconds and applies just the changed users. Changes are kept for
+# FACE_CHANGE_RETENTION seconds; a process idle for half that reloads instead. Empty disables the feed.
+FACE_CHANGE_FEED = os.environ.get('FACE_CHANGE_FEED', 'authentication.changes.DatabaseChangeFeed')
+FACE_CHANGE_POLL_INTERVAL = float(os.environ.get('FACE_CHANGE_POLL_INTERVAL', 1.0))
+FACE_CHANGE_RETENTION = int(os.environ.get('FACE_CHANGE_RETENTION', 24 * 3600))
+
+# Face pipeline
+# Worker processes for face detection/encoding; 0 runs inline in the request thread.
+FACE_ENGINE_WORKERS = int(os.environ.get('FACE_ENGINE_WORKERS', 0))
+# Images queued or in progress before new requests wait, and how long they wait (seconds) before a 503.
+FACE_ENGINE_MAX_PENDING = int(os.environ.get('FACE_ENGINE_MAX_PENDING', 64))
+FACE_ENGINE_QUEUE_TIMEOUT = float(os.environ.get('FACE_ENGINE_QUEUE_TIMEOUT', 2.0))
+# Maximum seconds to wait for one encoding.
+FACE_ENGINE_TIMEOUT = float(os.environ.get('FACE_ENGINE_TIMEOUT', 30.0))
+# JPEGs are decoded at 1/2, 1/4 or 1/8 scale when their longest side stays at or above this (0 = always full size).
+FACE_DECODE_MAX_SIDE = int(os.environ.get('FACE_DECODE_MAX_SIDE', 1280))
+# Faces are detected on a copy shrunk to this longest side (0 = full resolution), upsampled this many times.
+FACE_DETECT_MAX_SIDE = int(os.environ.get('FACE_DETECT_MAX_SIDE', 640))
+FACE_DETECT_UPSAMPLE = int(os.environ.get('FACE_DETECT_UPSAMPLE', 1))
+# Serve register/ and authenticate/ with async views (set by asgi.py; the WSGI entry point keeps the sync views).
+FACE_ASYNC_VIEWS = os.environ.get('FACE_ASYNC_VIEWS', '0') == '1'
+# Worker threads used to decode images in batch requests.
+FACE_BATCH_WORKERS = int(os.environ.get('FACE_BATCH_WORKERS', os.cpu_count() or 1))
+# Largest raw image accepted by register/ and authenticate/ as a multipart file or
+# application/octet-stream body; enforced while the upload streams in.
+FACE_UPLOAD_MAX_BYTES = int(os.environ.get('FACE_UPLOAD_MAX_BYTES', 10 * 1024 * 1024))
+FILE_UPLOAD_HANDLERS = [
+    'authentication.uploads.LimitedUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Registration rejects an image whose perceptual hash is within this many bits (of 64) of a stored one;
+# 0 only rejects identical hashes.
+FACE_HASH_MAX_DISTANCE = int(os.environ.get('FACE_HASH_MAX_DISTANCE', 6))
+
+# Probe cache: authenticate/ retries with an identical image reuse its encoding (and its match,
+# while the gallery is unchanged) for FACE_PROBE_CACHE_TTL seconds; 0 disables the cache. It is
+# per-process memory unless FACE_PROBE_CACHE_DIR is set (e.g. under /dev/shm) to share it
+# between worker processes.
+FACE_PROBE_CACHE_TTL = int(os.environ.get('FACE_PROBE_CACHE_TTL', 300))
+FACE_PROBE_CACHE_DIR = os.environ.get('FACE_PROBE_CACHE_DIR', '')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'face_probes': {
+        'BACKEND': ('django.core.cache.backends.filebased.FileBasedCache' if FACE_PROBE_CACHE_DIR
+                    else 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': FACE_PROBE_CACHE_DIR or 'face-probes',
+        'TIMEOUT': FACE_PROBE_CACHE_TTL,
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('FACE_PROBE_CACHE_SIZE', 10000))},
+    },
+}
+
+# Metrics: /metrics serves per-stage latency histograms in the Prometheus text format. With several
+# server processes, point FACE_METRICS_DIR at a directory they share so /metrics reports all of them.
+# FACE_SERVER_TIMING=1 also adds a Server-Timing header with the stage timings to every response.
+FACE_METRICS_DIR = os.environ.get('FACE_METRICS_DIR', '')
+FACE_SERVER_TIMING = os.environ.get('FACE_SERVER_TIMING', '0') == '1'
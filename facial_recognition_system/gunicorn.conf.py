@@ -0,0 +1,46 @@
+"""
+Production server: gunicorn managing uvicorn (ASGI) workers.
+
+    gunicorn -c facial_recognition_system/gunicorn.conf.py
+
+The app is imported in the master (``preload_app``) and ``when_ready`` loads
+the gallery, its search index and the image-hash index there before any worker
+is forked, so every worker starts warm and shares those pages copy-on-write.
+The dlib models are not shared: with the default ``FACE_ENGINE_WORKERS`` of at
+least 1, each worker starts its own encoding pool in ``post_fork``, and every
+engine process is spawned (not forked, since the worker already runs threads)
+and loads its own copy of the models. ``/api/authentication/ready/`` answers
+200 once the pool is up.
+"""
+import multiprocessing
+import os
+import threading
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+wsgi_app = "facial_recognition_system.asgi:application"
+worker_class = "uvicorn_worker.UvicornWorker"
+bind = os.environ.get("BIND", "0.0.0.0:8053")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+accesslog = "-"
+
+# Encoding processes per web worker: together they cover every core.
+os.environ.setdefault("FACE_ENGINE_WORKERS", str(max(1, multiprocessing.cpu_count() // workers)))
+
+
+def when_ready(server):
+    from django.db import connections
+
+    from authentication.warmup import warm_up
+
+    warm_up()
+    # Workers must not share the master's database connections.
+    connections.close_all()
+
+
+def post_fork(server, worker):
+    from authentication.warmup import warm_engine
+
+    threading.Thread(target=warm_engine, name="face-engine-warm-up", daemon=True).start()